@@ -1,7 +1,37 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+
+from fastapi import Body, FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from backend import config
 from backend.firewall_manager import FirewallManager
 from backend.firewall_domain import router as domain_router
+from backend.fleet import fleet, router as fleet_router
+from backend.audit import RequestContextMiddleware, audit_log
+from backend.blocklist import get_set_backend
+from backend.cidr_aggregate import cidr_aggregator
+from backend.coalescer import coalescer
+from backend.conditional import if_none_match, make_etag, not_modified
+from backend.domain_index import domain_index
+from backend.domain_sync import domain_sync
+from backend.events import event_stream, events
+from backend.helper_client import helper
+from backend.hosts_file import hosts_file
+from backend.jobs import executor, job_response, jobs
+from backend.metrics import MetricsMiddleware, metrics
+from backend.policy import apply_policy, current_policy, parse_policy
+from backend.port_ranges import apply_bulk_ports, parse_bulk_request
+from backend.rule_eval import rule_evaluator
+from backend.rule_state import rule_state
+from backend.schedules import create_schedule, scheduler
+from backend.snapshots import snapshot_store
+from backend.traffic_stats import traffic_stats
+from backend.ufw_batch import RuleBatch, resolve_service
+from backend.ufw_log import ufw_log
+
+logger = logging.getLogger(__name__)
 
 # Initialize FastAPI once
 app = FastAPI(title="AI Firewall Backend - Kali Integration")
@@ -18,7 +48,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing"],
 )
+app.add_middleware(RequestContextMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 
 
@@ -27,28 +60,185 @@ fw = FirewallManager()
 
 # Include the domain blocking routes
 app.include_router(domain_router)
+# Fleet mode (fan-out to other backends)
+app.include_router(fleet_router)
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    events.bind(asyncio.get_running_loop())
+    rule_state.start()
+    ufw_log.start()
+    if config.SYNC_ENABLED:
+        domain_sync.start()
+    if config.SCHEDULE_ENABLED:
+        scheduler.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    rule_state.stop()
+    ufw_log.stop()
+    await domain_sync.stop()
+    await scheduler.stop()
+    await fleet.stop()
+    audit_log.stop()
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Request latency, subprocess, helper, DNS and hosts file timings (Prometheus text format)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 # ------------------------
 # Core Firewall Endpoints
 # ------------------------
 
 @app.get("/api/firewall/status")
-def get_status():
-    """Return current UFW rules"""
-    return {"rules": fw.service_status()}
+def get_status(request: Request, response: Response, raw: bool = False,
+               refresh: bool = False, since: int = None):
+    """
+    Return current UFW rules as parsed JSON (served from memory)
+    ?raw=true also includes the `ufw status numbered` text
+    ?refresh=true forces a re-read from UFW
+    ?since=<generation> returns only the rules added / removed after it
+    (a full listing with "reset": true if that generation is no longer known)
+    Carries an ETag; If-None-Match gets 304 without re-reading UFW. The full
+    listing is encoded once per generation and served as those bytes.
+    """
+    snapshot = rule_state.refresh() if refresh else rule_state.snapshot()
+    etag = make_etag("rules", snapshot.generation, "raw" if raw else "",
+                     "" if since is None else f"since{since}")
+    if if_none_match(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    if since is not None:
+        changes = None
+        if since <= snapshot.generation:
+            changes = rule_state.changes_since(since, snapshot.generation)
+        if changes is not None:
+            return {"generation": snapshot.generation, "since": since,
+                    "active": snapshot.active, **changes}
+        return {**snapshot.to_dict(include_raw=raw), "since": since, "reset": True}
+    return Response(snapshot.to_json(include_raw=raw), media_type="application/json",
+                    headers={"ETag": etag})
+
+
+@app.get("/api/firewall/policy")
+def get_policy():
+    """Current services, ports and domains in the shape PUT /policy accepts"""
+    return current_policy(rule_state.snapshot())
+
+
+@app.put("/api/firewall/policy")
+async def put_policy(policy: dict = Body(...), dry_run: bool = False, refresh: bool = False,
+                     wait: bool = False):
+    """
+    Apply a complete desired policy with the minimal set of rule changes
+    Sections that are present replace the current state; missing sections are left alone.
+    ?dry_run=true only returns the plan, ?refresh=true re-reads UFW before diffing
+    Runs as a job on the whole ruleset (202 + job id, or ?wait=true for the result)
+    """
+    try:
+        parse_policy(policy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if dry_run:
+        return await apply_policy(policy, dry_run=True, refresh=refresh)
+    job = executor.submit("policy", apply_policy, policy, refresh=refresh,
+                          resources=[executor.GLOBAL])
+    return await job_response(job, wait)
+
+
+@app.post("/api/firewall/evaluate")
+def evaluate_flows(body: dict = Body(...)):
+    """
+    Which rule decides a flow, and with what verdict
+    Body: one flow {"direction": "in", "src": "1.2.3.4", "dst": "10.0.0.5",
+    "port": 22, "proto": "tcp"} or {"flows": [...]} for a batch.
+    Flows without a matching rule get the UFW default policy.
+    """
+    flows = body.get("flows") if "flows" in body else [body]
+    if not isinstance(flows, list):
+        raise HTTPException(status_code=400, detail="flows must be a list")
+    try:
+        result = rule_evaluator.evaluate(flows)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "flows" in body:
+        return {**result, "index": rule_evaluator.stats()}
+    flow = result["results"][0]
+    rule = result["rules"].get(flow["rule"])
+    return {"generation": result["generation"], "active": result["active"],
+            "verdict": flow["verdict"], "default": flow["default"], "rule": rule}
+
+
+@app.post("/api/firewall/emergency-stop/undo")
+async def undo_emergency_stop(wait: bool = False):
+    """
+    Restore the snapshot taken by the most recent emergency stop
+    Registered before /api/firewall/{service}/{action}, which would match it too
+    """
+    snapshot = snapshot_store.latest(reason="emergency_stop")
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="No emergency stop to undo")
+    job = executor.submit("snapshot_restore", snapshot_store.restore, snapshot["id"],
+                          resources=[executor.GLOBAL], params={"snapshot": snapshot["id"]})
+    return await job_response(job, wait)
+
+
+def port_resource(port, proto) -> str:
+    """Lock key shared by services and ports that map to the same rules"""
+    return f"port:{port}/{proto}"
+
+
+def toggle_service_job(service: str, action: str) -> dict:
+    batch = RuleBatch() if config.BATCH_MODE else None
+    result = fw.toggle_service(service, action, batch=batch)
+    rule_state.invalidate()
+    response = {"service": service, "action": action, "result": result}
+    if batch is not None:
+        response["batch"] = batch.stats()
+    return response
 
 
 @app.post("/api/firewall/{service}/{action}")
-def control_service(service: str, action: str):
+async def control_service(service: str, action: str, wait: bool = False, ttl: float = None):
     """
     Example: /api/firewall/http/on  or  /api/firewall/https/off
+    Runs as a job (202 + job id, or ?wait=true for the result); rapid
+    toggles of the same service collapse into one applied final state
+    ?ttl=<seconds> applies it as a schedule that restores the previous state afterwards
     """
-    result = fw.toggle_service(service, action)
-    return {"service": service, "action": action, "result": result}
+    error = fw.check_service_toggle(service, action)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    if ttl is not None:
+        return await create_schedule({"name": f"{service} {action} for {ttl:g}s",
+                                      "action": action, "services": [service],
+                                      "duration": ttl}, wait)
+    try:
+        port, proto = resolve_service(service.lower().strip())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = coalescer.submit(("service", service.lower().strip()), action,
+                           "service_toggle", toggle_service_job, service, action,
+                           resources=[port_resource(port, proto)],
+                           params={"service": service, "action": action})
+    return await job_response(job, wait)
+
+
+def toggle_port_job(port: int, action: str) -> dict:
+    batch = RuleBatch() if config.BATCH_MODE else None
+    result = fw.toggle_port(port, action, batch=batch)
+    rule_state.invalidate()
+    return result
 
 
 @app.post("/api/firewall/port/{port}/{action}")
-def control_port(port: int, action: str):
+async def control_port(port: int, action: str, wait: bool = False, ttl: float = None):
     """
     Control a specific port (blocks both IN and OUT)
     Example: /api/firewall/port/8080/on  or  /api/firewall/port/22/off
@@ -57,36 +247,278 @@ def control_port(port: int, action: str):
     - Port range (1-65535)
     - Critical ports (22, 8000, 8080 cannot be blocked)
     - Protocol support
+    Runs as a job (202 + job id, or ?wait=true for the result); rapid
+    toggles of the same port collapse into one applied final state
+    ?ttl=<seconds> applies it as a schedule that restores the previous state afterwards
     """
-    result = fw.toggle_port(port, action)
-    
     # Handle validation errors
-    if isinstance(result, dict) and not result.get("success"):
-        from fastapi import HTTPException
-        raise HTTPException(status_code=400, detail=result.get("error"))
+    error, _ = fw.check_port_toggle(port, action)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    if ttl is not None:
+        return await create_schedule({"name": f"port {port} {action} for {ttl:g}s",
+                                      "action": action, "ports": [f"{port}/tcp"],
+                                      "duration": ttl}, wait)
     
-    return result
+    job = coalescer.submit(("port", port, "tcp"), action,
+                           "port_toggle", toggle_port_job, port, action,
+                           resources=[port_resource(port, "tcp")],
+                           params={"port": port, "action": action})
+    return await job_response(job, wait)
 
 
-@app.post("/api/firewall/emergency-stop")
-def emergency_stop():
+@app.post("/api/firewall/ports")
+async def control_ports(body: dict = Body(...), dry_run: bool = False, wait: bool = False):
     """
-    Emergency Stop - Disable ALL firewall rules
-    WARNING: This will reset UFW and allow all traffic!
+    Open or block many ports and ranges at once
+    Body: {"action": "on", "proto": "tcp|udp|both", "ports": [80, "6000-6100", ...]}
+    Every item is validated first (protected ports cannot be blocked);
+    contiguous ports become ufw range rules, applied with one reload.
+    ?dry_run=true only returns the plan. Runs as a job on the whole ruleset.
     """
+    try:
+        parse_bulk_request(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if dry_run:
+        return await apply_bulk_ports(body, dry_run=True)
+    job = executor.submit("ports_bulk", apply_bulk_ports, body, resources=[executor.GLOBAL])
+    return await job_response(job, wait)
+
+
+def emergency_stop_job() -> dict:
+    # Keep the current state so the stop can be undone
+    snapshot = None
+    try:
+        snapshot = snapshot_store.capture(reason="emergency_stop")
+    except Exception as e:
+        logger.error("snapshot before emergency stop failed: %s", e)
     result = fw.reset_firewall()
+    # The reset removed every aggregated deny rule too
+    if cidr_aggregator.enabled:
+        cidr_aggregator.replace({"addresses": [], "networks": []})
     # After reset, re-enable UFW with default deny policy for safety
     fw.run_cmd("sudo ufw --force enable")
     fw.run_cmd("sudo ufw default deny incoming")
     fw.run_cmd("sudo ufw default allow outgoing")
+    # UFW's reset leaves the nftables blocklist sets alone; undo refills them
+    # from the snapshot
+    set_backend = get_set_backend()
+    nft = None
+    if set_backend is not None:
+        try:
+            nft = set_backend.replace([])
+        except Exception as e:
+            logger.error("flushing the nftables blocklist failed: %s", e)
+            nft = {"error": str(e)}
+    rule_state.invalidate()
+    events.publish("emergency_stop", {"result": result,
+                                      "snapshot": snapshot["id"] if snapshot else None})
     
     return {
         "status": "emergency_stop_executed",
         "message": "All firewall rules have been reset. UFW is now in default deny mode.",
-        "result": result
+        "result": result,
+        "nft": nft,
+        "snapshot": snapshot,
+        "undo": "/api/firewall/emergency-stop/undo" if snapshot else None,
     }
 
 
+@app.post("/api/firewall/emergency-stop")
+async def emergency_stop(wait: bool = False):
+    """
+    Emergency Stop - Disable ALL firewall rules
+    WARNING: This will reset UFW and allow all traffic!
+    Snapshots the full state first (undo with /api/firewall/emergency-stop/undo)
+    Waits for running jobs, then runs alone (202 + job id, or ?wait=true)
+    """
+    job = executor.submit("emergency_stop", emergency_stop_job, resources=[executor.GLOBAL])
+    return await job_response(job, wait)
+
+
+@app.get("/api/firewall/snapshots")
+def list_snapshots(reason: str = None):
+    """Saved full-state snapshots, newest first"""
+    return {"snapshots": snapshot_store.list(reason), "keep": snapshot_store.keep}
+
+
+@app.post("/api/firewall/snapshots")
+async def create_snapshot(label: str = None, wait: bool = False):
+    """
+    Save rules, defaults, managed hosts section and domain records
+    Runs alone like other whole-ruleset jobs, so the snapshot is consistent
+    """
+    job = executor.submit("snapshot", snapshot_store.capture, label=label,
+                          resources=[executor.GLOBAL], params={"label": label})
+    return await job_response(job, wait)
+
+
+@app.get("/api/firewall/snapshots/{snapshot_id}")
+def get_snapshot(snapshot_id: str):
+    snapshot = snapshot_store.get(snapshot_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"Unknown snapshot: {snapshot_id}")
+    return snapshot
+
+
+@app.delete("/api/firewall/snapshots/{snapshot_id}")
+def delete_snapshot(snapshot_id: str):
+    if not snapshot_store.delete(snapshot_id):
+        raise HTTPException(status_code=404, detail=f"Unknown snapshot: {snapshot_id}")
+    return {"status": "success", "deleted": snapshot_id}
+
+
+@app.post("/api/firewall/snapshots/{snapshot_id}/restore")
+async def restore_snapshot(snapshot_id: str, wait: bool = False):
+    """
+    Restore a snapshot: rules files are loaded with one reload, the hosts
+    section is rewritten once. Runs alone (202 + job id, or ?wait=true)
+    """
+    if snapshot_store.get(snapshot_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown snapshot: {snapshot_id}")
+    job = executor.submit("snapshot_restore", snapshot_store.restore, snapshot_id,
+                          resources=[executor.GLOBAL], params={"snapshot": snapshot_id})
+    return await job_response(job, wait)
+
+
+@app.get("/api/firewall/schedules")
+def list_schedules(offset: int = 0, limit: int = 100, active: bool = None):
+    """Scheduled rules and TTLs (?active=true for those currently applied)"""
+    return {**scheduler.list(offset=offset, limit=limit, active=active),
+            "scheduler": scheduler.stats()}
+
+
+@app.post("/api/firewall/schedules")
+async def add_schedule(body: dict = Body(...), wait: bool = False):
+    """
+    Schedule port, service or domain rules
+    Body: {"name": "work hours", "action": "block", "domains": [...],
+    "ports": [5432, "6000/udp"], "services": ["ftp"], plus either
+    "window": {"days": "weekdays", "start": "09:00", "end": "17:00"} (server
+    local time) or a one-off "start_at" / "end_at" / "duration" (seconds).
+    A schedule that is due now is applied right away (?wait=true for the result).
+    """
+    return await create_schedule(body, wait)
+
+
+@app.get("/api/firewall/schedules/{schedule_id}")
+def get_schedule(schedule_id: str):
+    schedule = scheduler.get(schedule_id)
+    if schedule is None:
+        raise HTTPException(status_code=404, detail=f"Unknown schedule: {schedule_id}")
+    return schedule
+
+
+@app.delete("/api/firewall/schedules/{schedule_id}")
+async def delete_schedule(schedule_id: str, revert: bool = True, wait: bool = False):
+    """
+    Cancel a schedule; if it is active its targets get their previous state
+    back first (?revert=false keeps the current rules)
+    """
+    try:
+        schedule, job = await scheduler.remove(schedule_id, revert=revert)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown schedule: {schedule_id}")
+    if job is None:
+        return {"status": "deleted", "schedule": schedule}
+    return await job_response(job, wait)
+
+
+@app.get("/api/firewall/jobs")
+def list_jobs(kind: str = None, limit: int = 100):
+    """Most recent jobs first"""
+    recent = sorted(jobs.list(kind), key=lambda job: job.created_at, reverse=True)
+    return {"jobs": [job.to_dict() for job in recent[:limit]], "executor": executor.stats(),
+            "coalescer": coalescer.stats()}
+
+
+@app.get("/api/firewall/history")
+def change_history(limit: int = 100, before: int = None, since: float = None,
+                   until: float = None, kind: str = None, resource: str = None,
+                   outcome: str = None, client: str = None):
+    """
+    Audit log of every change, newest first
+    Filters: since / until (unix time), kind (job kind), resource
+    ("port:8080/tcp", "domain:example.com", or a prefix like "domain:*"),
+    outcome (succeeded / failed), client (IP). Page with ?before=<next_before>.
+    """
+    return {**audit_log.query(limit=limit, before=before, since=since, until=until, kind=kind,
+                              resource=resource, outcome=outcome, client=client),
+            "audit": audit_log.stats()}
+
+
+@app.get("/api/firewall/logs")
+def firewall_logs(limit: int = 100, before: int = None, after: int = None, ip: str = None,
+                  port: int = None, action: str = None, direction: str = None,
+                  proto: str = None):
+    """
+    Packets logged by UFW, newest first
+    Filters: ip (source or destination), port (source or destination),
+    action (block / allow / audit / limit), direction (in / out / fwd), proto.
+    Page back with ?before=<next_before>; follow new entries with
+    ?after=<last_seq> (oldest first).
+    """
+    ufw_log.poll()
+    return {**ufw_log.query(limit=limit, before=before, after=after, ip=ip, port=port,
+                            action=action and action.lower(), direction=direction,
+                            proto=proto and proto.lower()),
+            "log": ufw_log.stats()}
+
+
+@app.get("/api/firewall/stats")
+def traffic_statistics(window: int = 3600, top: int = 10):
+    """
+    Traffic over the last `window` seconds from the UFW log: totals, top
+    blocked source IPs / ports / domains and a per-minute, per-hour or
+    per-day series (finest resolution that covers the window)
+    """
+    ufw_log.poll()
+    return {**traffic_stats.query(window=window, top=top), "stats": traffic_stats.stats()}
+
+
+@app.get("/api/firewall/jobs/{job_id}")
+def job_status(job_id: str):
+    """Status / result of a queued firewall operation"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job.to_dict()
+
+
+def events_snapshot() -> dict:
+    """Initial state for a new event stream"""
+    blocked = domain_index.list(limit=1000)
+    return {
+        "status": rule_state.snapshot().to_dict(include_raw=True),
+        "blocked_domains": blocked["items"],
+        "blocked_total": blocked["total"],
+        "hosts_generation": hosts_file.generation,
+    }
+
+
+@app.get("/api/firewall/events")
+async def stream_events():
+    """
+    Server-Sent Events: a `snapshot` event, then only changes as they are committed
+    (rule_added, rule_removed, status_changed, domain_blocked, domain_unblocked,
+    emergency_stop). A `snapshot` is sent again whenever the client must resync.
+    """
+    queue = events.subscribe()
+    
+    async def snapshot():
+        return await run_in_threadpool(events_snapshot)
+    
+    return StreamingResponse(event_stream(snapshot, queue), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/firewall/helper")
+def helper_status():
+    """Privileged helper connection pool (used instead of sudo when running)"""
+    return helper.stats()
+
+
 # Optional root endpoint
 @app.get("/")
 def root():
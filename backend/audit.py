@@ -0,0 +1,347 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from backend import config
+from backend.domain_index import domain_index
+from backend.jobs import jobs
+from backend.rule_state import rule_state
+
+logger = logging.getLogger(__name__)
+
+# Endpoint and client of the request being handled (set by RequestContextMiddleware)
+current_request = contextvars.ContextVar("current_request", default=None)
+
+# Longest list of rules / domains kept per change in the stored diff
+DIFF_LIMIT = 200
+MAX_PAGE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    started_at REAL,
+    duration REAL,
+    kind TEXT NOT NULL,
+    endpoint TEXT,
+    client TEXT,
+    params TEXT,
+    resources TEXT,
+    diff TEXT,
+    processes INTEGER,
+    outcome TEXT NOT NULL,
+    error TEXT,
+    job_id TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_ts ON changes (ts);
+CREATE INDEX IF NOT EXISTS changes_kind ON changes (kind, id);
+CREATE TABLE IF NOT EXISTS change_resources (
+    resource TEXT NOT NULL,
+    change_id INTEGER NOT NULL,
+    PRIMARY KEY (resource, change_id)
+) WITHOUT ROWID;
+"""
+
+COLUMNS = ("id", "ts", "started_at", "duration", "kind", "endpoint", "client", "params",
+           "resources", "diff", "processes", "outcome", "error", "job_id")
+JSON_COLUMNS = ("params", "resources", "diff")
+
+
+class RequestContextMiddleware:
+    """ASGI middleware recording who called which endpoint, for jobs it starts"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        client = scope.get("client")
+        token = current_request.set({
+            "endpoint": f"{scope['method']} {scope['path']}",
+            "client": client[0] if client else None,
+        })
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request.reset(token)
+
+
+def _truncate(items) -> dict:
+    items = list(items)
+    data = {"count": len(items), "items": items[:DIFF_LIMIT]}
+    if len(items) > DIFF_LIMIT:
+        data["truncated"] = True
+    return data
+
+
+class AuditLog:
+    """
+    Append-only history of every job (all mutations run as jobs) in SQLite.
+    Finished jobs are queued and a background thread writes them in
+    batches, one transaction each, so requests never wait for the disk.
+    The diff of a change is the rules / blocked names that changed between
+    the job's start and its end (jobs running at the same time share it).
+    Both generations are taken from memory when the job starts / finishes;
+    the writer thread never reads `ufw status` itself.
+    Rows are indexed by time, kind and resource; listings page by id
+    (keyset), so they cost the same at any table size.
+    """
+
+    def __init__(self, path=None, enabled=None, batch_size=None, flush_interval=None):
+        self.path = path or config.AUDIT_DB
+        self.enabled = config.AUDIT_ENABLED if enabled is None else enabled
+        self.batch_size = batch_size or config.AUDIT_BATCH_SIZE
+        self.flush_interval = config.AUDIT_FLUSH_INTERVAL if flush_interval is None \
+            else flush_interval
+        self._queue = queue.Queue()
+        self._context = {}
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._schema_ready = False
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+
+    # -- storage ----------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            conn.executescript(SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    # -- recording --------------------------------------------------------
+
+    def on_job(self, event, job):
+        """JobRegistry listener"""
+        if not self.enabled:
+            return
+        if event == "created":
+            self._context[job.id] = dict(current_request.get() or {})
+        elif event == "started":
+            context = self._context.setdefault(job.id, {})
+            context["rules_generation"] = rule_state.generation
+            context["domains_generation"] = domain_index.last_generation
+        elif event == "finished":
+            context = self._context.pop(job.id, {})
+            # A job invalidates the rules when it is done; the refresher's
+            # next read is the first generation that shows its changes
+            rules_until = None if rule_state.stale else rule_state.generation
+            resources = job.progress.get("resources") or []
+            self.record({
+                "ts": job.finished_at,
+                "started_at": job.started_at,
+                "duration": round(job.finished_at - job.started_at, 6) if job.started_at else None,
+                "kind": job.kind,
+                "endpoint": context.get("endpoint"),
+                "client": context.get("client"),
+                "params": job.params,
+                "resources": resources,
+                "processes": job.processes,
+                "outcome": job.status,
+                "error": job.error,
+                "job_id": job.id,
+                "rules_generation": context.get("rules_generation"),
+                "domains_generation": context.get("domains_generation"),
+                "rules_until": rules_until,
+                "domains_until": domain_index.last_generation,
+            })
+
+    def record(self, entry: dict):
+        """Queue one change for writing (non-blocking)"""
+        if not self.enabled:
+            return
+        self._queue.put(entry)
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer",
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            stop = False
+            # Let a burst of jobs land in the same transaction
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+            try:
+                self._write(conn, batch)
+            except Exception:
+                self.errors += 1
+                logger.exception("audit write failed (%d entries dropped)", len(batch))
+            if stop:
+                break
+        conn.close()
+
+    def _diffs(self, batch):
+        """Rule and blocklist changes between each entry's job start and end"""
+        for entry in batch:
+            diff = {}
+            since = entry.pop("rules_generation", None)
+            # Jobs that ended with a pending refresh take the latest generation
+            # read since (the refresher runs as soon as a job invalidates)
+            until = entry.pop("rules_until", None)
+            if until is None:
+                until = rule_state.generation
+            if since is not None and since < until:
+                changes = rule_state.changes_since(since, until)
+                if changes is None:
+                    diff["rules"] = {"reset": True}
+                elif changes["added"] or changes["removed"]:
+                    diff["rules"] = {"added": _truncate(changes["added"]),
+                                     "removed": _truncate(changes["removed"])}
+            since = entry.pop("domains_generation", None)
+            until = entry.pop("domains_until", None)
+            if since is not None and (until is None or since < until):
+                changes = domain_index.changes_since(since, until=until)
+                if changes is None:
+                    diff["domains"] = {"reset": True}
+                elif changes["added"] or changes["removed"]:
+                    diff["domains"] = {"added": _truncate(changes["added"]),
+                                       "removed": _truncate(changes["removed"])}
+            entry["diff"] = diff
+
+    def _write(self, conn, batch):
+        self._diffs(batch)
+        with conn:
+            for entry in batch:
+                cursor = conn.execute(
+                    "INSERT INTO changes (ts, started_at, duration, kind, endpoint, client, "
+                    "params, resources, diff, processes, outcome, error, job_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry["ts"], entry.get("started_at"), entry.get("duration"), entry["kind"],
+                     entry.get("endpoint"), entry.get("client"),
+                     json.dumps(entry.get("params") or {}, default=str),
+                     json.dumps(entry.get("resources") or []),
+                     json.dumps(entry["diff"]), entry.get("processes"), entry["outcome"],
+                     entry.get("error"), entry.get("job_id")),
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO change_resources (resource, change_id) VALUES (?, ?)",
+                    [(resource, cursor.lastrowid) for resource in entry.get("resources") or ()],
+                )
+        self.written += len(batch)
+        self.batches += 1
+
+    def stop(self, timeout=10):
+        """Write what is queued and stop the writer thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    # -- queries ----------------------------------------------------------
+
+    def query(self, limit=100, before=None, since=None, until=None, kind=None,
+              resource=None, outcome=None, client=None) -> dict:
+        """
+        Newest changes first, filtered
+        before: id cursor from the previous page's next_before
+        since / until: unix timestamps
+        resource: exact ("port:8080/tcp") or a prefix ending in "*" ("domain:*")
+        Returns: dict(items, next_before, limit)
+        """
+        limit = max(1, min(int(limit), MAX_PAGE))
+        conn = self._connect()
+        try:
+            if resource and not resource.endswith("*"):
+                source = "change_resources r JOIN changes c ON c.id = r.change_id"
+                id_column = "r.change_id"
+                conditions, args = ["r.resource = ?"], [resource]
+            else:
+                source, id_column, conditions, args = "changes c", "c.id", [], []
+                if resource:
+                    # Prefix: walk ids newest first and stop after `limit` matches
+                    # (sorting every match of a broad prefix would not scale)
+                    conditions.append("instr(c.resources, ?) > 0")
+                    args.append(json.dumps(resource[:-1])[:-1])
+
+            # Time filters become id bounds (ids grow with time), so every
+            # page is a range scan on the id / resource index
+            if since is not None:
+                row = conn.execute("SELECT id FROM changes WHERE ts >= ? ORDER BY ts LIMIT 1",
+                                   (since,)).fetchone()
+                if row is None:
+                    return {"items": [], "next_before": None, "limit": limit}
+                conditions.append(f"{id_column} >= ?")
+                args.append(row[0])
+            if until is not None:
+                row = conn.execute("SELECT id FROM changes WHERE ts <= ? ORDER BY ts DESC LIMIT 1",
+                                   (until,)).fetchone()
+                if row is None:
+                    return {"items": [], "next_before": None, "limit": limit}
+                conditions.append(f"{id_column} <= ?")
+                args.append(row[0])
+            if before is not None:
+                conditions.append(f"{id_column} < ?")
+                args.append(int(before))
+            for column, value in (("kind", kind), ("outcome", outcome), ("client", client)):
+                if value:
+                    conditions.append(f"c.{column} = ?")
+                    args.append(value)
+
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            columns = ", ".join(f"c.{column}" for column in COLUMNS)
+            rows = conn.execute(
+                f"SELECT {columns} FROM {source} {where} ORDER BY {id_column} DESC LIMIT ?",
+                (*args, limit + 1),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        items = []
+        for row in rows[:limit]:
+            item = dict(zip(COLUMNS, row))
+            for column in JSON_COLUMNS:
+                item[column] = json.loads(item[column]) if item[column] else None
+            items.append(item)
+        next_before = items[-1]["id"] if len(rows) > limit else None
+        return {"items": items, "next_before": next_before, "limit": limit}
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+
+# Shared audit log, fed by every job
+audit_log = AuditLog()
+jobs.add_listener(audit_log.on_job)
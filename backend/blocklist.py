@@ -0,0 +1,167 @@
+import ipaddress
+import json
+import logging
+import threading
+
+from backend import config
+from backend.helper_client import helper
+from backend.helper_protocol import NFT_SETS, nft_setup_script, nft_update_script
+from backend.system_files import run_process
+
+logger = logging.getLogger(__name__)
+
+
+class NftSetBlocklist:
+    """
+    Blocks IPs through two nftables hash sets (IPv4 / IPv6) referenced by a
+    fixed set of four drop rules in a dedicated table, so packet lookups cost
+    the same no matter how many IPs are blocked. Adding or removing IPs only
+    updates set elements; the ruleset is never reloaded.
+
+    table inet <NFT_TABLE>
+        set blocked4 { type ipv4_addr }
+        set blocked6 { type ipv6_addr }
+        chain input  { ip saddr @blocked4 drop; ip6 saddr @blocked6 drop }
+        chain output { ip daddr @blocked4 drop; ip6 daddr @blocked6 drop }
+    """
+
+    name = "nftables"
+    SETS = NFT_SETS
+
+    def __init__(self, table=None):
+        self.table = table or config.NFT_TABLE
+        self.members = {4: set(), 6: set()}
+        self.processes = 0
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _nft(self, op, argv, script=None, **args):
+        """
+        One nft call: through the helper as the structured operation `op`
+        (the helper builds the script itself), else `sudo nft <argv>`
+        A helper that cannot be reached falls back to sudo, like run_command.
+        """
+        if helper.available():
+            try:
+                result = helper.call(op, **args)
+            except OSError as e:
+                logger.warning("helper unreachable (%s), running nft through sudo", e)
+            else:
+                if result["returncode"] != 0:
+                    raise RuntimeError(result["stderr"].strip() or "nft failed")
+                return result["stdout"]
+        self.processes += 1
+        result = run_process(["sudo", "nft", *argv], input=script,
+                             capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or "nft failed")
+        return result.stdout
+
+    def setup_script(self) -> str:
+        """Idempotent nft script creating the table, sets and the four rules"""
+        return nft_setup_script(self.table)
+
+    def _apply(self, changes):
+        """[(verb, set, [ip, ...]), ...] as one atomic nft transaction"""
+        script = nft_update_script(self.table, changes)
+        if script:
+            self._nft("nft_update", ["-f", "-"], script=script,
+                      changes=[list(change) for change in changes])
+
+    def ensure_ready(self):
+        """Create the table on first use and load the current set members"""
+        if self._ready:
+            return
+        self._nft("nft_setup", ["-f", "-"], script=self.setup_script())
+        for version, set_name in self.SETS.items():
+            listing = json.loads(self._nft("nft_list", ["-j", "list", "set", "inet", self.table,
+                                                        set_name], set=set_name))
+            for item in listing.get("nftables", []):
+                for element in item.get("set", {}).get("elem", []):
+                    if isinstance(element, str):
+                        self.members[version].add(element)
+        self._ready = True
+
+    def _update(self, verb, ips):
+        """Add/delete elements for both families in one atomic nft transaction"""
+        by_version = {4: [], 6: []}
+        for ip in ips:
+            by_version[ipaddress.ip_address(ip).version].append(ip)
+
+        self._apply([(verb, self.SETS[version], addresses)
+                     for version, addresses in by_version.items() if addresses])
+        return by_version
+
+    def block(self, ips: list, domain: str) -> list:
+        """Add IPs to the blocklist sets"""
+        with self._lock:
+            self.ensure_ready()
+            new = [ip for ip in dict.fromkeys(ips)
+                   if ip not in self.members[ipaddress.ip_address(ip).version]]
+            for version, addresses in self._update("add", new).items():
+                self.members[version].update(addresses)
+        return [f"SET: {ip}" for ip in ips]
+
+    def unblock(self, ips: list) -> list:
+        """Remove IPs from the blocklist sets (unknown IPs are ignored)"""
+        with self._lock:
+            self.ensure_ready()
+            # nft rejects deleting absent elements, so only delete known members
+            present = [ip for ip in dict.fromkeys(ips)
+                       if ip in self.members[ipaddress.ip_address(ip).version]]
+            for version, addresses in self._update("delete", present).items():
+                self.members[version].difference_update(addresses)
+        return list(ips)
+
+    def replace(self, ips: list):
+        """Make the sets hold exactly these IPs in one nft transaction"""
+        with self._lock:
+            self.ensure_ready()
+            by_version = {4: set(), 6: set()}
+            for ip in ips:
+                by_version[ipaddress.ip_address(ip).version].add(ip)
+            changes = []
+            for version, addresses in by_version.items():
+                changes.append(("flush", self.SETS[version], []))
+                changes.append(("add", self.SETS[version], sorted(addresses)))
+            self._apply(changes)
+            self.members = by_version
+        return {"ipv4": len(by_version[4]), "ipv6": len(by_version[6])}
+
+    def contains(self, ip: str) -> bool:
+        return ip in self.members[ipaddress.ip_address(ip).version]
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "table": self.table,
+            "ipv4_blocked": len(self.members[4]),
+            "ipv6_blocked": len(self.members[6]),
+            "rules": 4,
+            "processes": self.processes,
+        }
+
+
+_set_backend = None
+_set_backend_checked = False
+_set_backend_lock = threading.Lock()
+
+
+def get_set_backend():
+    """
+    Return the configured set-based blocklist, or None to use per-IP UFW rules
+    Falls back to UFW (with a warning) if nftables is not available
+    """
+    global _set_backend, _set_backend_checked
+    if config.BLOCKLIST_BACKEND != "nftables":
+        return None
+    with _set_backend_lock:
+        if not _set_backend_checked:
+            _set_backend_checked = True
+            backend = NftSetBlocklist()
+            try:
+                backend.ensure_ready()
+                _set_backend = backend
+            except (OSError, RuntimeError, ValueError) as e:
+                logger.warning("nftables blocklist unavailable (%s), using ufw rules instead", e)
+        return _set_backend
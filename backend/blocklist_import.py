@@ -0,0 +1,184 @@
+import functools
+import gzip
+import ipaddress
+import os
+import re
+import time
+
+from backend import config
+from backend.hosts_file import hosts_file
+from backend.system_files import running_job
+
+FORMATS = ("auto", "hosts", "plain", "adblock")
+
+DOMAIN_RE = re.compile(
+    r"^(?=.{1,253}$)(?:[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?\.)+[a-z0-9-]{2,63}$"
+)
+
+# Names found in the header of most hosts-format lists
+HOSTS_SKIP = {
+    "localhost", "localhost.localdomain", "local", "broadcasthost",
+    "ip6-localhost", "ip6-loopback", "ip6-localnet", "ip6-mcastprefix",
+    "ip6-allnodes", "ip6-allrouters", "ip6-allhosts", "0.0.0.0",
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _is_ip(token: str) -> bool:
+    # Cached: hosts-format lists repeat the same one or two addresses
+    try:
+        ipaddress.ip_address(token)
+        return True
+    except ValueError:
+        return False
+
+
+def clean_domain(name: str):
+    """Lower-case and validate a domain name, or None if it is not one"""
+    name = name.strip().lower().rstrip(".")
+    if name in HOSTS_SKIP or not DOMAIN_RE.match(name):
+        return None
+    return name
+
+
+def parse_line(line: str, fmt: str = "auto") -> list:
+    """
+    Extract domains from one line of a blocklist
+    Formats:
+        hosts    '0.0.0.0 ads.example.com'  (any address, several names allowed)
+        plain    'ads.example.com'
+        adblock  '||ads.example.com^'       (rules with options or paths are skipped)
+    Returns: list of raw names (not yet validated)
+    """
+    line = line.strip()
+    if not line or line[0] in "#![":
+        return []
+    if line.startswith("@@"):
+        # AdBlock exception rule
+        return []
+
+    if fmt == "adblock" or (fmt == "auto" and line.startswith("||")):
+        if not line.startswith("||"):
+            return []
+        body = line[2:]
+        end = body.find("^")
+        if end <= 0:
+            return []
+        rest = body[end + 1:]
+        if rest and rest not in ("$important",):
+            return []
+        return [body[:end]]
+
+    if "#" in line:
+        line = line.split("#", 1)[0].strip()
+    tokens = line.split()
+    if not tokens:
+        return []
+
+    if fmt == "hosts" or (fmt == "auto" and len(tokens) > 1 and _is_ip(tokens[0])):
+        return tokens[1:] if _is_ip(tokens[0]) else []
+    if fmt in ("plain", "auto") and len(tokens) == 1:
+        return tokens
+    return []
+
+
+def iter_file_lines(path: str):
+    """Stream lines from a local file (gzip supported) without loading it"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            yield line
+
+
+class BlocklistImporter:
+    """
+    Imports a blocklist stream into the hosts file in large batches.
+    Lines are parsed one at a time and only the pending batch is held in
+    memory; names already in the hosts index are skipped when the batch is
+    committed. The DNS cache is flushed once at the end.
+    """
+
+    def __init__(self, job, fmt="auto", batch_size=None, hosts=None, flush_dns=None,
+                 on_batch=None, total_bytes=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Invalid format: {fmt}. Valid formats: {', '.join(FORMATS)}")
+        self.job = job
+        self.fmt = fmt
+        self.batch_size = batch_size or config.IMPORT_BATCH_SIZE
+        self.hosts = hosts or hosts_file
+        self.flush_dns = flush_dns
+        self.on_batch = on_batch
+        self.progress = job.progress
+        self.progress.update({
+            "lines": 0, "bytes": 0, "total_bytes": total_bytes, "domains": 0,
+            "added": 0, "duplicates": 0, "invalid": 0, "batches": 0,
+            "lines_per_second": 0,
+        })
+        self._pending = {}
+        self._started = time.monotonic()
+
+    def _commit(self):
+        if not self._pending:
+            return
+        added, _ = self.hosts.apply(add=list(self._pending))
+        self.progress["added"] += len(added)
+        self.progress["duplicates"] += len(self._pending) - len(added)
+        self.progress["batches"] += 1
+        if self.on_batch is not None and added:
+            self.on_batch(added)
+        self._pending = {}
+
+    def run(self, lines) -> dict:
+        progress = self.progress
+        pending = self._pending
+        for line in lines:
+            progress["lines"] += 1
+            progress["bytes"] += len(line)
+            for raw in parse_line(line, self.fmt):
+                domain = clean_domain(raw)
+                if domain is None:
+                    progress["invalid"] += 1
+                    continue
+                progress["domains"] += 1
+                # Already-blocked domains are counted as duplicates on commit
+                if domain in pending:
+                    progress["duplicates"] += 1
+                    continue
+                pending[domain] = None
+            if progress["lines"] % 10000 == 0:
+                self._update_rate()
+            if len(pending) >= self.batch_size:
+                self._commit()
+                pending = self._pending
+        self._commit()
+        self._update_rate()
+        if self.flush_dns is not None and progress["added"]:
+            self.flush_dns()
+        return {
+            "added": progress["added"],
+            "duplicates": progress["duplicates"],
+            "invalid": progress["invalid"],
+            "lines": progress["lines"],
+            "batches": progress["batches"],
+        }
+
+    def _update_rate(self):
+        elapsed = time.monotonic() - self._started
+        if elapsed > 0:
+            self.progress["lines_per_second"] = int(self.progress["lines"] / elapsed)
+
+
+def run_import_job(job, lines_factory, fmt="auto", flush_dns=None, on_batch=None,
+                   total_bytes=None, cleanup_path=None):
+    """Run an import to completion, recording the outcome on the job"""
+    running_job.set(job)
+    job.start()
+    try:
+        importer = BlocklistImporter(job, fmt=fmt, flush_dns=flush_dns,
+                                     on_batch=on_batch, total_bytes=total_bytes)
+        job.succeed(importer.run(lines_factory()))
+    except Exception as e:
+        job.fail(e)
+    finally:
+        if cleanup_path and os.path.exists(cleanup_path):
+            os.unlink(cleanup_path)
@@ -0,0 +1,47 @@
+import collections
+import threading
+
+
+class ChangeLog:
+    """
+    Bounded history of (generation, added, removed) so clients can ask for
+    "everything that changed since generation N" instead of a full listing.
+    Items are hashable keys; a reset (state re-read from scratch) drops the
+    history, after which older generations can only get a full listing.
+    """
+
+    def __init__(self, max_entries=1000):
+        self._entries = collections.deque(maxlen=max_entries)
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def record(self, generation, added, removed):
+        with self._lock:
+            if len(self._entries) == self._entries.maxlen:
+                self._floor = self._entries[0][0]
+            self._entries.append((generation, list(added), list(removed)))
+
+    def reset(self, generation):
+        """History before this generation is unknown"""
+        with self._lock:
+            self._entries.clear()
+            self._floor = generation
+
+    def since(self, generation, until=None):
+        """
+        Net changes after a generation (up to and including `until`)
+        Returns: (added, removed) lists, or None if the history does not reach back that far
+        """
+        with self._lock:
+            if generation < self._floor:
+                return None
+            entries = [entry for entry in self._entries
+                       if entry[0] > generation and (until is None or entry[0] <= until)]
+        # Net out items that were added and removed again (or vice versa)
+        counts = collections.Counter()
+        for _, added, removed in entries:
+            counts.update(added)
+            counts.subtract(removed)
+        added = [item for item, n in counts.items() for _ in range(n) if n > 0]
+        removed = [item for item, n in counts.items() for _ in range(-n) if n < 0]
+        return added, removed
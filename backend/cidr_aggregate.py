@@ -0,0 +1,251 @@
+import bisect
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+
+from backend import config
+from backend.domain_registry import domain_registry
+
+ADDRESS_TYPES = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+MAX_PREFIX = {4: 32, 6: 128}
+AGGREGATED_COMMENT = "Blocked domains (aggregated)"
+
+
+def merge_runs(values) -> list:
+    """Sorted integers -> merged (low, high) runs of consecutive values"""
+    runs = []
+    for value in sorted(values):
+        if runs and value == runs[-1][1] + 1:
+            runs[-1][1] = value
+        elif not runs or value > runs[-1][1]:
+            runs.append([value, value])
+    return [tuple(run) for run in runs]
+
+
+def aggregate(values, version, min_prefix=None) -> list:
+    """
+    Fewest CIDR networks covering a set of addresses (given as integers)
+    Runs of addresses are covered exactly. With min_prefix below the
+    host length, networks inside the same /min_prefix block are widened to
+    one covering network (this also blocks the gaps between them).
+    """
+    address = ADDRESS_TYPES[version]
+    networks = []
+    for low, high in merge_runs(values):
+        networks.extend(ipaddress.summarize_address_range(address(low), address(high)))
+    if min_prefix is None or min_prefix >= MAX_PREFIX[version]:
+        return networks
+
+    result, groups = [], {}
+    for network in networks:
+        if network.prefixlen <= min_prefix:
+            result.append(network)
+        else:
+            groups.setdefault(network.supernet(new_prefix=min_prefix), []).append(network)
+    for members in groups.values():
+        if len(members) == 1:
+            result.append(members[0])
+            continue
+        first = int(members[0].network_address)
+        last = int(members[-1].broadcast_address)
+        prefix = MAX_PREFIX[version] - (first ^ last).bit_length()
+        result.append(ipaddress.ip_network((address(first), prefix), strict=False))
+    return sorted(result)
+
+
+def network_text(network) -> str:
+    """'1.2.3.4' for single hosts (same key as per-IP rules), else '1.2.3.0/24'"""
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+class AggregationPlan:
+    """Result of CidrAggregator.plan(); commit() it once the rules are applied"""
+
+    def __init__(self, members, networks, add, delete, comments):
+        self.members = members
+        self.networks = networks
+        self.add = add
+        self.delete = delete
+        self.comments = comments
+
+    def comment(self, network: str) -> str:
+        return self.comments.get(network, AGGREGATED_COMMENT)
+
+
+class CidrAggregator:
+    """
+    Keeps the blocked IPv4/IPv6 addresses and covers them with the fewest
+    deny rules: adjacent addresses share one CIDR rule instead of one rule
+    per address. Every change recomputes the cover and yields only the
+    rules to add and delete, so unblocking an address splits its prefix
+    back into the parts that are still blocked.
+    The addresses and the networks emitted are kept in the state dir. On
+    first use the addresses come from the domain registry and the old
+    per-IP rules are replaced.
+    """
+
+    def __init__(self, path=None, enabled=None, min_prefix=None):
+        self.path = path or os.path.join(config.STATE_DIR, "cidr_blocks.json")
+        self.enabled = config.CIDR_AGGREGATE if enabled is None else enabled
+        self.min_prefix = min_prefix or {4: config.CIDR_MIN_PREFIX_V4,
+                                         6: config.CIDR_MIN_PREFIX_V6}
+        self._members = None
+        self._networks = None
+        self._migrate = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._members is not None:
+            return
+        self._members = {4: set(), 6: set()}
+        self._networks = set()
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            for ip in data.get("addresses", []):
+                address = ipaddress.ip_address(ip)
+                self._members[address.version].add(int(address))
+            self._networks = set(data.get("networks", []))
+            return
+        except (OSError, ValueError):
+            pass
+        # No state yet: start from what is blocked per IP today
+        for domain in domain_registry.domains():
+            record = domain_registry.get(domain)
+            for ip in (record.ips if record else ()):
+                try:
+                    address = ipaddress.ip_address(ip)
+                except ValueError:
+                    continue
+                if not (address.is_loopback or address.is_unspecified):
+                    self._members[address.version].add(int(address))
+        self._migrate = True
+
+    def _save(self):
+        addresses = [str(ADDRESS_TYPES[version](value))
+                     for version, values in self._members.items() for value in sorted(values)]
+        data = {"version": 1, "addresses": addresses, "networks": sorted(self._networks)}
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".cidr_blocks-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def _cover(self, members) -> dict:
+        """{version: sorted networks} covering the members"""
+        return {version: aggregate(values, version, self.min_prefix[version])
+                for version, values in members.items()}
+
+    @staticmethod
+    def _covering(cover, addresses) -> set:
+        """Texts of the networks that contain any of the addresses"""
+        starts = {version: [int(n.network_address) for n in networks]
+                  for version, networks in cover.items()}
+        found = set()
+        for address in addresses:
+            networks = cover[address.version]
+            index = bisect.bisect_right(starts[address.version], int(address)) - 1
+            if index >= 0 and address in networks[index]:
+                found.add(network_text(networks[index]))
+        return found
+
+    def plan(self, operations) -> AggregationPlan:
+        """
+        operations: ("block", ips, comment) / ("unblock", ips, None) in order
+        Returns: the new state with the networks to add and delete
+        """
+        with self._lock:
+            self._ensure_loaded()
+            members = {version: set(values) for version, values in self._members.items()}
+            previous = set(self._networks)
+            migrate = self._migrate
+        comments, released, blocked = {}, set(), set()
+        for op, ips, comment in operations:
+            for ip in ips:
+                address = ipaddress.ip_address(ip)
+                if op == "block":
+                    members[address.version].add(int(address))
+                    comments[str(address)] = comment
+                    blocked.add(address)
+                else:
+                    members[address.version].discard(int(address))
+                    released.add(str(address))
+                    blocked.discard(address)
+
+        cover = self._cover(members)
+        networks = {network_text(network) for version in cover for network in cover[version]}
+        delete = previous - networks
+        # Per-IP rules written before aggregation (or before a restart without state)
+        stale = released | ({str(ADDRESS_TYPES[version](value))
+                             for version, values in members.items() for value in values}
+                            if migrate else set())
+        delete |= stale - networks
+        add = networks - previous if not migrate else networks
+        # The saved networks may not match the rules files (e.g. after a
+        # `ufw reset`): re-add the ones covering this request's blocks;
+        # RulesFile.add skips those that are really there
+        add |= self._covering(cover, blocked)
+        return AggregationPlan(members, networks, sorted(add), sorted(delete),
+                               {ip: c for ip, c in comments.items() if c and ip in networks})
+
+    def commit(self, plan: AggregationPlan):
+        """Adopt a plan after its rules were applied"""
+        with self._lock:
+            self._members = plan.members
+            self._networks = plan.networks
+            self._migrate = False
+            self._save()
+
+    def export(self):
+        """Blocked addresses and emitted networks (for snapshots), None if unused"""
+        with self._lock:
+            if self._members is None and not os.path.exists(self.path):
+                return None
+            self._ensure_loaded()
+            return {"addresses": [str(ADDRESS_TYPES[version](value))
+                                  for version, values in self._members.items()
+                                  for value in sorted(values)],
+                    "networks": sorted(self._networks)}
+
+    def replace(self, data):
+        """Adopt exported state after its rules files were restored"""
+        with self._lock:
+            if data is None:
+                self._members = self._networks = None
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                return
+            self._members = {4: set(), 6: set()}
+            for ip in data["addresses"]:
+                address = ipaddress.ip_address(ip)
+                self._members[address.version].add(int(address))
+            self._networks = set(data["networks"])
+            self._migrate = False
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self.enabled:
+                self._ensure_loaded()
+            addresses = sum(len(values) for values in (self._members or {}).values())
+            networks = len(self._networks or ())
+        # Each address / network is one deny-in plus one deny-out rule
+        return {
+            "enabled": self.enabled,
+            "min_prefix_v4": self.min_prefix[4],
+            "min_prefix_v6": self.min_prefix[6],
+            "addresses": addresses,
+            "networks": networks,
+            "rules": networks * 2,
+            "rules_without_aggregation": addresses * 2,
+            "rules_saved": (addresses - networks) * 2,
+        }
+
+
+# Shared aggregator used by RuleBatch for domain IP blocks
+cidr_aggregator = CidrAggregator()
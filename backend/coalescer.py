@@ -0,0 +1,93 @@
+import inspect
+
+from fastapi.concurrency import run_in_threadpool
+
+from backend import config
+from backend.jobs import Job, executor as shared_executor
+
+
+class _Call:
+    """The latest requested state for one target, and the job that applies it"""
+
+    __slots__ = ("key", "state", "fn", "args", "kwargs", "job", "requests")
+
+    def __init__(self, key, state, fn, args, kwargs):
+        self.key = key
+        self.state = state
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.job = None
+        self.requests = 1
+
+
+class Coalescer:
+    """
+    Collapses bursts of requests for the same target into one execution.
+
+    A request opens a job that waits `window` seconds (plus however long
+    its resource lock is busy). Requests for the same key arriving before
+    that job starts replace its desired state and return the same job, so
+    on -> off -> on within the window applies "on" once. A request that
+    matches the state of the job currently running shares it (single-flight).
+    Every caller gets the result of the state that was actually applied.
+    """
+
+    def __init__(self, executor=None, window=None):
+        self.executor = executor or shared_executor
+        self.window = config.COALESCE_WINDOW if window is None else window
+        self._pending = {}
+        self._running = {}
+        self.requests = 0
+        self.executions = 0
+
+    def submit(self, key, state, kind, fn, *args, resources=(), params=None, **kwargs) -> Job:
+        """Request `state` for `key`; fn(*args, **kwargs) applies it"""
+        self.requests += 1
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.state, pending.fn, pending.args, pending.kwargs = state, fn, args, kwargs
+            pending.requests += 1
+            pending.job.params = params or pending.job.params
+            pending.job.progress["coalesced_requests"] = pending.requests
+            return pending.job
+
+        running = self._running.get(key)
+        if running is not None and running.state == state:
+            running.requests += 1
+            running.job.progress["coalesced_requests"] = running.requests
+            return running.job
+
+        call = _Call(key, state, fn, args, kwargs)
+        self._pending[key] = call
+        call.job = self.executor.submit(kind, self._execute, call, resources=resources,
+                                        params=params, delay=self.window)
+        call.job.progress["coalesced_requests"] = 1
+        return call.job
+
+    async def _execute(self, call: _Call):
+        # From here on new requests can no longer change this call's state
+        if self._pending.get(call.key) is call:
+            del self._pending[call.key]
+        self._running[call.key] = call
+        self.executions += 1
+        try:
+            if inspect.iscoroutinefunction(call.fn):
+                return await call.fn(*call.args, **call.kwargs)
+            return await run_in_threadpool(call.fn, *call.args, **call.kwargs)
+        finally:
+            if self._running.get(call.key) is call:
+                del self._running[call.key]
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "requests": self.requests,
+            "executions": self.executions,
+            "pending": len(self._pending),
+            "running": len(self._running),
+        }
+
+
+# Shared coalescer in front of toggle_port / toggle_service / manage_domain
+coalescer = Coalescer()
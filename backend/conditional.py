@@ -0,0 +1,26 @@
+import uuid
+
+from fastapi import Request, Response
+
+# Generations restart at every boot; the ETag carries this so a cached
+# copy from a previous process never matches by accident.
+BOOT_ID = uuid.uuid4().hex[:12]
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from a generation and whatever else shapes the response"""
+    return '"' + "-".join([BOOT_ID] + [str(part) for part in parts]) + '"'
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    """Does the client already hold this exact representation?"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,149 @@
+import os
+
+
+def _env_float(name, default):
+    """Read a float setting from the environment, falling back to default"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return float(default)
+
+
+def _env_bool(name, default):
+    """Read an on/off setting from the environment"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off", "")
+
+
+# Maximum age (seconds) of the cached `ufw status` snapshot before the
+# background refresher re-reads it
+RULE_CACHE_MAX_AGE = _env_float("FIREWALL_RULE_CACHE_MAX_AGE", 30)
+
+# Apply the rule changes of one request as a single rewrite of the UFW
+# rules files followed by one `ufw reload` (set to 0 for one ufw call per rule)
+BATCH_MODE = _env_bool("FIREWALL_BATCH_MODE", True)
+
+# Location of UFW's user.rules / user6.rules
+UFW_RULES_DIR = os.environ.get("FIREWALL_UFW_RULES_DIR", "/etc/ufw")
+
+# UFW defaults file (IPV6=yes/no, default policies)
+UFW_DEFAULTS_FILE = os.environ.get("FIREWALL_UFW_DEFAULTS_FILE", "/etc/default/ufw")
+
+# How blocked domain IPs are enforced: "ufw" (one rule per IP and direction)
+# or "nftables" (hash sets referenced by a fixed number of rules)
+BLOCKLIST_BACKEND = os.environ.get("FIREWALL_BLOCKLIST_BACKEND", "ufw").strip().lower()
+
+# With the ufw backend, merge blocked domain IPs into the fewest CIDR rules
+CIDR_AGGREGATE = _env_bool("FIREWALL_CIDR_AGGREGATE", False)
+# Widest prefix a rule may grow to when covering nearby addresses (this
+# also blocks the addresses in between); 32 / 128 = cover exactly
+CIDR_MIN_PREFIX_V4 = int(_env_float("FIREWALL_CIDR_MIN_PREFIX_V4", 32))
+CIDR_MIN_PREFIX_V6 = int(_env_float("FIREWALL_CIDR_MIN_PREFIX_V6", 128))
+
+# nftables table holding the blocklist sets
+NFT_TABLE = os.environ.get("FIREWALL_NFT_TABLE", "cyber_sec_blocklist")
+
+# DNS resolution used for domain blocking
+DNS_TIMEOUT = _env_float("FIREWALL_DNS_TIMEOUT", 2.0)
+# TTL used when the resolver does not report one (system getaddrinfo fallback)
+DNS_DEFAULT_TTL = _env_float("FIREWALL_DNS_DEFAULT_TTL", 300)
+# How long NXDOMAIN / no-data answers are cached when no SOA minimum is given
+DNS_NEGATIVE_TTL = _env_float("FIREWALL_DNS_NEGATIVE_TTL", 60)
+# Upper bound on cached TTLs and on the number of cached answers
+DNS_MAX_TTL = _env_float("FIREWALL_DNS_MAX_TTL", 86400)
+DNS_CACHE_SIZE = int(_env_float("FIREWALL_DNS_CACHE_SIZE", 100000))
+
+# Where the backend keeps its own state (domain -> IP records, ...)
+STATE_DIR = os.path.expanduser(os.environ.get("FIREWALL_STATE_DIR", "~/.cyber_sec"))
+
+# Background re-resolution of blocked domains
+SYNC_ENABLED = _env_bool("FIREWALL_SYNC_ENABLED", True)
+# Maximum concurrent re-resolutions
+SYNC_CONCURRENCY = int(_env_float("FIREWALL_SYNC_CONCURRENCY", 16))
+# Global refresh budget in domains per second
+SYNC_BUDGET = _env_float("FIREWALL_SYNC_BUDGET", 50)
+# Never re-resolve a domain more often than this (seconds), whatever its TTL
+SYNC_MIN_INTERVAL = _env_float("FIREWALL_SYNC_MIN_INTERVAL", 30)
+# An IP is unblocked once the domain has stopped resolving to it for this long
+SYNC_STALE_AFTER = _env_float("FIREWALL_SYNC_STALE_AFTER", 600)
+
+# Hosts file used for DNS-level blocking and the address blocked names map to
+HOSTS_FILE = os.environ.get("FIREWALL_HOSTS_FILE", "/etc/hosts")
+HOSTS_BLOCK_ADDRESS = os.environ.get("FIREWALL_HOSTS_BLOCK_ADDRESS", "0.0.0.0")
+
+# Bulk blocklist import: domains committed to the hosts file per rewrite
+IMPORT_BATCH_SIZE = int(_env_float("FIREWALL_IMPORT_BATCH_SIZE", 200000))
+
+# Privileged helper daemon (python -m backend.helper_daemon, run as root).
+# When its socket exists, privileged operations go over it instead of sudo.
+HELPER_SOCKET = os.environ.get("FIREWALL_HELPER_SOCKET", "/run/cyber_sec/helper.sock")
+# Connections the API server keeps open to the helper
+HELPER_POOL_SIZE = int(_env_float("FIREWALL_HELPER_POOL_SIZE", 4))
+# Seconds to wait for one helper response (a ufw reload can take a while)
+HELPER_TIMEOUT = _env_float("FIREWALL_HELPER_TIMEOUT", 60)
+
+# Mutating API operations run as jobs; at most this many use threadpool
+# workers at once (the rest stay free for status reads)
+JOB_WORKERS = int(_env_float("FIREWALL_JOB_WORKERS", 8))
+
+# Toggles / domain actions on the same target arriving within this many
+# seconds are collapsed into one applied final state (0 = no extra wait)
+COALESCE_WINDOW = _env_float("FIREWALL_COALESCE_WINDOW", 0.25)
+
+# Full-state snapshots (rules, hosts section, domain records) kept in the
+# state dir; the oldest are deleted beyond this many
+SNAPSHOT_KEEP = int(_env_float("FIREWALL_SNAPSHOT_KEEP", 20))
+
+# Audit log of every mutation (SQLite in the state dir); entries are
+# written by a background thread in batches of up to AUDIT_BATCH_SIZE,
+# at most AUDIT_FLUSH_INTERVAL seconds after the change
+AUDIT_ENABLED = _env_bool("FIREWALL_AUDIT_ENABLED", True)
+AUDIT_DB = os.path.expanduser(os.environ.get("FIREWALL_AUDIT_DB", os.path.join(STATE_DIR, "audit.db")))
+AUDIT_BATCH_SIZE = int(_env_float("FIREWALL_AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL = _env_float("FIREWALL_AUDIT_FLUSH_INTERVAL", 1.0)
+
+# UFW packet log, followed from UFW_LOG_FILE; the newest UFW_LOG_BUFFER
+# parsed entries are kept in memory. On first start only the last
+# UFW_LOG_BACKFILL bytes are read; later starts resume the saved offset.
+UFW_LOG_FILE = os.environ.get("FIREWALL_UFW_LOG_FILE", "/var/log/ufw.log")
+UFW_LOG_BUFFER = int(_env_float("FIREWALL_UFW_LOG_BUFFER", 100000))
+UFW_LOG_BACKFILL = int(_env_float("FIREWALL_UFW_LOG_BACKFILL", 1 << 20))
+UFW_LOG_POLL_INTERVAL = _env_float("FIREWALL_UFW_LOG_POLL_INTERVAL", 0.5)
+
+# Traffic analytics: heavy-hitter sketch size of each minute / hour / day
+# bucket (top blocked sources, ports and domains); memory stays bounded
+# however many distinct IPs are logged
+STATS_SKETCH_SIZE = int(_env_float("FIREWALL_STATS_SKETCH_SIZE", 200))
+
+# Metrics at GET /metrics (Prometheus text format). Requests sending the
+# TRACE_HEADER header get a Server-Timing header with the subprocesses,
+# helper calls, DNS queries and hosts file I/O they caused
+METRICS_ENABLED = _env_bool("FIREWALL_METRICS_ENABLED", True)
+TRACE_ENABLED = _env_bool("FIREWALL_TRACE_ENABLED", True)
+TRACE_HEADER = os.environ.get("FIREWALL_TRACE_HEADER", "X-Firewall-Trace")
+
+# Scheduled rules and TTLs (SQLite in the state dir). Timers falling due
+# within SCHEDULE_BATCH_WINDOW seconds of each other are applied as one
+# change; a failed change is retried after SCHEDULE_RETRY seconds
+SCHEDULE_ENABLED = _env_bool("FIREWALL_SCHEDULE_ENABLED", True)
+SCHEDULE_DB = os.path.expanduser(os.environ.get("FIREWALL_SCHEDULE_DB", os.path.join(STATE_DIR, "schedules.db")))
+SCHEDULE_BATCH_WINDOW = _env_float("FIREWALL_SCHEDULE_BATCH_WINDOW", 1.0)
+SCHEDULE_RETRY = _env_float("FIREWALL_SCHEDULE_RETRY", 60)
+
+# Fleet mode: this backend can push a change to other backends ("agents").
+# FLEET_AGENTS ("name=http://host:8000,...") is added to the registry kept
+# in FLEET_REGISTRY at every start. At most FLEET_CONCURRENCY requests are
+# in flight (also the size of the keep-alive pool); each host gets
+# FLEET_TIMEOUT seconds per attempt and FLEET_RETRIES more attempts,
+# FLEET_RETRY_BACKOFF seconds apart (doubling). FLEET_TOKEN, if set, is
+# sent as a bearer token for agents behind an authenticating proxy.
+FLEET_AGENTS = os.environ.get("FIREWALL_FLEET_AGENTS", "")
+FLEET_REGISTRY = os.path.expanduser(os.environ.get("FIREWALL_FLEET_REGISTRY", os.path.join(STATE_DIR, "fleet.json")))
+FLEET_CONCURRENCY = int(_env_float("FIREWALL_FLEET_CONCURRENCY", 32))
+FLEET_TIMEOUT = _env_float("FIREWALL_FLEET_TIMEOUT", 30)
+FLEET_CONNECT_TIMEOUT = _env_float("FIREWALL_FLEET_CONNECT_TIMEOUT", 3)
+FLEET_RETRIES = int(_env_float("FIREWALL_FLEET_RETRIES", 2))
+FLEET_RETRY_BACKOFF = _env_float("FIREWALL_FLEET_RETRY_BACKOFF", 0.5)
+FLEET_TOKEN = os.environ.get("FIREWALL_FLEET_TOKEN", "")
@@ -0,0 +1,196 @@
+import asyncio
+import socket
+import threading
+import time
+
+from backend import config
+from backend.metrics import add_span, dns_duration, dns_resolve_duration, metrics, timed
+
+try:
+    import dns.asyncresolver
+    import dns.exception
+    import dns.rdatatype
+    import dns.resolver
+    HAVE_DNSPYTHON = True
+except ImportError:  # pragma: no cover - optional dependency
+    HAVE_DNSPYTHON = False
+
+RECORD_FAMILIES = {"A": socket.AF_INET, "AAAA": socket.AF_INET6}
+
+
+class ResolverCache:
+    """
+    TTL-aware cache of DNS answers keyed by (name, record type).
+    Negative answers (NXDOMAIN / no data) are cached as empty tuples.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or config.DNS_CACHE_SIZE
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, name, rdtype):
+        """Return cached addresses (possibly empty) or None on a miss"""
+        key = (name, rdtype)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                if not entry[0]:
+                    self.negative_hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def ttl_remaining(self, name, rdtype):
+        """Seconds until the cached answer expires (0 if not cached)"""
+        entry = self._entries.get((name, rdtype))
+        if entry is None:
+            return 0
+        return max(0.0, entry[1] - time.monotonic())
+
+    def put(self, name, rdtype, addresses, ttl):
+        ttl = max(0.0, min(float(ttl), config.DNS_MAX_TTL))
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict()
+            self._entries[(name, rdtype)] = (tuple(addresses), time.monotonic() + ttl)
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry[1] <= now]
+        for key in expired:
+            del self._entries[key]
+        # Still full: drop the oldest tenth (dicts keep insertion order)
+        if len(self._entries) >= self.max_entries:
+            for key in list(self._entries)[:max(1, self.max_entries // 10)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _negative_ttl(exc) -> float:
+    """SOA minimum from a negative answer, else the configured negative TTL"""
+    try:
+        if isinstance(exc, dns.resolver.NXDOMAIN):
+            responses = list(exc.responses().values())
+        else:
+            responses = [exc.response()]
+        for response in responses:
+            for rrset in response.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    return min(rrset.ttl, rrset[0].minimum)
+    except Exception:
+        pass
+    return config.DNS_NEGATIVE_TTL
+
+
+class DomainResolver:
+    """
+    Resolves A/AAAA records concurrently with a per-query timeout.
+    Uses dnspython when installed (real TTLs, bypasses /etc/hosts, which
+    holds 0.0.0.0 for blocked domains); otherwise falls back to the system
+    getaddrinfo with DNS_DEFAULT_TTL.
+    """
+
+    def __init__(self, cache=None, timeout=None):
+        self.cache = cache or ResolverCache()
+        self.timeout = config.DNS_TIMEOUT if timeout is None else timeout
+        self.timeouts = 0
+
+    async def _query(self, name, rdtype):
+        """Returns (addresses, ttl); ttl None means do not cache"""
+        if HAVE_DNSPYTHON:
+            try:
+                answer = await dns.asyncresolver.resolve(name, rdtype, lifetime=self.timeout)
+                addresses = sorted({rdata.address for rdata in answer})
+                return addresses, max(0.0, answer.expiration - time.time())
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+                return [], _negative_ttl(e)
+            except dns.exception.Timeout:
+                self.timeouts += 1
+                return [], None
+            except dns.exception.DNSException:
+                return [], None
+
+        loop = asyncio.get_running_loop()
+        try:
+            info = await asyncio.wait_for(
+                loop.getaddrinfo(name, None, family=RECORD_FAMILIES[rdtype]),
+                timeout=self.timeout,
+            )
+            return sorted({addr[4][0] for addr in info}), config.DNS_DEFAULT_TTL
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return [], None
+        except socket.gaierror as e:
+            if e.errno in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", None)):
+                return [], config.DNS_NEGATIVE_TTL
+            return [], None
+
+    async def lookup(self, name, rdtype):
+        """Resolve one record type for one name through the cache"""
+        cached = self.cache.get(name, rdtype)
+        if cached is not None:
+            return list(cached)
+        started = time.perf_counter()
+        addresses, ttl = await self._query(name, rdtype)
+        elapsed = time.perf_counter() - started
+        dns_duration.observe(elapsed, rdtype,
+                             "answer" if addresses else "empty" if ttl is not None else "failed")
+        add_span("dns", f"{name} {rdtype}", elapsed)
+        if ttl is not None:
+            self.cache.put(name, rdtype, addresses, ttl)
+        return addresses
+
+    async def resolve(self, name) -> tuple:
+        """Returns: (list[ipv4], list[ipv6])"""
+        with timed(dns_resolve_duration):
+            ipv4, ipv6 = await asyncio.gather(self.lookup(name, "A"), self.lookup(name, "AAAA"))
+        return ipv4, ipv6
+
+    async def resolve_many(self, names) -> dict:
+        """Resolve all names (A and AAAA) at once, returns {name: (ipv4, ipv6)}"""
+        names = list(dict.fromkeys(names))
+        results = await asyncio.gather(*(self.resolve(name) for name in names))
+        return dict(zip(names, results))
+
+    def resolve_sync(self, name) -> tuple:
+        """Blocking wrapper for code that is not running on an event loop"""
+        return asyncio.run(self.resolve(name))
+
+    def stats(self) -> dict:
+        return {
+            "backend": "dnspython" if HAVE_DNSPYTHON else "getaddrinfo",
+            "timeout": self.timeout,
+            "timeouts": self.timeouts,
+            **self.cache.stats(),
+        }
+
+
+# Shared resolver (and cache) for all domain operations
+resolver = DomainResolver()
+metrics.gauge("firewall_dns_cache_lookups_total", "DNS cache lookups by result",
+              lambda: {("hit",): resolver.cache.hits - resolver.cache.negative_hits,
+                       ("negative_hit",): resolver.cache.negative_hits,
+                       ("miss",): resolver.cache.misses},
+              labels=("result",), kind="counter")
+metrics.gauge("firewall_dns_cache_entries", "Answers held in the DNS cache",
+              lambda: len(resolver.cache._entries))
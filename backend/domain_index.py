@@ -0,0 +1,272 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+
+from backend import config
+from backend.changelog import ChangeLog
+from backend.domain_trie import DomainTrie, format_pattern, parse_pattern
+from backend.hosts_file import hosts_file
+
+# Above this many changes the sorted listing is rebuilt instead of patched
+SORTED_PATCH_LIMIT = 1000
+
+
+class DomainIndex:
+    """
+    In-memory index of everything blocked: exact names from the hosts file
+    plus wildcard ("*.example.com") and subtree (".example.com") rules.
+    Answers "is this name blocked, and by which rule?" in O(labels) and
+    serves paginated / prefix-filtered listings from a sorted name list.
+    Pattern rules are persisted in the state dir since /etc/hosts cannot
+    express them.
+    """
+
+    def __init__(self, hosts=None, rules_path=None):
+        self.hosts = hosts or hosts_file
+        self.rules_path = rules_path or os.path.join(config.STATE_DIR, "domain_rules.json")
+        self._trie = None
+        self._patterns = None
+        self._sorted = None
+        self._stale = False
+        self._generation = 0
+        self.changes = ChangeLog()
+        self._lock = threading.RLock()
+        self.hosts.add_listener(self._on_hosts_change)
+
+    # -- building -------------------------------------------------------
+
+    def _load_patterns(self):
+        if self._patterns is not None:
+            return
+        self._patterns = {}
+        try:
+            with open(self.rules_path, "r") as f:
+                for item in json.load(f).get("rules", []):
+                    self._patterns[item["domain"], item["kind"]] = None
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_patterns(self):
+        data = {"version": 1, "rules": [{"domain": d, "kind": k} for d, k in self._patterns]}
+        directory = os.path.dirname(self.rules_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".domain_rules-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.rules_path)
+
+    def _check_stale(self):
+        # Cheap stat check; edits made outside the API mark the index stale
+        len(self.hosts)
+        if self._stale:
+            self._stale = False
+            self._trie = None
+            self._generation += 1
+            self.changes.reset(self._generation)
+
+    def _changed(self, added, removed):
+        self._generation += 1
+        self.changes.record(self._generation, added, removed)
+
+    def _ensure_built(self):
+        self._check_stale()
+        if self._trie is not None:
+            return
+        self._load_patterns()
+        trie = DomainTrie()
+        for domain in self.hosts.blocked():
+            trie.add(domain, "exact")
+        for domain, kind in self._patterns:
+            trie.add(domain, kind)
+        self._trie = trie
+        self._sorted = None
+
+    def _on_hosts_change(self, added, removed):
+        if added is None:
+            # File changed on disk: rebuild on next use. No lock here, the
+            # hosts manager calls this while holding its own lock.
+            self._stale = True
+            return
+        with self._lock:
+            self._changed(added, removed)
+            if self._trie is None:
+                return
+            for domain in added:
+                self._trie.add(domain, "exact")
+            for domain in removed:
+                self._trie.remove(domain, "exact")
+            self._patch_sorted(added, removed)
+
+    def _patch_sorted(self, added, removed):
+        if self._sorted is None:
+            return
+        if len(added) + len(removed) > SORTED_PATCH_LIMIT:
+            self._sorted = None
+            return
+        for domain in removed:
+            i = bisect.bisect_left(self._sorted, domain)
+            if i < len(self._sorted) and self._sorted[i] == domain:
+                del self._sorted[i]
+        for domain in added:
+            i = bisect.bisect_left(self._sorted, domain)
+            if i == len(self._sorted) or self._sorted[i] != domain:
+                self._sorted.insert(i, domain)
+
+    def _sorted_names(self):
+        if self._sorted is None:
+            names = set(self.hosts.blocked())
+            names.update(format_pattern(d, k) for d, k in self._patterns)
+            self._sorted = sorted(names)
+        return self._sorted
+
+    # -- queries --------------------------------------------------------
+
+    @property
+    def generation(self) -> int:
+        """Bumped on every change to the listing; only stats the hosts file"""
+        with self._lock:
+            self._check_stale()
+            return self._generation
+
+    @property
+    def last_generation(self) -> int:
+        """Latest known generation without checking the hosts file (no I/O)"""
+        return self._generation
+
+    def changes_since(self, generation, prefix=None, under=None, until=None):
+        """
+        Names / rules added and removed after a generation (up to `until`),
+        filtered like list()
+        Returns: dict(added, removed), or None if that generation is too old
+        """
+        with self._lock:
+            self._check_stale()
+            if generation > self._generation:
+                # From another boot of the service
+                return None
+            current = self._generation if until is None else min(until, self._generation)
+            changes = self.changes.since(generation, current)
+        if changes is None:
+            return None
+
+        def wanted(name):
+            if prefix and not name.startswith(prefix.strip().lower()):
+                return False
+            if under:
+                base = under.strip().lower().rstrip(".")
+                domain = parse_pattern(name)[0]
+                return domain == base or domain.endswith("." + base)
+            return True
+
+        added, removed = changes
+        return {"generation": current,
+                "added": sorted(n for n in added if wanted(n)),
+                "removed": sorted(n for n in removed if wanted(n))}
+
+    def check(self, name: str) -> dict:
+        """
+        Is the name blocked, and by which rule?
+        Only exact names are enforced (hosts file + firewall). A name that
+        only matches a wildcard / subtree rule is reported with that rule but
+        blocked=False, enforced=False: nothing resolves or blocks it yet.
+        """
+        with self._lock:
+            self._ensure_built()
+            match = self._trie.match(name)
+        domain = name.strip().lower().rstrip(".")
+        if match is None:
+            return {"domain": domain, "blocked": False, "enforced": False, "rule": None,
+                    "kind": None}
+        rule_domain, kind = match
+        enforced = kind == "exact"
+        return {"domain": domain, "blocked": enforced, "enforced": enforced,
+                "rule": format_pattern(rule_domain, kind), "kind": kind}
+
+    def list(self, offset=0, limit=1000, prefix=None, under=None) -> dict:
+        """
+        Page through blocked names / rules in sorted order
+        prefix: only names starting with this text
+        under:  only rules for this domain and its subdomains (trie walk)
+        """
+        with self._lock:
+            self._ensure_built()
+            if under:
+                under = under.strip().lower().rstrip(".")
+                items = []
+                total = 0
+                for domain, kind in self._trie.iter_under(under):
+                    if total >= offset and len(items) < limit:
+                        items.append(format_pattern(domain, kind))
+                    total += 1
+            else:
+                names = self._sorted_names()
+                lo, hi = 0, len(names)
+                if prefix:
+                    prefix = prefix.strip().lower()
+                    lo = bisect.bisect_left(names, prefix)
+                    hi = bisect.bisect_left(names, prefix + "￿")
+                total = hi - lo
+                items = names[lo + offset:min(hi, lo + offset + limit)]
+        next_offset = offset + len(items) if offset + len(items) < total else None
+        return {"items": items, "total": total, "offset": offset, "limit": limit,
+                "next_offset": next_offset}
+
+    # -- pattern rules --------------------------------------------------
+
+    def add_pattern(self, pattern: str) -> tuple:
+        domain, kind = parse_pattern(pattern)
+        with self._lock:
+            self._load_patterns()
+            if (domain, kind) in self._patterns:
+                return domain, kind
+            self._patterns[domain, kind] = None
+            self._save_patterns()
+            self._changed([format_pattern(domain, kind)], [])
+            if self._trie is not None:
+                self._trie.add(domain, kind)
+                self._patch_sorted([format_pattern(domain, kind)], [])
+        return domain, kind
+
+    def remove_pattern(self, pattern: str) -> bool:
+        domain, kind = parse_pattern(pattern)
+        with self._lock:
+            self._load_patterns()
+            if self._patterns.pop((domain, kind), "missing") == "missing":
+                return False
+            self._save_patterns()
+            self._changed([], [format_pattern(domain, kind)])
+            if self._trie is not None:
+                self._trie.remove(domain, kind)
+                self._patch_sorted([], [format_pattern(domain, kind)])
+        return True
+
+    def replace_patterns(self, patterns) -> tuple:
+        """
+        Make the pattern rules exactly `patterns` with one save (snapshot restore)
+        Returns: (rules added, rules removed) as formatted patterns
+        """
+        wanted = dict.fromkeys(parse_pattern(pattern) for pattern in patterns)
+        with self._lock:
+            self._load_patterns()
+            added = [format_pattern(d, k) for d, k in wanted if (d, k) not in self._patterns]
+            removed = [format_pattern(d, k) for d, k in self._patterns if (d, k) not in wanted]
+            if not added and not removed:
+                return added, removed
+            self._patterns = wanted
+            self._save_patterns()
+            self._changed(added, removed)
+            # Rebuilt on next use
+            self._trie = None
+            self._sorted = None
+        return added, removed
+
+    def patterns(self) -> list:
+        with self._lock:
+            self._load_patterns()
+            return [format_pattern(d, k) for d, k in self._patterns]
+
+
+# Shared index over the managed hosts file
+domain_index = DomainIndex()
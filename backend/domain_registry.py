@@ -0,0 +1,257 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from backend import config
+
+
+class DomainRecord:
+    """
+    IPs blocked for one domain, with the last time each IP was resolved
+    source: "manual" (domain endpoint, policy, schedules) or "import" (bulk
+    imports); a policy's domains section only manages manual blocks
+    """
+
+    __slots__ = ("names", "ips", "ttl", "source")
+
+    def __init__(self, names, ips=None, ttl=None, source=None):
+        self.names = tuple(names)
+        self.ips = dict(ips or {})
+        self.ttl = ttl
+        # Records saved before sources existed: imports only recorded the name itself
+        self.source = source or ("import" if len(self.names) == 1 else "manual")
+
+    @classmethod
+    def from_dict(cls, domain, item):
+        return cls(item.get("names", [domain]), item.get("ips"), item.get("ttl"),
+                   item.get("source"))
+
+    def to_dict(self):
+        return {"names": list(self.names), "ips": self.ips, "ttl": self.ttl,
+                "source": self.source}
+
+
+class DomainIpRegistry:
+    """
+    Remembers which IPs were blocked for each domain so they can be unblocked
+    later without a fresh (and possibly different) DNS lookup.
+    A reverse index (ip -> domains) keeps IPs shared by several domains
+    blocked until the last of them is unblocked.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(config.STATE_DIR, "domain_ips.json")
+        self._records = {}
+        self._owners = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for domain, item in data.get("domains", {}).items():
+            record = DomainRecord.from_dict(domain, item)
+            self._records[domain] = record
+            for ip in record.ips:
+                self._owners.setdefault(ip, set()).add(domain)
+
+    def get(self, domain):
+        with self._lock:
+            self._ensure_loaded()
+            return self._records.get(domain)
+
+    def domains(self):
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._records)
+
+    def managed(self) -> dict:
+        """{domain: names} of the manual blocks (what a policy may unblock)"""
+        with self._lock:
+            self._ensure_loaded()
+            return {domain: record.names for domain, record in self._records.items()
+                    if record.source == "manual"}
+
+    def owners(self, ip):
+        """Domains currently holding a block on this IP"""
+        with self._lock:
+            self._ensure_loaded()
+            return set(self._owners.get(ip, ()))
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._records)
+
+    def _attach(self, domain, ip):
+        self._owners.setdefault(ip, set()).add(domain)
+
+    def _detach(self, domain, ip) -> bool:
+        """Drop ownership, return True if no domain holds the IP any more"""
+        holders = self._owners.get(ip)
+        if holders is None:
+            return True
+        holders.discard(domain)
+        if not holders:
+            del self._owners[ip]
+            return True
+        return False
+
+    def record_block(self, domain, names, ips, ttl=None, now=None, source="manual"):
+        """
+        Record (or extend) the IPs blocked for a domain
+        A manual block takes over an imported record; an import never
+        demotes a manual one.
+        """
+        now = now or time.time()
+        with self._lock:
+            self._ensure_loaded()
+            record = self._records.get(domain)
+            if record is None:
+                record = self._records[domain] = DomainRecord(names, source=source)
+            elif source == "manual" and record.source != "manual":
+                record.names = tuple(names)
+                record.source = source
+            record.ttl = ttl
+            for ip in ips:
+                record.ips[ip] = now
+                self._attach(domain, ip)
+            self._dirty = True
+            return record
+
+    def releasable(self, domain):
+        """
+        What unblocking a domain would give back, without forgetting it yet
+        (call release() once the unblock was applied)
+        Returns: (all recorded IPs, IPs no other domain still holds) or None
+        """
+        with self._lock:
+            self._ensure_loaded()
+            record = self._records.get(domain)
+            if record is None:
+                return None
+            exclusive = [ip for ip in record.ips if self._owners.get(ip, {domain}) <= {domain}]
+            return list(record.ips), exclusive
+
+    def release(self, domain):
+        """
+        Forget a domain
+        Returns: (all recorded IPs, IPs no other domain still holds) or None
+        """
+        with self._lock:
+            self._ensure_loaded()
+            record = self._records.pop(domain, None)
+            if record is None:
+                return None
+            exclusive = [ip for ip in record.ips if self._detach(domain, ip)]
+            self._dirty = True
+            return list(record.ips), exclusive
+
+    def refresh_changes(self, domain, fresh_ips, now=None, stale_after=None, prune=True):
+        """
+        What apply_refresh() would change, without changing anything
+        Returns: (new IPs to block, stale IPs safe to unblock), or None when
+        the domain has no record (any more)
+        """
+        now = now or time.time()
+        stale_after = config.SYNC_STALE_AFTER if stale_after is None else stale_after
+        with self._lock:
+            self._ensure_loaded()
+            record = self._records.get(domain)
+            if record is None:
+                return None
+            # Blocked only when no other domain holds the IP already
+            added = [ip for ip in fresh_ips if ip not in record.ips
+                     and not self._owners.get(ip, set()) - {domain}]
+            fresh = set(fresh_ips)
+            removed = [ip for ip, last_seen in (record.ips.items() if prune else ())
+                       if ip not in fresh and now - last_seen > stale_after
+                       and not self._owners.get(ip, set()) - {domain}]
+            return added, removed
+
+    def apply_refresh(self, domain, fresh_ips, ttl=None, now=None, stale_after=None,
+                      prune=True):
+        """
+        Merge a re-resolution into the record
+        prune=False keeps IPs past stale_after (the lookup gave no usable answer)
+        Returns: (new IPs to block, stale IPs safe to unblock)
+        """
+        now = now or time.time()
+        stale_after = config.SYNC_STALE_AFTER if stale_after is None else stale_after
+        with self._lock:
+            self._ensure_loaded()
+            record = self._records.get(domain)
+            if record is None:
+                return [], []
+            added = [ip for ip in fresh_ips if ip not in record.ips]
+            for ip in fresh_ips:
+                record.ips[ip] = now
+                self._attach(domain, ip)
+            removed = []
+            for ip, last_seen in (list(record.ips.items()) if prune else ()):
+                if now - last_seen > stale_after:
+                    del record.ips[ip]
+                    if self._detach(domain, ip):
+                        removed.append(ip)
+            record.ttl = ttl
+            if added or removed:
+                self._dirty = True
+            # Only block IPs that no other domain had already blocked
+            added = [ip for ip in added if self._owners.get(ip) == {domain}]
+            return added, removed
+
+    def export(self) -> dict:
+        """All records as plain dicts (for snapshots)"""
+        with self._lock:
+            self._ensure_loaded()
+            return {domain: record.to_dict() for domain, record in self._records.items()}
+
+    def replace(self, domains: dict):
+        """
+        Replace every record at once (snapshot restore) and save
+        Returns: (domains that are new, domains that are gone)
+        """
+        with self._lock:
+            self._ensure_loaded()
+            previous = set(self._records)
+            self._records = {}
+            self._owners = {}
+            for domain, item in domains.items():
+                record = DomainRecord.from_dict(domain, item)
+                self._records[domain] = record
+                for ip in record.ips:
+                    self._attach(domain, ip)
+            self._dirty = True
+            added = sorted(set(self._records) - previous)
+            removed = sorted(previous - set(self._records))
+        self.save()
+        return added, removed
+
+    def save(self, force=False):
+        """Write the registry atomically if it changed"""
+        with self._lock:
+            if not (self._dirty or force) or not self._loaded:
+                return False
+            data = {"version": 1,
+                    "domains": {d: r.to_dict() for d, r in self._records.items()}}
+            self._dirty = False
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".domain_ips-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        return True
+
+
+# Shared registry of blocked domain -> IP mappings
+domain_registry = DomainIpRegistry()
@@ -0,0 +1,274 @@
+import asyncio
+import heapq
+import ipaddress
+import logging
+import random
+import time
+
+from backend import config
+from backend.blocklist import get_set_backend
+from backend.dns_resolver import resolver as shared_resolver
+from backend.domain_registry import domain_registry
+from backend.jobs import executor
+from backend.rule_state import rule_state
+from backend.ufw_batch import RuleBatch
+
+logger = logging.getLogger(__name__)
+
+
+def usable_addresses(ips) -> list:
+    """
+    Sorted unique addresses, minus what a lookup of a blocked or missing
+    name returns instead of real ones (0.0.0.0, ::, loopback, the hosts
+    file block address)
+    """
+    usable = set()
+    for ip in ips:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            continue
+        if address.is_unspecified or address.is_loopback or ip == config.HOSTS_BLOCK_ADDRESS:
+            continue
+        usable.add(ip)
+    return sorted(usable)
+
+
+def apply_ip_changes(changes: list) -> dict:
+    """
+    Apply IP diffs for many domains at once
+    changes: list of (domain, ips_to_block, ips_to_unblock)
+    With UFW in batch mode all domains share one rules rewrite and reload.
+    """
+    # Imported here: firewall_domain imports this module for the worker
+    from backend.firewall_domain import (
+        block_ips_in_firewall, queue_ip_blocks, queue_ip_unblocks, unblock_ips_from_firewall,
+    )
+
+    stats = {"domains": len(changes), "blocked": 0, "unblocked": 0}
+    set_backend = get_set_backend()
+    batch = RuleBatch() if config.BATCH_MODE and set_backend is None else None
+
+    for domain, added, removed in changes:
+        if batch is not None:
+            queue_ip_blocks(batch, added, domain)
+            queue_ip_unblocks(batch, removed)
+        else:
+            if added:
+                block_ips_in_firewall(added, domain)
+            if removed:
+                unblock_ips_from_firewall(removed)
+        stats["blocked"] += len(added)
+        stats["unblocked"] += len(removed)
+
+    if batch is not None:
+        stats["batch"] = batch.apply()
+    rule_state.invalidate()
+    return stats
+
+
+class DomainSyncWorker:
+    """
+    Re-resolves blocked domains when their DNS records expire and applies
+    only the difference (new IPs blocked, IPs unseen for SYNC_STALE_AFTER
+    unblocked). Due domains are kept in a heap; each tick takes as many as
+    the global budget allows, resolves them with bounded concurrency and
+    applies all their diffs as one change.
+    """
+
+    def __init__(self, registry=None, resolver=None, concurrency=None, budget=None,
+                 min_interval=None):
+        self.registry = registry or domain_registry
+        self.resolver = resolver or shared_resolver
+        self.concurrency = concurrency or config.SYNC_CONCURRENCY
+        self.budget = config.SYNC_BUDGET if budget is None else budget
+        self.min_interval = config.SYNC_MIN_INTERVAL if min_interval is None else min_interval
+        self._heap = []
+        self._due = {}
+        self._tokens = float(self.budget)
+        self._last_refill = time.monotonic()
+        self._wakeup = None
+        self._loop = None
+        self._task = None
+        self.refreshed = 0
+        self.ips_added = 0
+        self.ips_removed = 0
+        self.last_tick = None
+
+    def ttl_for(self, names) -> float:
+        """Shortest remaining TTL among the cached A/AAAA answers for the names"""
+        remaining = [
+            self.resolver.cache.ttl_remaining(name, rdtype)
+            for name in names for rdtype in ("A", "AAAA")
+        ]
+        remaining = [ttl for ttl in remaining if ttl > 0]
+        return min(remaining) if remaining else config.DNS_DEFAULT_TTL
+
+    def schedule(self, domain, delay=None):
+        """(Re)schedule a domain for re-resolution after delay seconds"""
+        delay = max(self.min_interval, delay if delay is not None else config.DNS_DEFAULT_TTL)
+        due = time.monotonic() + delay
+        self._due[domain] = due
+        heapq.heappush(self._heap, (due, domain))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def schedule_many_threadsafe(self, domains, delay=None):
+        """Schedule domains from a worker thread (e.g. a bulk import)"""
+        if self._loop is None:
+            for domain in domains:
+                self.schedule(domain, delay)
+            return
+        self._loop.call_soon_threadsafe(self._schedule_many, list(domains), delay)
+
+    def _schedule_many(self, domains, delay):
+        for domain in domains:
+            self.schedule(domain, delay)
+
+    def forget(self, domain):
+        # Heap entries are skipped lazily once the domain has no due time
+        self._due.pop(domain, None)
+
+    def _take_tokens(self) -> int:
+        now = time.monotonic()
+        self._tokens = min(float(self.budget), self._tokens + (now - self._last_refill) * self.budget)
+        self._last_refill = now
+        return int(self._tokens)
+
+    def _pop_due(self, limit) -> list:
+        now = time.monotonic()
+        domains = []
+        while self._heap and len(domains) < limit and self._heap[0][0] <= now:
+            due, domain = heapq.heappop(self._heap)
+            if self._due.get(domain) == due:
+                del self._due[domain]
+                domains.append(domain)
+        return domains
+
+    async def _refresh(self, domain, semaphore):
+        record = self.registry.get(domain)
+        if record is None:
+            return None
+        async with semaphore:
+            resolved = await self.resolver.resolve_many(record.names)
+        fresh = usable_addresses(ip for v4, v6 in resolved.values() for ip in v4 + v6)
+        ttl = self.ttl_for(record.names)
+        self.schedule(domain, ttl)
+        # A failed lookup, or only sinkhole answers (the system resolver reads
+        # our own hosts entries), says nothing about which IPs went stale
+        return domain, fresh, ttl, bool(fresh)
+
+    def _apply(self, refreshed) -> dict:
+        """
+        Job body: diff each refresh against the registry, apply the IP
+        changes, then update the records. Runs holding the domains' locks,
+        so a domain unblocked (or reset) meanwhile is skipped.
+        """
+        now = time.time()
+        changes, updates, claimed = [], [], set()
+        for domain, fresh, ttl, prune in refreshed:
+            diff = self.registry.refresh_changes(domain, fresh, now=now, prune=prune)
+            if diff is None:
+                continue
+            updates.append((domain, fresh, ttl, prune))
+            # Another domain of this tick may block the same new IP already
+            added = [ip for ip in diff[0] if ip not in claimed]
+            claimed.update(added)
+            if added or diff[1]:
+                changes.append((domain, added, diff[1]))
+        stats = apply_ip_changes(changes) if changes else {"domains": 0}
+        # Records change only once the firewall did (apply_ip_changes raises)
+        for domain, fresh, ttl, prune in updates:
+            self.registry.apply_refresh(domain, fresh, ttl, now=now, prune=prune)
+        self.ips_added += sum(len(added) for _, added, _ in changes)
+        self.ips_removed += sum(len(removed) for _, _, removed in changes)
+        self.registry.save()
+        return {"status": "success", **stats}
+
+    async def tick(self):
+        """Refresh the due domains the budget allows; returns how many ran"""
+        domains = self._pop_due(self._take_tokens())
+        if not domains:
+            return 0
+        self._tokens -= len(domains)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(self._refresh(domain, semaphore) for domain in domains), return_exceptions=True
+        )
+        refreshed = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("domain re-resolution failed: %s", result)
+            elif result:
+                refreshed.append(result)
+        if refreshed:
+            # A job like every other change: it waits for unblocks / emergency
+            # stops of these domains and shows up in the job list and history
+            job = executor.submit("domain_sync", self._apply, refreshed,
+                                  resources=[f"domain:{domain}" for domain, *_ in refreshed],
+                                  params={"domains": [domain for domain, *_ in refreshed][:20],
+                                          "count": len(refreshed)})
+            await executor.wait(job)
+            if job.status == "failed":
+                logger.warning("domain sync apply failed: %s", job.error)
+        self.refreshed += len(domains)
+        self.last_tick = time.time()
+        return len(domains)
+
+    async def _run(self):
+        # Spread the initial refresh of persisted domains over their TTLs
+        for domain in self.registry.domains():
+            record = self.registry.get(domain)
+            ttl = record.ttl if record and record.ttl else config.DNS_DEFAULT_TTL
+            self.schedule(domain, random.uniform(0, ttl))
+        while True:
+            try:
+                if not await self.tick():
+                    delay = 1.0
+                    if self._heap:
+                        delay = min(delay, max(0.05, self._heap[0][0] - time.monotonic()))
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("domain sync tick failed: %s", e)
+                await asyncio.sleep(1.0)
+
+    def start(self):
+        """Start the worker on the running event loop"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.registry.save()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "tracked_domains": len(self.registry),
+            "scheduled": len(self._due),
+            "refreshed": self.refreshed,
+            "ips_added": self.ips_added,
+            "ips_removed": self.ips_removed,
+            "budget_per_second": self.budget,
+            "concurrency": self.concurrency,
+            "last_tick": self.last_tick,
+        }
+
+
+# Shared worker, started by the API server
+domain_sync = DomainSyncWorker()
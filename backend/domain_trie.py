@@ -0,0 +1,150 @@
+EXACT = 1
+WILDCARD = 2
+SUBTREE = 4
+
+KIND_FLAGS = {"exact": EXACT, "wildcard": WILDCARD, "subtree": SUBTREE}
+FLAG_KINDS = {flag: kind for kind, flag in KIND_FLAGS.items()}
+
+
+def parse_pattern(pattern: str) -> tuple:
+    """
+    Split a rule pattern into (domain, kind)
+    Examples:
+        'example.com'    -> ('example.com', 'exact')     only that name
+        '*.example.com'  -> ('example.com', 'wildcard')  any subdomain, not the name itself
+        '.example.com'   -> ('example.com', 'subtree')   the name and every subdomain
+    """
+    pattern = pattern.strip().lower().rstrip(".")
+    if pattern.startswith("*."):
+        return pattern[2:], "wildcard"
+    if pattern.startswith("."):
+        return pattern[1:], "subtree"
+    return pattern, "exact"
+
+
+def format_pattern(domain: str, kind: str) -> str:
+    if kind == "wildcard":
+        return f"*.{domain}"
+    if kind == "subtree":
+        return f".{domain}"
+    return domain
+
+
+class _Node:
+    __slots__ = ("children", "flags")
+
+    def __init__(self):
+        self.children = None
+        self.flags = 0
+
+
+class DomainTrie:
+    """
+    Trie over reversed domain labels (com -> example -> cdn).
+    Each node can carry exact / wildcard / subtree rules, so a lookup walks
+    at most one node per label of the queried name.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, domain: str, kind: str = "exact") -> bool:
+        node = self._root
+        for label in reversed(domain.split(".")):
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        flag = KIND_FLAGS[kind]
+        if node.flags & flag:
+            return False
+        node.flags |= flag
+        self._count += 1
+        return True
+
+    def remove(self, domain: str, kind: str = "exact") -> bool:
+        path = []
+        node = self._root
+        for label in reversed(domain.split(".")):
+            if node.children is None or label not in node.children:
+                return False
+            path.append((node, label))
+            node = node.children[label]
+        flag = KIND_FLAGS[kind]
+        if not node.flags & flag:
+            return False
+        node.flags &= ~flag
+        self._count -= 1
+        # Prune empty branches
+        while path and not node.flags and not node.children:
+            parent, label = path.pop()
+            del parent.children[label]
+            if not parent.children:
+                parent.children = None
+            node = parent
+        return True
+
+    def match(self, name: str):
+        """
+        Most specific rule covering a name, or None
+        Returns: (rule domain, kind)
+        """
+        labels = name.strip().lower().rstrip(".").split(".")
+        node = self._root
+        best = None
+        depth = 0
+        total = len(labels)
+        for label in reversed(labels):
+            if node.children is None:
+                break
+            node = node.children.get(label)
+            if node is None:
+                break
+            depth += 1
+            if node.flags:
+                suffix = ".".join(labels[total - depth:])
+                if depth == total and node.flags & EXACT:
+                    best = (suffix, "exact")
+                elif node.flags & SUBTREE:
+                    best = (suffix, "subtree")
+                elif depth < total and node.flags & WILDCARD:
+                    best = (suffix, "wildcard")
+        return best
+
+    def _find(self, domain: str):
+        node = self._root
+        if not domain:
+            return node
+        for label in reversed(domain.split(".")):
+            if node.children is None:
+                return None
+            node = node.children.get(label)
+            if node is None:
+                return None
+        return node
+
+    def iter_under(self, domain: str = ""):
+        """
+        Yield (domain, kind) for every rule at or below a domain, in
+        reversed-label order (all of example.com's subdomains together)
+        """
+        start = self._find(domain)
+        if start is None:
+            return
+        stack = [(start, domain.split(".")[::-1] if domain else [])]
+        while stack:
+            node, labels = stack.pop()
+            if node.flags:
+                name = ".".join(reversed(labels))
+                for flag, kind in FLAG_KINDS.items():
+                    if node.flags & flag:
+                        yield name, kind
+            if node.children:
+                for label in sorted(node.children, reverse=True):
+                    stack.append((node.children[label], labels + [label]))
@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import time
+
+from backend.hosts_file import hosts_file
+from backend.rule_state import rule_state
+from backend.ufw_rules import diff_rules
+
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT = 15.0
+
+
+class EventBus:
+    """
+    Fans change events out to streaming clients.
+    publish() may be called from any thread; each subscriber gets its own
+    bounded queue. A subscriber that falls too far behind is told to
+    resync (it then gets a fresh snapshot) instead of blocking the bus.
+    """
+
+    def __init__(self, queue_size=1000, history=1000):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._seq = itertools.count(1)
+        self._loop = None
+        self.recent = collections.deque(maxlen=history)
+        self.published = 0
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def publish(self, event_type: str, data: dict):
+        event = {"id": next(self._seq), "type": event_type, "time": time.time(), "data": data}
+        self.recent.append(event)
+        self.published += 1
+        if self._loop is None or not self._subscribers:
+            return event
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, event)
+        except RuntimeError:
+            # Loop closed during shutdown
+            pass
+        return event
+
+    def _deliver(self, event):
+        for queue in list(self._subscribers):
+            if queue.full():
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+            else:
+                queue.put_nowait(event)
+
+    def subscribe(self) -> asyncio.Queue:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subscribers), "published": self.published}
+
+
+def _on_rules_changed(previous, snapshot):
+    if previous is None:
+        return
+    added, removed = diff_rules(previous.rules, snapshot.rules)
+    if removed:
+        events.publish("rule_removed", {"rules": [rule.to_dict() for rule in removed],
+                                        "generation": snapshot.generation})
+    if added:
+        events.publish("rule_added", {"rules": [rule.to_dict() for rule in added],
+                                      "generation": snapshot.generation})
+    if not added and not removed and previous.active != snapshot.active:
+        events.publish("status_changed", {"active": snapshot.active,
+                                          "generation": snapshot.generation})
+
+
+def _on_hosts_changed(added, removed):
+    if added is None:
+        # Edited outside the API: clients should reload the list
+        events.publish("resync", {"reason": "hosts file changed on disk"})
+        return
+    if removed:
+        events.publish("domain_unblocked", {"domains": sorted(removed),
+                                            "generation": hosts_file.generation})
+    if added:
+        events.publish("domain_blocked", {"domains": sorted(added),
+                                          "generation": hosts_file.generation})
+
+
+def format_sse(event: dict) -> str:
+    """One Server-Sent Events frame"""
+    lines = []
+    if event.get("id") is not None:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event.get('data', {}))}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def event_stream(snapshot_factory, queue):
+    """
+    SSE generator: a full snapshot first, then only change events.
+    snapshot_factory() returns the snapshot payload (called again on resync).
+    """
+    try:
+        yield format_sse({"type": "snapshot", "data": await snapshot_factory()})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event["type"] == "resync":
+                yield format_sse({"type": "snapshot", "data": await snapshot_factory()})
+            else:
+                yield format_sse(event)
+    finally:
+        events.unsubscribe(queue)
+
+
+# Shared bus; the rule cache and hosts file feed it
+events = EventBus()
+rule_state.add_listener(_on_rules_changed)
+hosts_file.add_listener(_on_hosts_changed)
@@ -1,13 +1,36 @@
-from fastapi import APIRouter
-import subprocess
-import socket
-import re
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+import os
+import tempfile
+import threading
+
+from backend import config
+from backend.blocklist import get_set_backend
+from backend.blocklist_import import FORMATS, iter_file_lines, run_import_job
+from backend.cidr_aggregate import cidr_aggregator
+from backend.coalescer import coalescer
+from backend.conditional import if_none_match, make_etag, not_modified
+from backend.dns_resolver import resolver
+from backend.domain_index import domain_index
+from backend.domain_registry import domain_registry
+from backend.domain_sync import domain_sync
+from backend.domain_trie import format_pattern, parse_pattern
+from backend.events import events
+from backend.helper_client import helper
+from backend.hosts_file import hosts_file
+from backend.jobs import job_response, jobs
+from backend.rule_state import rule_state
+from backend.system_files import run_process
+from backend.ufw_batch import RuleBatch, RuleSpec
 
 router = APIRouter(prefix="/api/firewall/domain", tags=["Domain Rules"])
 
 def run_cmd(cmd: str):
     """Execute shell command and return output"""
-    result = subprocess.run(cmd, shell=True, text=True, capture_output=True)
+    routed = helper.run_command(cmd)
+    if routed is not None:
+        return routed[1].strip() + routed[2].strip()
+    result = run_process(cmd, shell=True, text=True, capture_output=True)
     return result.stdout.strip() + result.stderr.strip()
 
 def normalize_domain(domain: str) -> tuple:
@@ -33,71 +56,83 @@ def normalize_domain(domain: str) -> tuple:
 
 def get_all_ips_for_domain(domain: str) -> tuple:
     """
-    Resolve domain to all IPv4 and IPv6 addresses.
+    Resolve domain to all IPv4 and IPv6 addresses (through the shared TTL cache).
     Returns: (list[ipv4], list[ipv6])
     """
-    ipv4_addresses = []
-    ipv6_addresses = []
-    
-    try:
-        # Get IPv4 addresses
-        ipv4_info = socket.getaddrinfo(domain, None, socket.AF_INET)
-        ipv4_addresses = list(set([addr[4][0] for addr in ipv4_info]))
-    except Exception:
-        pass
-    
-    try:
-        # Get IPv6 addresses
-        ipv6_info = socket.getaddrinfo(domain, None, socket.AF_INET6)
-        ipv6_addresses = list(set([addr[4][0] for addr in ipv6_info]))
-    except Exception:
-        pass
-    
-    return ipv4_addresses, ipv6_addresses
+    return resolver.resolve_sync(domain)
 
 def get_blocked_domains() -> set:
-    """Get list of currently blocked domains from /etc/hosts"""
-    blocked = set()
-    try:
-        with open('/etc/hosts', 'r') as f:
-            for line in f:
-                if line.strip().startswith('0.0.0.0'):
-                    parts = line.strip().split()
-                    if len(parts) >= 2:
-                        blocked.add(parts[1])
-    except Exception:
-        pass
-    return blocked
+    """Get list of currently blocked domains (from the in-memory hosts index)"""
+    return hosts_file.blocked()
 
 def add_to_hosts(domains: list):
-    """Add domains to /etc/hosts with 0.0.0.0"""
-    existing = get_blocked_domains()
-    to_add = [d for d in domains if d not in existing]
+    """Add domains to the managed section of /etc/hosts with 0.0.0.0"""
+    added, _ = hosts_file.apply(add=domains)
     
-    if not to_add:
+    if not added:
         return f"Domains already in /etc/hosts"
     
-    entries = "\n".join([f"0.0.0.0 {d}" for d in to_add]) + "\n"
-    cmd = f"echo '{entries}' | sudo tee -a /etc/hosts > /dev/null"
-    run_cmd(cmd)
-    return f"Added {len(to_add)} domain(s) to /etc/hosts"
+    return f"Added {len(added)} domain(s) to /etc/hosts"
 
 def remove_from_hosts(domains: list):
-    """Remove domains from /etc/hosts"""
+    """Remove domains from /etc/hosts (one rewrite for all of them)"""
+    hosts_file.apply(remove=domains)
+    return ", ".join(f"Removed {domain}" for domain in domains)
+
+LOCALHOST_IPS = {'127.0.0.1', '0.0.0.0', '::1', '::'}
+
+def queue_ip_blocks(batch: RuleBatch, ips: list, domain: str) -> list:
+    """Queue the in/out deny rules for each IP into a RuleBatch (not applied)"""
     results = []
-    for domain in domains:
-        cmd = f"sudo sed -i '/^0.0.0.0.*{re.escape(domain)}$/d' /etc/hosts"
-        run_cmd(cmd)
-        results.append(f"Removed {domain}")
-    return ", ".join(results)
+    if cidr_aggregator.enabled:
+        ips = [ip for ip in ips if ip not in LOCALHOST_IPS]
+        batch.block_addresses(ips, comment=f"Blocked {domain}")
+        return [result for ip in ips for result in (f"OUT: {ip}", f"IN: {ip}")]
+    for ip in ips:
+        if ip in LOCALHOST_IPS:
+            continue
+        batch.add(RuleSpec("deny", "out", dst=ip, comment=f"Blocked {domain}"))
+        batch.add(RuleSpec("deny", "in", src=ip, comment=f"Blocked {domain}"))
+        results.extend([f"OUT: {ip}", f"IN: {ip}"])
+    return results
+
+def queue_ip_unblocks(batch: RuleBatch, ips: list) -> list:
+    """Queue deletion of the in/out deny rules for each IP (not applied)"""
+    results = []
+    if cidr_aggregator.enabled:
+        ips = [ip for ip in ips if ip not in LOCALHOST_IPS]
+        batch.unblock_addresses(ips)
+        return ips
+    for ip in ips:
+        if ip in LOCALHOST_IPS:
+            continue
+        batch.delete(RuleSpec("deny", "out", dst=ip))
+        batch.delete(RuleSpec("deny", "in", src=ip))
+        results.append(ip)
+    return results
 
-def block_ips_in_firewall(ips: list, domain: str):
-    """Block list of IPs in UFW firewall"""
+def block_ips_in_firewall(ips: list, domain: str, batch: RuleBatch = None):
+    """
+    Block list of IPs in UFW firewall
+    If a RuleBatch is given, all rules are applied with one reload
+    With the nftables backend the IPs go into kernel sets instead
+    """
     results = []
-    localhost_ips = {'127.0.0.1', '0.0.0.0', '::1', '::'}
+    
+    set_backend = get_set_backend()
+    if set_backend is not None:
+        return set_backend.block([ip for ip in ips if ip not in LOCALHOST_IPS], domain)
+    
+    if batch is None and cidr_aggregator.enabled:
+        # Aggregated rules are always computed and applied as a batch
+        batch = RuleBatch()
+    if batch is not None:
+        results = queue_ip_blocks(batch, ips, domain)
+        batch.apply()
+        return results
     
     for ip in ips:
-        if ip in localhost_ips:
+        if ip in LOCALHOST_IPS:
             continue
         
         # Block outbound
@@ -112,13 +147,27 @@ def block_ips_in_firewall(ips: list, domain: str):
     
     return results
 
-def unblock_ips_from_firewall(ips: list):
-    """Remove IP blocking rules from UFW firewall"""
+def unblock_ips_from_firewall(ips: list, batch: RuleBatch = None):
+    """
+    Remove IP blocking rules from UFW firewall
+    If a RuleBatch is given, all rules are removed with one reload
+    With the nftables backend the IPs are removed from the kernel sets
+    """
     results = []
-    localhost_ips = {'127.0.0.1', '0.0.0.0', '::1', '::'}
+    
+    set_backend = get_set_backend()
+    if set_backend is not None:
+        return set_backend.unblock([ip for ip in ips if ip not in LOCALHOST_IPS])
+    
+    if batch is None and cidr_aggregator.enabled:
+        batch = RuleBatch()
+    if batch is not None:
+        results = queue_ip_unblocks(batch, ips)
+        batch.apply()
+        return results
     
     for ip in ips:
-        if ip in localhost_ips:
+        if ip in LOCALHOST_IPS:
             continue
         
         # Try to delete rules (ignore errors if rule doesn't exist)
@@ -133,27 +182,186 @@ def flush_dns_cache():
     run_cmd("sudo systemd-resolve --flush-caches 2>/dev/null || sudo resolvectl flush-caches 2>/dev/null || true")
     return "DNS cache flushed"
 
+@router.post("/import", status_code=202)
+async def import_blocklist(request: Request, format: str = "auto", path: str = None,
+                           resolve: bool = False):
+    """
+    Bulk-import a blocklist into /etc/hosts.
+    Send the list as the (streamed) request body, or pass ?path= for a local
+    file (.gz allowed). format: auto, hosts, plain or adblock (||domain^).
+    resolve=true also hands the domains to the background re-resolver so
+    their IPs get blocked within the sync budget.
+    Poll GET /api/firewall/domain/import/{job_id} for progress.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400,
+                            detail=f"Invalid format: {format}. Valid formats: {', '.join(FORMATS)}")
+    
+    cleanup_path = None
+    if path:
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=400, detail=f"File not found: {path}")
+        source = path
+    else:
+        # Spool the upload to disk so parsing never holds the whole list in memory
+        fd, source = tempfile.mkstemp(prefix="fw-import-")
+        cleanup_path = source
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+    
+    job = jobs.create("blocklist_import", {"format": format, "path": path, "resolve": resolve})
+    threading.Thread(
+        target=run_import_job,
+        kwargs={
+            "job": job,
+            "lines_factory": lambda: iter_file_lines(source),
+            "fmt": format,
+            "flush_dns": flush_dns_cache,
+            "on_batch": track_imported_domains if resolve else None,
+            "total_bytes": os.path.getsize(source),
+            "cleanup_path": cleanup_path,
+        },
+        name=f"import-{job.id}",
+        daemon=True,
+    ).start()
+    return {"status": "accepted", "job_id": job.id,
+            "status_url": f"/api/firewall/domain/import/{job.id}"}
+
+@router.get("/import/{job_id}")
+def import_status(job_id: str):
+    """Progress / result of a bulk import"""
+    job = jobs.get(job_id)
+    if job is None or job.kind != "blocklist_import":
+        raise HTTPException(status_code=404, detail=f"Unknown import job: {job_id}")
+    return job.to_dict()
+
+def track_imported_domains(domains: list):
+    """Register imported domains with the sync worker so their IPs get blocked"""
+    for domain in domains:
+        domain_registry.record_block(domain, [domain], [], source="import")
+    domain_sync.schedule_many_threadsafe(domains, 0)
+
 @router.post("/{domain}/{action}")
-def manage_domain(domain: str, action: str):
+async def domain_action(domain: str, action: str, wait: bool = False, ttl: float = None):
+    """
+    Block or unblock a domain, wildcard ('*.xyz.com') or subtree ('.xyz.com').
+    Runs as a job locked on the domain (202 + job id, or ?wait=true for the result)
+    ?ttl=<seconds> applies it as a schedule that restores the previous state afterwards
+    """
+    if action.lower() not in ("block", "unblock"):
+        return {
+            "status": "error",
+            "message": "Invalid action. Use 'block' or 'unblock'."
+        }
+    if ttl is not None:
+        # Imported here: the scheduler builds on this module
+        from backend.schedules import create_schedule
+        return await create_schedule({"name": f"{domain} {action.lower()} for {ttl:g}s",
+                                      "action": action.lower(), "domains": [domain],
+                                      "duration": ttl}, wait)
+    rule_domain, kind = parse_pattern(domain)
+    base_domain = rule_domain if kind != "exact" else normalize_domain(domain)[0]
+    # Requests for the same domain / rule within the window apply only the last action
+    job = coalescer.submit(("domain", format_pattern(base_domain, kind)), action.lower(),
+                           "domain_action", manage_domain, domain, action,
+                           resources=[f"domain:{base_domain}"],
+                           params={"domain": domain, "action": action.lower()})
+    return await job_response(job, wait)
+
+async def manage_domain(domain: str, action: str):
     """
     Block or unblock a domain (works with both www.xyz.com and xyz.com).
     Automatically handles both variants regardless of what user enters.
+    DNS lookups for both variants run concurrently on the event loop; the
+    hosts-file and firewall changes run in the threadpool.
     """
+    if action.lower() not in ("block", "unblock"):
+        return {
+            "status": "error",
+            "message": "Invalid action. Use 'block' or 'unblock'."
+        }
+    
     try:
+        rule_domain, kind = parse_pattern(domain)
+        if kind != "exact":
+            return await manage_domain_pattern(rule_domain, kind, action.lower())
+        
         # Normalize domain to get both variants
         base_domain, www_domain = normalize_domain(domain)
         all_domains = [base_domain, www_domain]
         
-        # Get IPs for both variants
-        base_ipv4, base_ipv6 = get_all_ips_for_domain(base_domain)
-        www_ipv4, www_ipv6 = get_all_ips_for_domain(www_domain)
+        if action.lower() == "unblock" and domain_registry.get(base_domain) is not None:
+            # Unblock exactly what was blocked (tracked by the sync worker),
+            # keeping IPs that another blocked domain still resolves to
+            all_ips, exclusive = domain_registry.releasable(base_domain)
+            all_ipv4 = [ip for ip in exclusive if ":" not in ip]
+            all_ipv6 = [ip for ip in exclusive if ":" in ip]
+            response = await run_in_threadpool(
+                apply_domain_action, action, base_domain, www_domain, all_ipv4, all_ipv6
+            )
+            if response.get("status") == "success":
+                # Forget the record only once its rules are gone
+                domain_registry.release(base_domain)
+                domain_sync.forget(base_domain)
+            response["recorded_ips"] = len(all_ips)
+            return response
+        
+        # Get IPs for both variants (A + AAAA, all four queries at once)
+        resolved = await resolver.resolve_many(all_domains)
+        base_ipv4, base_ipv6 = resolved[base_domain]
+        www_ipv4, www_ipv6 = resolved[www_domain]
         
         # Combine and deduplicate IPs
         all_ipv4 = list(set(base_ipv4 + www_ipv4))
         all_ipv6 = list(set(base_ipv6 + www_ipv6))
-        all_ips = all_ipv4 + all_ipv6
         
+        response = await run_in_threadpool(
+            apply_domain_action, action, base_domain, www_domain, all_ipv4, all_ipv6
+        )
+        if action.lower() == "block" and response.get("status") == "success":
+            # Track the IPs so the sync worker can follow DNS changes
+            ttl = domain_sync.ttl_for(all_domains)
+            domain_registry.record_block(base_domain, all_domains, all_ipv4 + all_ipv6, ttl)
+            domain_sync.schedule(base_domain, ttl)
+        return response
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+async def manage_domain_pattern(rule_domain: str, kind: str, action: str) -> dict:
+    """
+    Block or unblock a wildcard ('*.xyz.com') or subtree ('.xyz.com') rule.
+    /etc/hosts has no wildcards, so the rule itself lives in the domain index
+    (listed by /blocked, reported but not enforced by /check). A subtree rule
+    also blocks the base domain itself through the normal hosts + firewall path.
+    """
+    pattern = format_pattern(rule_domain, kind)
+    if action == "block":
+        domain_index.add_pattern(pattern)
+    elif not domain_index.remove_pattern(pattern):
+        return {"status": "error", "message": f"No rule for {pattern}"}
+    
+    events.publish("domain_blocked" if action == "block" else "domain_unblocked",
+                   {"domains": [pattern], "generation": hosts_file.generation})
+    # Subdomains matching the rule are not blocked until they are blocked by name
+    response = {"status": "success", "rule": pattern, "kind": kind, "enforced": False}
+    if kind == "subtree":
+        response["base"] = await manage_domain(rule_domain, action)
+    response["message"] = f"{action.capitalize()}ed rule {pattern}"
+    return response
+
+def apply_domain_action(action: str, base_domain: str, www_domain: str,
+                        all_ipv4: list, all_ipv6: list):
+    """Apply a block/unblock for already-resolved addresses (blocking I/O)"""
+    all_domains = [base_domain, www_domain]
+    all_ips = all_ipv4 + all_ipv6
+    
+    try:
         results = []
+        batch = RuleBatch() if config.BATCH_MODE else None
         
         if action.lower() == "block":
             # 1. Add to /etc/hosts (DNS level blocking)
@@ -161,14 +369,15 @@ def manage_domain(domain: str, action: str):
             results.append(hosts_result)
             
             # 2. Block IPs in firewall
-            firewall_results = block_ips_in_firewall(all_ips, base_domain)
+            firewall_results = block_ips_in_firewall(all_ips, base_domain, batch)
             results.extend(firewall_results)
+            rule_state.invalidate()
             
             # 3. Flush DNS cache
             flush_result = flush_dns_cache()
             results.append(flush_result)
             
-            return {
+            response = {
                 "status": "success",
                 "action": "blocked",
                 "domains_blocked": all_domains,
@@ -178,6 +387,9 @@ def manage_domain(domain: str, action: str):
                 "total_rules": len(firewall_results),
                 "message": f"Blocked {base_domain} and {www_domain} ({len(all_ips)} IPs)"
             }
+            if batch is not None:
+                response["batch"] = batch.stats()
+            return response
             
         elif action.lower() == "unblock":
             # 1. Remove from /etc/hosts
@@ -185,14 +397,15 @@ def manage_domain(domain: str, action: str):
             results.append(hosts_result)
             
             # 2. Unblock IPs from firewall
-            firewall_results = unblock_ips_from_firewall(all_ips)
+            firewall_results = unblock_ips_from_firewall(all_ips, batch)
             results.extend(firewall_results)
+            rule_state.invalidate()
             
             # 3. Flush DNS cache
             flush_result = flush_dns_cache()
             results.append(flush_result)
             
-            return {
+            response = {
                 "status": "success",
                 "action": "unblocked",
                 "domains_unblocked": all_domains,
@@ -201,6 +414,9 @@ def manage_domain(domain: str, action: str):
                 "total_ips": len(all_ips),
                 "message": f"Unblocked {base_domain} and {www_domain} ({len(all_ips)} IPs)"
             }
+            if batch is not None:
+                response["batch"] = batch.stats()
+            return response
         else:
             return {
                 "status": "error",
@@ -213,19 +429,70 @@ def manage_domain(domain: str, action: str):
             "message": str(e)
         }
 
+@router.get("/resolver")
+def resolver_status():
+    """DNS resolver cache statistics (hits, misses, negative answers)"""
+    return {"status": "success", **resolver.stats()}
+
+@router.get("/sync")
+def domain_sync_status():
+    """State of the background re-resolution worker"""
+    return {"status": "success", **domain_sync.stats()}
+
+@router.get("/blocklist")
+def blocklist_backend_status():
+    """Report which backend enforces IP blocks and how large it is"""
+    set_backend = get_set_backend()
+    if set_backend is None:
+        return {"status": "success", "backend": "ufw",
+                "aggregation": cidr_aggregator.stats()}
+    return {"status": "success", **set_backend.stats()}
+
+@router.get("/check/{domain}")
+def check_domain(domain: str):
+    """Is a domain blocked, and by which exact / wildcard / subtree rule?"""
+    return {"status": "success", **domain_index.check(domain)}
+
 @router.get("/blocked")
-def list_blocked_domains():
-    """Get list of all currently blocked domains"""
+def list_blocked_domains(request: Request, response: Response, offset: int = 0,
+                         limit: int = 1000, prefix: str = None, under: str = None,
+                         since: int = None):
+    """
+    Get a page of currently blocked domains and rules, sorted
+    prefix: only names starting with this text
+    under:  only rules at or below this domain (e.g. under=example.com)
+    since:  only names / rules added or removed after this generation
+    Carries an ETag; If-None-Match gets 304 without reading /etc/hosts.
+    """
+    if offset < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
     try:
-        blocked = sorted(list(get_blocked_domains()))
-        return {
+        generation = domain_index.generation
+        etag = make_etag("domains", generation, offset, limit, prefix or "", under or "",
+                         "" if since is None else f"since{since}")
+        if if_none_match(request, etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+
+        if since is not None:
+            changes = domain_index.changes_since(since, prefix=prefix, under=under)
+            if changes is not None:
+                return {"status": "success", "since": since, **changes}
+        page = domain_index.list(offset=offset, limit=limit, prefix=prefix, under=under)
+        result = {
             "status": "success",
-            "blocked_domains": blocked,
-            "total": len(blocked)
+            "blocked_domains": page["items"],
+            "total": page["total"],
+            "offset": page["offset"],
+            "limit": page["limit"],
+            "next_offset": page["next_offset"],
+            "generation": generation,
         }
+        if since is not None:
+            result.update(since=since, reset=True)
+        return result
     except Exception as e:
         return {
             "status": "error",
             "message": str(e)
         }
-
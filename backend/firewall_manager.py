@@ -1,6 +1,10 @@
 import subprocess
 import re
 
+from backend.helper_client import helper
+from backend.system_files import run_process
+from backend.ufw_batch import RuleSpec, resolve_service
+
 class FirewallManager:
     """
     Manages UFW rules for HTTP, HTTPS, DNS, SSH, and custom ports.
@@ -38,8 +42,15 @@ class FirewallManager:
 
     def run_cmd(self, cmd):
         """Run a shell command and return output or error"""
+        # Through the privileged helper when it is running (no shell, no sudo)
+        routed = helper.run_command(cmd)
+        if routed is not None:
+            returncode, stdout, stderr = routed
+            if returncode != 0:
+                return f"Error: {stderr.strip()}"
+            return stdout.strip()
         try:
-            result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
+            result = run_process(cmd, shell=True, check=True, capture_output=True, text=True)
             return result.stdout.strip()
         except subprocess.CalledProcessError as e:
             return f"Error: {e.stderr.strip()}"
@@ -249,6 +260,35 @@ class FirewallManager:
             if all("Could not delete" in r or not r for r in [result1, result2, result3, result4, result5, result6]):
                 break
 
+    def toggle_rule_changes(self, port, proto, action):
+        """
+        Rule changes toggle_service / toggle_port make, as (op, RuleSpec) pairs
+        for a RuleBatch: delete every allow/deny variant, then add the new
+        in + out rules
+        """
+        changes = []
+        for verb in ("allow", "deny"):
+            for direction in ("in", "out"):
+                changes.append(("delete", RuleSpec(verb, direction, port=port, proto=proto)))
+        verb = "allow" if action == "on" else "deny"
+        for direction in ("in", "out"):
+            changes.append(("add", RuleSpec(verb, direction, port=port, proto=proto)))
+        return changes
+
+    def apply_batch(self, batch, changes):
+        """
+        Queue (op, RuleSpec) pairs into a RuleBatch and apply it
+        Returns: summary string in the style of the sequential ufw output
+        """
+        for op, spec in changes:
+            if op == "add":
+                batch.add(spec)
+            else:
+                batch.delete(spec)
+        stats = batch.apply()
+        return (f"Rules updated: {stats['rules_added']} added, {stats['rules_removed']} removed "
+                f"({stats['processes']} processes, {stats['reloads']} reloads)")
+
     def service_status(self):
         """Return all firewall rules"""
         return self.run_cmd("sudo ufw status numbered")
@@ -257,17 +297,22 @@ class FirewallManager:
         """Reset all rules (use carefully)"""
         return self.run_cmd("sudo ufw --force reset")
 
-    def toggle_service(self, service, action):
+    def toggle_service(self, service, action, batch=None):
         """
         Toggle service on/off with proper rule cleanup and validation
+        If a RuleBatch is given, all changes are applied with one reload
         """
         # Validate inputs
-        is_valid, error = self.validate_service(service)
-        if not is_valid:
+        error = self.check_service_toggle(service, action)
+        if error:
             return f"Error: {error}"
         
-        if action not in ["on", "off"]:
-            return "Error: Invalid action. Use 'on' or 'off'"
+        if batch is not None:
+            try:
+                port, proto = resolve_service(service.lower().strip())
+                return self.apply_batch(batch, self.toggle_rule_changes(port, proto, action))
+            except (RuntimeError, ValueError) as e:
+                return f"Error: {e}"
         
         # First, delete any existing rules for this service
         self.delete_service_rules(service)
@@ -278,30 +323,65 @@ class FirewallManager:
         else:
             return self.deny_service(service)
     
-    def toggle_port(self, port, action, proto="tcp"):
+    def check_service_toggle(self, service, action):
         """
-        Toggle port on/off with proper rule cleanup and validation
-        Handles all boundary cases
+        Validate a toggle_service request without changing anything
+        Returns: error message or None
+        """
+        is_valid, error = self.validate_service(service)
+        if not is_valid:
+            return error
+        if action not in ["on", "off"]:
+            return "Invalid action. Use 'on' or 'off'"
+        return None
+
+    def check_port_toggle(self, port, action, proto="tcp"):
+        """
+        Validate a toggle_port request without changing anything
+        Returns: (error message or None, warning message or None)
         """
         # Validate port
         is_valid, error, warning = self.validate_port(port)
         if not is_valid:
-            return {"success": False, "error": error}
+            return error, None
         
         # Validate protocol
         proto_valid, proto_error = self.validate_protocol(proto)
         if not proto_valid:
-            return {"success": False, "error": proto_error}
+            return proto_error, None
         
         # Validate action
         if action not in ["on", "off"]:
-            return {"success": False, "error": "Invalid action. Use 'on' or 'off'"}
+            return "Invalid action. Use 'on' or 'off'", None
         
         # Extra protection for critical ports when blocking
         if action == "off" and port in self.PROTECTED_PORTS:
+            return f"Cannot block port {port} - {self.PROTECTED_PORTS[port]}", None
+        return None, warning
+
+    def toggle_port(self, port, action, proto="tcp", batch=None):
+        """
+        Toggle port on/off with proper rule cleanup and validation
+        Handles all boundary cases
+        If a RuleBatch is given, all changes are applied with one reload
+        """
+        error, warning = self.check_port_toggle(port, action, proto)
+        if error:
+            return {"success": False, "error": error}
+        
+        if batch is not None:
+            try:
+                result = self.apply_batch(batch, self.toggle_rule_changes(port, proto, action))
+            except (RuntimeError, ValueError) as e:
+                return {"success": False, "error": str(e)}
             return {
-                "success": False, 
-                "error": f"Cannot block port {port} - {self.PROTECTED_PORTS[port]}"
+                "success": True,
+                "result": result,
+                "warning": warning,
+                "port": port,
+                "protocol": proto,
+                "action": action,
+                "batch": batch.stats()
             }
         
         # First, delete any existing rules for this port
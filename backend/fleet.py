@@ -0,0 +1,421 @@
+"""
+Fleet mode: push one change to many firewall backends at once
+Every backend is an agent (its normal API); any of them can act as the
+controller of the agents in its registry. A change is sent to all
+selected agents concurrently over pooled keep-alive connections, with a
+per-host timeout and retries, and the per-host results come back as one
+response.
+"""
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+from fastapi import APIRouter, Body, HTTPException
+
+from backend import config
+from backend.metrics import metrics
+
+try:
+    import httpx
+    HAVE_HTTPX = True
+except ImportError:  # pragma: no cover - optional dependency
+    HAVE_HTTPX = False
+
+router = APIRouter(prefix="/api/firewall/fleet", tags=["Fleet"])
+
+NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.:-]{0,62}$")
+# Answers from an agent (or a proxy in front of it) that was not ready
+RETRY_STATUS = {502, 503, 504}
+# Longest non-JSON response body kept in a result
+MAX_TEXT = 2000
+
+fleet_duration = metrics.histogram(
+    "firewall_fleet_request_duration_seconds", "Requests to fleet agents, retries included",
+    ("agent", "outcome"))
+
+
+def parse_agent_url(url) -> str:
+    """Validate an agent base URL ('http://host:8000'); returns it without trailing slash"""
+    text = str(url or "").strip().rstrip("/")
+    parts = urlsplit(text)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise ValueError(f"Invalid agent URL: {url}. Use http(s)://host:port")
+    if parts.query or parts.fragment:
+        raise ValueError(f"Invalid agent URL: {url}. No query or fragment allowed")
+    return text
+
+
+def parse_agent_list(text) -> list:
+    """'web1=http://10.0.0.5:8000,http://10.0.0.6:8000' -> [(name, url), ...]"""
+    agents = []
+    for entry in str(text or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, url = entry.partition("=")
+        if not sep:
+            url = entry
+            name = urlsplit(entry.rstrip("/")).netloc
+        agents.append((name.strip(), url.strip()))
+    return agents
+
+
+def failed(status_code, body) -> bool:
+    """A 4xx/5xx answer, or a finished job that reports an error"""
+    if status_code >= 400:
+        return True
+    for item in (body, body.get("result") if isinstance(body, dict) else None):
+        if isinstance(item, dict) and (item.get("status") in ("error", "failed")
+                                       or item.get("success") is False):
+            return True
+    return False
+
+
+class Fleet:
+    """
+    Registry of agents plus the client that fans requests out to them.
+    Agents added through the API are saved in `path`; those configured
+    with FIREWALL_FLEET_AGENTS are (re-)added at every start. The HTTP
+    client and its connection pool are created on first use and shared by
+    all fan-outs; a semaphore keeps at most `concurrency` requests in
+    flight across all of them.
+    """
+
+    def __init__(self, path=None, concurrency=None, timeout=None, connect_timeout=None,
+                 retries=None, backoff=None, token=None):
+        self.path = path or config.FLEET_REGISTRY
+        self.concurrency = max(1, concurrency or config.FLEET_CONCURRENCY)
+        self.timeout = timeout or config.FLEET_TIMEOUT
+        self.connect_timeout = connect_timeout or config.FLEET_CONNECT_TIMEOUT
+        self.retries = config.FLEET_RETRIES if retries is None else max(0, retries)
+        self.backoff = config.FLEET_RETRY_BACKOFF if backoff is None else backoff
+        self.token = config.FLEET_TOKEN if token is None else token
+        self._agents = {}
+        self._health = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._client = None
+        self._slots = None
+        self._loop = None
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    # -- registry -----------------------------------------------------------
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        for item in data.get("agents", []):
+            self._agents[item["name"]] = item
+        for name, url in parse_agent_list(config.FLEET_AGENTS):
+            try:
+                self._agents[name] = {"name": name, "url": parse_agent_url(url),
+                                      "added_at": time.time(), "source": "config"}
+            except ValueError:
+                continue
+
+    def _save(self):
+        """Write the registry atomically (called with the lock held)"""
+        data = {"version": 1, "agents": list(self._agents.values())}
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".fleet-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def agents(self) -> list:
+        with self._lock:
+            self._ensure_loaded()
+            return [{**agent, "health": self._health.get(name)}
+                    for name, agent in self._agents.items()]
+
+    def add(self, name, url) -> dict:
+        """Register (or re-point) an agent; raises ValueError on bad input"""
+        name = str(name or "").strip()
+        if not NAME_RE.match(name):
+            raise ValueError(f"Invalid agent name: {name or '(empty)'}. "
+                             "Use letters, digits, '.', '_', ':' or '-'")
+        agent = {"name": name, "url": parse_agent_url(url), "added_at": time.time(),
+                 "source": "api"}
+        with self._lock:
+            self._ensure_loaded()
+            self._agents[name] = agent
+            self._health.pop(name, None)
+            self._save()
+        return agent
+
+    def remove(self, name) -> bool:
+        with self._lock:
+            self._ensure_loaded()
+            if self._agents.pop(name, None) is None:
+                return False
+            self._health.pop(name, None)
+            self._save()
+        return True
+
+    def select(self, names=None) -> list:
+        """All agents, or the named subset ('a,b' or a list); ValueError on unknown names"""
+        with self._lock:
+            self._ensure_loaded()
+            if not names:
+                return list(self._agents.values())
+            if isinstance(names, str):
+                names = [n.strip() for n in names.split(",") if n.strip()]
+            unknown = [n for n in names if n not in self._agents]
+            if unknown:
+                raise ValueError(f"Unknown agent(s): {', '.join(unknown)}")
+            return [self._agents[n] for n in dict.fromkeys(names)]
+
+    # -- requests -----------------------------------------------------------
+
+    def _ensure_client(self):
+        """One pooled client per event loop (re-created if the loop changed)"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+            self._client = httpx.AsyncClient(
+                headers=headers,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout, pool=None),
+                limits=httpx.Limits(max_connections=self.concurrency,
+                                    max_keepalive_connections=self.concurrency,
+                                    keepalive_expiry=60))
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._client
+
+    async def _send(self, agent, method, path, params, body, idempotent, timeout) -> dict:
+        """
+        One agent's request with retries. Connection failures are always
+        retried (nothing reached the agent); timeouts and 502/503/504 only
+        when the change is idempotent (a set-state toggle, not an emergency
+        stop, whose second run would replace the snapshot undo restores).
+        """
+        client = self._ensure_client()
+        url = agent["url"] + path
+        request_timeout = httpx.Timeout(timeout or self.timeout, connect=self.connect_timeout,
+                                        pool=None)
+        started = time.perf_counter()
+        attempts = 0
+        result = {"agent": agent["name"], "url": agent["url"], "ok": False, "status_code": None,
+                  "response": None, "error": None}
+        while True:
+            attempts += 1
+            retry = False
+            async with self._slots:
+                try:
+                    response = await client.request(method, url, params=params, json=body,
+                                                    timeout=request_timeout)
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    result["error"] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                    retry = True
+                except httpx.HTTPError as e:
+                    result["error"] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                    retry = idempotent
+                else:
+                    try:
+                        payload = response.json()
+                    except ValueError:
+                        payload = response.text[:MAX_TEXT]
+                    result.update(status_code=response.status_code, response=payload,
+                                  error=None, ok=not failed(response.status_code, payload))
+                    retry = idempotent and response.status_code in RETRY_STATUS
+            if not retry or attempts > self.retries:
+                break
+            self.retried += 1
+            await asyncio.sleep(self.backoff * 2 ** (attempts - 1))
+
+        elapsed = time.perf_counter() - started
+        if not result["ok"] and result["error"] is None and isinstance(result["response"], dict):
+            detail = result["response"].get("detail") or result["response"].get("message")
+            result["error"] = str(detail) if detail else f"HTTP {result['status_code']}"
+        result.update(attempts=attempts, elapsed_ms=round(elapsed * 1000, 3))
+        outcome = "ok" if result["ok"] else ("error" if result["status_code"] else "unreachable")
+        fleet_duration.observe(elapsed, agent["name"], outcome)
+        self.requests += 1
+        self.failures += not result["ok"]
+        with self._lock:
+            self._health[agent["name"]] = {"ok": result["ok"], "status_code": result["status_code"],
+                                           "error": result["error"], "at": time.time(),
+                                           "elapsed_ms": result["elapsed_ms"]}
+        return result
+
+    async def broadcast(self, method, path, params=None, body=None, agents=None,
+                        idempotent=True, timeout=None) -> dict:
+        """
+        Send the same request to every selected agent concurrently and
+        gather the per-host results (in registry order) into one response.
+        Raises ValueError for unknown agent names, RuntimeError without
+        httpx or agents.
+        """
+        if not HAVE_HTTPX:
+            raise RuntimeError("Fleet mode needs the httpx package (pip install httpx)")
+        selected = self.select(agents)
+        if not selected:
+            raise RuntimeError("No fleet agents registered; add them with "
+                               "POST /api/firewall/fleet/agents or FIREWALL_FLEET_AGENTS")
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self._send(agent, method, path, params, body,
+                                                    idempotent, timeout)
+                                          for agent in selected))
+        succeeded = sum(1 for r in results if r["ok"])
+        if succeeded == len(results):
+            status = "success"
+        else:
+            status = "partial" if succeeded else "failed"
+        return {
+            "status": status,
+            "request": {"method": method, "path": path, "params": params},
+            "agents": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+            "results": results,
+        }
+
+    async def stop(self):
+        """Close the pooled connections"""
+        if self._client is not None:
+            client, self._client = self._client, None
+            try:
+                await client.aclose()
+            except RuntimeError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_loaded()
+            agents = len(self._agents)
+            healthy = sum(1 for name in self._agents
+                          if (self._health.get(name) or {}).get("ok"))
+        return {
+            "available": HAVE_HTTPX,
+            "registered": agents,
+            "healthy": healthy,
+            "concurrency": self.concurrency,
+            "timeout": self.timeout,
+            "retries": self.retries,
+            "requests": self.requests,
+            "retried": self.retried,
+            "failures": self.failures,
+        }
+
+
+# Shared fleet of this backend
+fleet = Fleet()
+
+
+async def fan_out(method, path, agents=None, timeout=None, params=None, body=None,
+                  idempotent=True) -> dict:
+    """broadcast() with its errors mapped to HTTP status codes"""
+    try:
+        return await fleet.broadcast(method, path, params=params, body=body, agents=agents,
+                                     idempotent=idempotent, timeout=timeout)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.get("/agents")
+def list_agents():
+    """Registered agents with the outcome of the last request to each"""
+    return {"status": "success", "agents": fleet.agents(), **fleet.stats()}
+
+
+@router.post("/agents")
+def add_agent(body: dict = Body(...)):
+    """Register an agent: {"name": "web1", "url": "http://10.0.0.5:8000"}"""
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Body must be a JSON object")
+    try:
+        agent = fleet.add(body.get("name"), body.get("url"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "agent": agent}
+
+
+@router.delete("/agents/{name}")
+def remove_agent(name: str):
+    if not fleet.remove(name):
+        raise HTTPException(status_code=404, detail=f"Unknown agent: {name}")
+    return {"status": "success", "removed": name}
+
+
+@router.post("/check")
+async def check_agents(agents: str = None, timeout: float = None):
+    """Ping every agent (GET /) and refresh the health shown in the agent list"""
+    return await fan_out("GET", "/", agents, timeout)
+
+
+@router.post("/port/{port}/{action}")
+async def fleet_port(port: int, action: str, wait: bool = True, ttl: float = None,
+                     agents: str = None, timeout: float = None):
+    """Open / block a port on every agent (?agents=a,b for a subset)"""
+    return await fan_out("POST", f"/api/firewall/port/{port}/{quote(action, safe='')}", agents,
+                         timeout, params={"wait": wait, "ttl": ttl})
+
+
+@router.post("/ports")
+async def fleet_ports(body: dict = Body(...), wait: bool = True, agents: str = None,
+                      timeout: float = None):
+    """Bulk port change (same body as /api/firewall/ports) on every agent"""
+    return await fan_out("POST", "/api/firewall/ports", agents, timeout,
+                         params={"wait": wait}, body=body)
+
+
+@router.post("/service/{service}/{action}")
+async def fleet_service(service: str, action: str, wait: bool = True, ttl: float = None,
+                        agents: str = None, timeout: float = None):
+    """Toggle a service on every agent"""
+    return await fan_out("POST", f"/api/firewall/{quote(service, safe='')}/"
+                                 f"{quote(action, safe='')}",
+                         agents, timeout, params={"wait": wait, "ttl": ttl})
+
+
+@router.post("/domain/{domain}/{action}")
+async def fleet_domain(domain: str, action: str, wait: bool = True, ttl: float = None,
+                       agents: str = None, timeout: float = None):
+    """Block / unblock a domain or wildcard on every agent"""
+    return await fan_out("POST", f"/api/firewall/domain/{quote(domain, safe='*.')}/"
+                                 f"{quote(action, safe='')}",
+                         agents, timeout, params={"wait": wait, "ttl": ttl})
+
+
+@router.put("/policy")
+async def fleet_policy(body: dict = Body(...), dry_run: bool = False, wait: bool = True,
+                       agents: str = None, timeout: float = None):
+    """Push the same complete policy to every agent (each applies only its own diff)"""
+    return await fan_out("PUT", "/api/firewall/policy", agents, timeout,
+                         params={"dry_run": dry_run, "wait": wait}, body=body)
+
+
+@router.post("/emergency-stop")
+async def fleet_emergency_stop(wait: bool = True, agents: str = None, timeout: float = None):
+    """
+    Emergency stop on every agent. Only retried where the request cannot
+    have arrived: a second stop would replace the snapshot undo restores
+    """
+    return await fan_out("POST", "/api/firewall/emergency-stop", agents, timeout,
+                         params={"wait": wait}, idempotent=False)
+
+
+@router.post("/emergency-stop/undo")
+async def fleet_undo_emergency_stop(wait: bool = True, agents: str = None,
+                                    timeout: float = None):
+    """Undo the last emergency stop on every agent (restoring it twice is harmless)"""
+    return await fan_out("POST", "/api/firewall/emergency-stop/undo", agents, timeout,
+                         params={"wait": wait})
@@ -0,0 +1,165 @@
+import itertools
+import json
+import os
+import queue
+import shlex
+import socket
+import threading
+import time
+
+from backend import config
+from backend.helper_protocol import check_ufw_argv
+from backend.metrics import add_span, helper_duration
+
+# Seconds to stop trying the helper after a connection failure
+RETRY_AFTER = 5.0
+
+
+class HelperError(RuntimeError):
+    """The helper refused or failed an operation"""
+
+
+class _Connection:
+    def __init__(self, path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile("rb")
+
+    def exchange(self, requests: list) -> list:
+        """Write all requests, then read one response per request (pipelined)"""
+        payload = b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in requests)
+        self.sock.sendall(payload)
+        responses = []
+        for _ in requests:
+            line = self.rfile.readline()
+            if not line:
+                raise ConnectionError("helper closed the connection")
+            responses.append(json.loads(line))
+        return responses
+
+    def close(self):
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class HelperClient:
+    """
+    Small connection pool to the privileged helper daemon.
+    available() is False when the socket does not exist (or was unreachable
+    in the last RETRY_AFTER seconds); callers then fall back to sudo.
+    """
+
+    def __init__(self, path=None, pool_size=None, timeout=None):
+        self.path = config.HELPER_SOCKET if path is None else path
+        self.pool_size = pool_size or config.HELPER_POOL_SIZE
+        self.timeout = timeout or config.HELPER_TIMEOUT
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._ids = itertools.count(1)
+        self._down_until = 0.0
+        self.calls = 0
+        self.round_trips = 0
+        self.connections = 0
+        self.errors = 0
+
+    def available(self) -> bool:
+        return bool(self.path) and time.monotonic() >= self._down_until \
+            and os.path.exists(self.path)
+
+    def _acquire(self) -> _Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            conn = _Connection(self.path, self.timeout)
+            self.connections += 1
+            return conn
+
+    def call_many(self, operations: list) -> list:
+        """
+        Run [(op, args), ...] over one connection in a single round trip
+        Returns: list of results; raises HelperError on the first failure
+        """
+        requests = [{"id": next(self._ids), "op": op, "args": args} for op, args in operations]
+        with self._slots:
+            try:
+                conn = self._acquire()
+            except OSError:
+                self._down_until = time.monotonic() + RETRY_AFTER
+                raise
+            started = time.perf_counter()
+            try:
+                responses = conn.exchange(requests)
+            except (OSError, ValueError):
+                conn.close()
+                self._down_until = time.monotonic() + RETRY_AFTER
+                raise
+            self._idle.put(conn)
+        elapsed = time.perf_counter() - started
+        helper_duration.observe(elapsed, requests[0]["op"])
+        add_span("helper", requests[0]["op"], elapsed)
+        self.calls += len(requests)
+        self.round_trips += 1
+        results = []
+        for response in responses:
+            if not response.get("ok"):
+                self.errors += 1
+                raise HelperError(response.get("error") or "helper operation failed")
+            results.append(response.get("result"))
+        return results
+
+    def call(self, op, **args):
+        return self.call_many([(op, args)])[0]
+
+    def run_command(self, cmd: str):
+        """
+        Run one of the backend's `sudo ...` shell strings through the helper
+        Understands 'sudo ufw <args>' with optional '2>/dev/null' / '|| true',
+        and the DNS cache flush. Returns (returncode, stdout, stderr), or None
+        when the helper is not available or the command is not one it runs
+        (reset, disable, default policies: those stay behind sudo).
+        """
+        if not self.available():
+            return None
+        ignore_errors = cmd.rstrip().endswith("|| true")
+        if "flush-caches" in cmd:
+            op, args = "flush_dns", {}
+        else:
+            command = cmd.replace("2>/dev/null", "").strip()
+            if ignore_errors:
+                command = command[:command.rfind("||")].strip()
+            if not command.startswith("sudo ufw ") or any(c in command for c in ";&|`$<>"):
+                return None
+            try:
+                argv = check_ufw_argv(shlex.split(command)[2:])
+            except ValueError:
+                return None
+            op, args = "ufw", {"argv": argv}
+        try:
+            result = self.call(op, **args)
+        except OSError:
+            return None
+        except HelperError as e:
+            return (0, "", "") if ignore_errors else (1, "", str(e))
+        returncode = 0 if ignore_errors else result["returncode"]
+        stderr = "" if "2>/dev/null" in cmd else result["stderr"]
+        return returncode, result["stdout"], stderr
+
+    def stats(self) -> dict:
+        return {
+            "socket": self.path,
+            "available": self.available(),
+            "pool_size": self.pool_size,
+            "idle_connections": self._idle.qsize(),
+            "connections_opened": self.connections,
+            "calls": self.calls,
+            "round_trips": self.round_trips,
+            "errors": self.errors,
+        }
+
+
+# Shared pool used by every privileged code path
+helper = HelperClient()
@@ -0,0 +1,238 @@
+"""
+Privileged helper for the firewall backend.
+
+Runs once as root and serves whitelisted operations to the API server over
+a Unix socket, so the server does not fork a shell + sudo for every rule.
+
+Protocol: newline-delimited JSON. Each request is
+    {"id": 1, "op": "ufw", "args": {"argv": ["status", "numbered"]}}
+and gets exactly one response, in order:
+    {"id": 1, "ok": true, "result": {...}}   or   {"id": 1, "ok": false, "error": "..."}
+Clients may write many requests before reading (pipelining).
+
+Start with:
+    sudo python -m backend.helper_daemon --user $USER
+"""
+import argparse
+import grp
+import json
+import logging
+import os
+import pwd
+import socket
+import socketserver
+import struct
+import subprocess
+import tempfile
+
+from backend import config
+from backend.helper_protocol import (NFT_SETS, check_defaults, check_ufw_argv,
+                                     defaults_settings, nft_setup_script, nft_update_script,
+                                     render_defaults)
+
+logger = logging.getLogger("helper_daemon")
+
+FILE_MODES = (0o640, 0o644)
+
+
+class OperationError(Exception):
+    """A request that was refused or failed"""
+
+
+def _run(argv, input_text=None) -> dict:
+    result = subprocess.run(argv, input=input_text, capture_output=True, text=True)
+    return {"returncode": result.returncode, "stdout": result.stdout, "stderr": result.stderr}
+
+
+class Operations:
+    """The whitelisted operations; every argument is validated before use"""
+
+    def __init__(self, rules_dir=None, hosts_file=None, nft_table=None, defaults_file=None):
+        rules_dir = rules_dir or config.UFW_RULES_DIR
+        self.files = {
+            os.path.realpath(os.path.join(rules_dir, "user.rules")),
+            os.path.realpath(os.path.join(rules_dir, "user6.rules")),
+            os.path.realpath(hosts_file or config.HOSTS_FILE),
+        }
+        # Not in self.files: only changed through op_set_defaults
+        self.defaults_file = os.path.realpath(defaults_file or config.UFW_DEFAULTS_FILE)
+        self.nft_table = nft_table or config.NFT_TABLE
+
+    def _check_path(self, path) -> str:
+        real = os.path.realpath(str(path))
+        if real not in self.files:
+            raise OperationError(f"Path not allowed: {path}")
+        return real
+
+    def op_ping(self):
+        return {"pid": os.getpid()}
+
+    def op_ufw(self, argv):
+        """Rule changes, reload, status and `--force enable` (see helper_protocol)"""
+        try:
+            argv = check_ufw_argv(argv)
+        except ValueError as e:
+            raise OperationError(str(e))
+        return _run(["ufw", *argv])
+
+    def op_read_file(self, path):
+        with open(self._check_path(path), "r") as f:
+            return {"text": f.read()}
+
+    def op_write_files(self, contents, mode=0o644):
+        """Atomically replace whitelisted files (temp file + rename in the same dir)"""
+        if mode not in FILE_MODES:
+            raise OperationError(f"File mode not allowed: {mode:o}")
+        targets = {self._check_path(path): text for path, text in contents.items()}
+        for path, text in targets.items():
+            _replace_file(path, text, mode)
+        return {"written": len(targets)}
+
+    def op_set_defaults(self, settings):
+        """
+        Set default policies / IPV6 in the UFW defaults file (see
+        helper_protocol); the rest of the file is kept as it is
+        """
+        with open(self.defaults_file, "r") as f:
+            text = f.read()
+        try:
+            settings = check_defaults(defaults_settings(text), settings)
+        except ValueError as e:
+            raise OperationError(str(e))
+        _replace_file(self.defaults_file, render_defaults(text, settings), 0o644)
+        return {"written": 1}
+
+    def op_nft_setup(self):
+        """Create the blocklist table, sets and drop rules (idempotent)"""
+        return _run(["nft", "-f", "-"], input_text=nft_setup_script(self.nft_table))
+
+    def op_nft_list(self, set):
+        if set not in NFT_SETS.values():
+            raise OperationError(f"Unknown nft set: {set}")
+        return _run(["nft", "-j", "list", "set", "inet", self.nft_table, set])
+
+    def op_nft_update(self, changes):
+        """
+        Add / delete / flush blocklist set elements in one transaction
+        changes: [[verb, set, [ip, ...]], ...]; the script is built here from
+        validated addresses, never taken from the caller
+        """
+        try:
+            script = nft_update_script(self.nft_table, changes)
+        except (TypeError, ValueError) as e:
+            raise OperationError(f"Invalid nft update: {e}")
+        if not script:
+            return {"returncode": 0, "stdout": "", "stderr": ""}
+        return _run(["nft", "-f", "-"], input_text=script)
+
+    def op_flush_dns(self):
+        result = _run(["resolvectl", "flush-caches"]) if _which("resolvectl") else None
+        if result is None or result["returncode"] != 0:
+            if _which("systemd-resolve"):
+                result = _run(["systemd-resolve", "--flush-caches"])
+        return result or {"returncode": 0, "stdout": "", "stderr": ""}
+
+    def dispatch(self, request: dict) -> dict:
+        op = request.get("op")
+        handler = getattr(self, f"op_{op}", None) if isinstance(op, str) else None
+        if handler is None:
+            raise OperationError(f"Unknown operation: {op}")
+        args = request.get("args") or {}
+        if not isinstance(args, dict):
+            raise OperationError("args must be an object")
+        try:
+            return handler(**args)
+        except TypeError as e:
+            raise OperationError(f"Bad arguments for {op}: {e}")
+
+
+def _replace_file(path, text, mode):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".fw-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _which(name) -> bool:
+    return any(os.access(os.path.join(d, name), os.X_OK)
+               for d in os.environ.get("PATH", "/usr/sbin:/usr/bin").split(os.pathsep))
+
+
+def _peer_uid(sock) -> int:
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+class HelperHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        try:
+            uid = _peer_uid(self.request)
+        except OSError:
+            uid = None
+        if uid not in server.allowed_uids:
+            logger.warning("refusing connection from uid %s", uid)
+            return
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = {"id": None}
+            try:
+                request = json.loads(line)
+                response["id"] = request.get("id")
+                response["result"] = server.operations.dispatch(request)
+                response["ok"] = True
+            except (OperationError, OSError, ValueError) as e:
+                response["ok"] = False
+                response["error"] = str(e)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, operations, allowed_uids, group=None):
+        if os.path.exists(path):
+            os.unlink(path)
+        os.makedirs(os.path.dirname(path) or ".", mode=0o755, exist_ok=True)
+        self.operations = operations
+        self.allowed_uids = set(allowed_uids)
+        super().__init__(path, HelperHandler)
+        os.chmod(path, 0o660)
+        if group is not None:
+            os.chown(path, 0, group)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Privileged helper for the firewall backend")
+    parser.add_argument("--socket", default=config.HELPER_SOCKET)
+    parser.add_argument("--user", default=os.environ.get("SUDO_USER"),
+                        help="user the API server runs as (allowed to connect)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    allowed = {0}
+    group = None
+    if args.user:
+        entry = pwd.getpwnam(args.user)
+        allowed.add(entry.pw_uid)
+        group = grp.getgrgid(entry.pw_gid).gr_gid
+    server = HelperServer(args.socket, Operations(), allowed, group)
+    logger.info("listening on %s (uids %s)", args.socket, sorted(allowed))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
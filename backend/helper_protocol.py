@@ -0,0 +1,168 @@
+"""
+What the privileged helper accepts, shared by the daemon (which enforces it)
+and the client (which sends everything else through sudo instead).
+
+ufw: only rule changes (allow / deny / reject / limit, optionally after
+`delete`), `reload`, `status` and `--force enable`. Nothing that resets,
+disables or loosens the default policies goes over the socket.
+
+nft: no scripts are accepted; the daemon builds them from structured
+operations on the blocklist sets of its own table.
+
+defaults: /etc/default/ufw is never written from caller text (ufw sources it
+as shell). The daemon only sets the default policies and IPV6 to validated
+values, and refuses any change that loosens them.
+"""
+import ipaddress
+import re
+
+UFW_VERBS = {"allow", "deny", "reject", "limit"}
+# Keyword / value pairs of ufw's extended rule syntax
+UFW_RULE_KEYWORDS = {"proto", "from", "to", "port", "on", "app"}
+UFW_FIXED_COMMANDS = (["status"], ["status", "numbered"], ["status", "verbose"], ["reload"],
+                      ["--force", "enable"])
+UFW_TOKEN_RE = re.compile(r"^[A-Za-z0-9_.:/,@][A-Za-z0-9_.:/,@-]*$")
+COMMENT_RE = re.compile(r"^[^\x00-\x1f']{0,200}$")
+
+NFT_SETS = {4: "blocked4", 6: "blocked6"}
+DEFAULT_POLICY_KEYS = ("DEFAULT_INPUT_POLICY", "DEFAULT_OUTPUT_POLICY", "DEFAULT_FORWARD_POLICY")
+DEFAULT_POLICIES = ("DROP", "REJECT", "ACCEPT")
+IPV6_VALUES = ("yes", "no")
+NFT_VERBS = ("add", "delete", "flush")
+
+
+def check_ufw_argv(argv) -> list:
+    """
+    Validate ufw arguments against the rule grammar; returns them as strings
+    Raises ValueError for anything else (reset, disable, default, ...).
+    """
+    argv = [str(token) for token in argv]
+    if argv in UFW_FIXED_COMMANDS:
+        return argv
+    rule = argv[1:] if argv[:1] == ["delete"] else argv
+    if not rule or rule[0] not in UFW_VERBS:
+        raise ValueError(f"ufw command not allowed: {' '.join(argv[:2])}")
+    tokens = rule[1:]
+    if len(tokens) >= 2 and tokens[-2] == "comment":
+        if not COMMENT_RE.match(tokens[-1]):
+            raise ValueError("Invalid rule comment")
+        tokens = tokens[:-2]
+    if tokens[:1] in (["in"], ["out"]):
+        tokens = tokens[1:]
+    if len(tokens) == 1:
+        # Simple syntax: <port>[/<proto>] or a service name
+        if tokens[0] in UFW_RULE_KEYWORDS or not UFW_TOKEN_RE.match(tokens[0]):
+            raise ValueError(f"Invalid ufw argument: {tokens[0]}")
+        return argv
+    if not tokens or len(tokens) % 2:
+        raise ValueError(f"Invalid ufw rule: {' '.join(argv)}")
+    seen = set()
+    for keyword, value in zip(tokens[::2], tokens[1::2]):
+        if keyword not in UFW_RULE_KEYWORDS or keyword in seen:
+            raise ValueError(f"Invalid ufw argument: {keyword}")
+        seen.add(keyword)
+        if value in UFW_RULE_KEYWORDS or not UFW_TOKEN_RE.match(value):
+            raise ValueError(f"Invalid ufw argument: {value}")
+    return argv
+
+
+def nft_setup_script(table) -> str:
+    """Idempotent nft script creating the table, sets and the four drop rules"""
+    t = f"inet {table}"
+    return "\n".join([
+        f"add table {t}",
+        f"add set {t} {NFT_SETS[4]} {{ type ipv4_addr; }}",
+        f"add set {t} {NFT_SETS[6]} {{ type ipv6_addr; }}",
+        f"add chain {t} input {{ type filter hook input priority -10; policy accept; }}",
+        f"add chain {t} output {{ type filter hook output priority -10; policy accept; }}",
+        f"flush chain {t} input",
+        f"flush chain {t} output",
+        f"add rule {t} input ip saddr @{NFT_SETS[4]} drop",
+        f"add rule {t} input ip6 saddr @{NFT_SETS[6]} drop",
+        f"add rule {t} output ip daddr @{NFT_SETS[4]} drop",
+        f"add rule {t} output ip6 daddr @{NFT_SETS[6]} drop",
+    ]) + "\n"
+
+
+def nft_set_version(set_name) -> int:
+    for version, name in NFT_SETS.items():
+        if name == set_name:
+            return version
+    raise ValueError(f"Unknown nft set: {set_name}")
+
+
+def nft_update_script(table, changes) -> str:
+    """
+    One atomic nft transaction from [(verb, set, [ip, ...]), ...] where verb
+    is add / delete / flush; every element must be an address of the set's
+    family. Raises ValueError otherwise.
+    """
+    lines = []
+    for change in changes:
+        verb, set_name, elements = change
+        if verb not in NFT_VERBS:
+            raise ValueError(f"nft operation not allowed: {verb}")
+        version = nft_set_version(set_name)
+        if verb == "flush":
+            lines.append(f"flush set inet {table} {set_name}")
+            continue
+        addresses = []
+        for element in elements:
+            address = ipaddress.ip_address(str(element))
+            if address.version != version:
+                raise ValueError(f"{element} does not belong in {set_name}")
+            addresses.append(str(address))
+        if addresses:
+            lines.append(f"{verb} element inet {table} {set_name} {{ {', '.join(addresses)} }}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def defaults_settings(text) -> dict:
+    """The default policies and IPV6 setting of a UFW defaults file"""
+    settings = {}
+    for line in text.splitlines():
+        key, sep, value = line.strip().partition("=")
+        if sep and (key in DEFAULT_POLICY_KEYS or key == "IPV6"):
+            settings[key] = value.strip().strip('"')
+    return settings
+
+
+def check_defaults(current: dict, wanted: dict) -> dict:
+    """
+    Validate new default settings against the current ones
+    Raises ValueError for unknown keys / values and for loosening changes
+    (a policy becoming ACCEPT, IPV6 being turned off).
+    """
+    if not isinstance(wanted, dict):
+        raise ValueError("settings must be an object")
+    checked = {}
+    for key, value in wanted.items():
+        value = str(value)
+        if key in DEFAULT_POLICY_KEYS:
+            if value not in DEFAULT_POLICIES:
+                raise ValueError(f"Invalid {key}: {value}")
+            if value == "ACCEPT" and current.get(key) != "ACCEPT":
+                raise ValueError(f"{key}=ACCEPT loosens the firewall")
+        elif key == "IPV6":
+            if value not in IPV6_VALUES:
+                raise ValueError(f"Invalid IPV6: {value}")
+            if value == "no" and current.get(key, "yes") != "no":
+                raise ValueError("IPV6=no loosens the firewall")
+        else:
+            raise ValueError(f"Setting not allowed: {key}")
+        checked[key] = value
+    return checked
+
+
+def render_defaults(text, settings) -> str:
+    """The defaults file text with these settings replaced (or appended)"""
+    lines, done = [], set()
+    for line in text.splitlines():
+        key, sep, value = line.strip().partition("=")
+        if sep and key in settings:
+            done.add(key)
+            if value.strip().strip('"') != settings[key]:
+                line = f'{key}="{settings[key]}"'
+        lines.append(line)
+    lines.extend(f'{key}="{value}"' for key, value in settings.items() if key not in done)
+    return "\n".join(lines) + "\n"
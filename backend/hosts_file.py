@@ -0,0 +1,194 @@
+import logging
+import os
+import threading
+
+from backend import config
+from backend.metrics import hosts_duration, metrics, timed
+from backend.system_files import read_file, write_files_atomic
+
+logger = logging.getLogger(__name__)
+
+BEGIN_MARKER = "# BEGIN cyber_sec blocked domains (managed by the firewall backend)"
+END_MARKER = "# END cyber_sec blocked domains"
+
+
+class HostsFileManager:
+    """
+    Owns a delimited section of the hosts file holding blocked domains.
+
+    The section is indexed in memory (domain -> address), so reads never
+    parse the file; any number of additions/removals is applied with one
+    rewrite (temp file + atomic rename). Lines outside the section are
+    written back unchanged, except that bare "0.0.0.0 <domain>" lines left by
+    earlier versions of this app are moved into the section on first write.
+    The file is re-indexed if it changes on disk behind our back.
+    """
+
+    def __init__(self, path=None, block_address=None):
+        self.path = path or config.HOSTS_FILE
+        self.block_address = block_address or config.HOSTS_BLOCK_ADDRESS
+        self._index = {}
+        self._legacy = set()
+        self._before = []
+        self._after = []
+        self._file_id = None
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.writes = 0
+        self.processes = 0
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        Register callback(added, removed) for changes to the blocked set.
+        After a re-read of a file changed on disk it is called as
+        callback(None, None): the listener should rebuild from blocked().
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, added, removed):
+        for callback in self._listeners:
+            try:
+                callback(added, removed)
+            except Exception:
+                logger.exception("hosts file listener failed")
+
+    def _stat_id(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _parse(self, text):
+        self._index = {}
+        self._legacy = set()
+        self._before = []
+        self._after = []
+        outside = self._before
+        in_section = False
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped == BEGIN_MARKER:
+                in_section = True
+                continue
+            if stripped == END_MARKER:
+                in_section = False
+                outside = self._after
+                continue
+            if in_section:
+                parts = stripped.split()
+                if len(parts) >= 2 and not parts[0].startswith("#"):
+                    self._index[parts[1]] = parts[0]
+                continue
+            parts = stripped.split()
+            if len(parts) == 2 and parts[0] == self.block_address:
+                self._legacy.add(parts[1])
+            outside.append(line)
+
+    def _refresh(self):
+        """Re-index only if the file changed since we last read or wrote it"""
+        file_id = self._stat_id()
+        if file_id is not None and file_id == self._file_id:
+            return
+        text = ""
+        if file_id is not None:
+            with timed(hosts_duration, "read", span="hosts"):
+                text, processes = read_file(self.path)
+            self.processes += processes
+        first_load = self._file_id is None and self.generation == 0
+        self._parse(text)
+        self._file_id = file_id
+        self.generation += 1
+        if not first_load:
+            self._notify(None, None)
+
+    def blocked(self) -> set:
+        """All domains blocked through the hosts file"""
+        with self._lock:
+            self._refresh()
+            return set(self._index) | self._legacy
+
+    def __contains__(self, domain):
+        with self._lock:
+            self._refresh()
+            return domain in self._index or domain in self._legacy
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._index) + len(self._legacy)
+
+    def apply(self, add=(), remove=()) -> tuple:
+        """
+        Add and remove domains with a single rewrite of the hosts file
+        Returns: (domains added, domains removed)
+        """
+        with self._lock:
+            self._refresh()
+            added = []
+            removed = []
+            legacy_removed = set()
+            for domain in remove:
+                if self._index.pop(domain, None) is not None:
+                    removed.append(domain)
+                elif domain in self._legacy:
+                    self._legacy.discard(domain)
+                    legacy_removed.add(domain)
+                    removed.append(domain)
+            for domain in add:
+                if domain not in self._index and domain not in self._legacy:
+                    self._index[domain] = self.block_address
+                    added.append(domain)
+            if not added and not removed:
+                return added, removed
+
+            try:
+                self._write(legacy_removed)
+            except Exception:
+                # Force a re-read so the index matches what is really on disk
+                self._file_id = None
+                raise
+        self._notify(added, removed)
+        return added, removed
+
+    def _write(self, legacy_removed=()):
+        # Move legacy lines into the section; drop the ones being removed
+        legacy = self._legacy | set(legacy_removed)
+        for domain in self._legacy:
+            self._index.setdefault(domain, self.block_address)
+        self._legacy = set()
+        self._before = [line for line in self._before if not self._is_managed_line(line, legacy)]
+        self._after = [line for line in self._after if not self._is_managed_line(line, legacy)]
+
+        out = list(self._before)
+        out.append(BEGIN_MARKER)
+        out.extend(f"{address} {domain}" for domain, address in self._index.items())
+        out.append(END_MARKER)
+        out.extend(self._after)
+        with timed(hosts_duration, "write", span="hosts"):
+            self.processes += write_files_atomic({self.path: "\n".join(out) + "\n"}, mode=0o644)
+        self.writes += 1
+        self.generation += 1
+        self._file_id = self._stat_id()
+
+    def _is_managed_line(self, line, domains):
+        parts = line.split()
+        return len(parts) == 2 and parts[0] == self.block_address and parts[1] in domains
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "managed_entries": len(self._index),
+                "legacy_entries": len(self._legacy),
+                "writes": self.writes,
+                "processes": self.processes,
+                "generation": self.generation,
+            }
+
+
+# Shared manager for the configured hosts file
+hosts_file = HostsFileManager()
+metrics.gauge("firewall_hosts_blocked_domains", "Domains in the managed hosts section",
+              lambda: len(hosts_file._index) + len(hosts_file._legacy))
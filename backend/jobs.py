@@ -0,0 +1,267 @@
+import asyncio
+import inspect
+import logging
+import threading
+import time
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+from backend import config
+from backend.system_files import running_job
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A long-running operation whose progress can be polled"""
+
+    def __init__(self, kind, params=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.params = params or {}
+        self.status = "queued"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.processes = 0
+        self._listeners = ()
+
+    def _notify(self, event):
+        for callback in self._listeners:
+            try:
+                callback(event, self)
+            except Exception:
+                logger.exception("job listener failed")
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed")
+
+    def start(self):
+        self.status = "running"
+        self.started_at = time.time()
+        self._notify("started")
+
+    def succeed(self, result=None):
+        self.result = result
+        self.status = "succeeded"
+        self.finished_at = time.time()
+        self._notify("finished")
+
+    def fail(self, error):
+        self.error = str(error)
+        self.status = "failed"
+        self.finished_at = time.time()
+        self._notify("finished")
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "processes": self.processes,
+        }
+
+
+class JobRegistry:
+    """Keeps recent jobs in memory (finished jobs beyond max_finished are dropped)"""
+
+    def __init__(self, max_finished=1000):
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        Register callback(event, job) for "created", "started" and "finished"
+        "created" runs in the caller's context (e.g. the request handler)
+        """
+        self._listeners.append(callback)
+
+    def create(self, kind, params=None) -> Job:
+        job = Job(kind, params)
+        job._listeners = self._listeners
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job._notify("created")
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self, kind=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if kind is None or job.kind == kind]
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.done]
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.id]
+
+
+class _RWLock:
+    """asyncio readers-writer lock (writers are not starved by new readers)"""
+
+    def __init__(self):
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, exclusive: bool):
+        async with self._cond:
+            if exclusive:
+                self._waiting_writers += 1
+                await self._cond.wait_for(lambda: not self._writer and not self._readers)
+                self._waiting_writers -= 1
+                self._writer = True
+            else:
+                await self._cond.wait_for(lambda: not self._writer and not self._waiting_writers)
+                self._readers += 1
+
+    async def release(self, exclusive: bool):
+        async with self._cond:
+            if exclusive:
+                self._writer = False
+            else:
+                self._readers -= 1
+            self._cond.notify_all()
+
+
+class JobExecutor:
+    """
+    Runs mutating operations as jobs on the event loop.
+    Each job names the resources it touches ("port:8080/tcp", "service:http",
+    "domain:example.com"); jobs on the same resource run one at a time in
+    submission order, jobs on different resources run concurrently. A job on
+    the global resource ("ruleset") waits for every other job and blocks new
+    ones while it runs. At most JOB_WORKERS jobs occupy threadpool workers,
+    so status reads always find a free worker.
+    """
+
+    GLOBAL = "ruleset"
+
+    def __init__(self, registry=None, workers=None):
+        self.registry = registry or jobs
+        self.workers = workers or config.JOB_WORKERS
+        self._global = None
+        self._locks = {}
+        self._lock_users = {}
+        self._slots = None
+        self._tasks = {}
+
+    def _ensure_primitives(self):
+        # Created lazily so they bind to the running loop
+        if self._global is None:
+            self._global = _RWLock()
+            self._slots = asyncio.Semaphore(self.workers)
+
+    def submit(self, kind, fn, *args, resources=(), params=None, delay=0, **kwargs) -> Job:
+        """
+        Queue fn(*args, **kwargs) (sync or async) and return its Job right away
+        delay: seconds to wait before competing for the locks
+        """
+        self._ensure_primitives()
+        job = self.registry.create(kind, params)
+        job.progress["resources"] = sorted(resources) or [self.GLOBAL]
+        task = asyncio.get_running_loop().create_task(
+            self._run(job, fn, args, kwargs, sorted(set(resources)), delay)
+        )
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return job
+
+    async def _run(self, job, fn, args, kwargs, resources, delay=0):
+        if delay:
+            await asyncio.sleep(delay)
+        exclusive = not resources or self.GLOBAL in resources
+        await self._global.acquire(exclusive)
+        registered = []
+        held = []
+        try:
+            if not exclusive:
+                # Sorted acquisition order, so two jobs can never deadlock
+                for resource in resources:
+                    lock = self._locks.setdefault(resource, asyncio.Lock())
+                    self._lock_users[resource] = self._lock_users.get(resource, 0) + 1
+                    registered.append(resource)
+                    await lock.acquire()
+                    held.append(resource)
+            async with self._slots:
+                # Copied into the worker thread: subprocesses count on this job
+                running_job.set(job)
+                job.start()
+                try:
+                    if inspect.iscoroutinefunction(fn):
+                        result = await fn(*args, **kwargs)
+                    else:
+                        result = await run_in_threadpool(fn, *args, **kwargs)
+                    job.succeed(result)
+                except Exception as e:
+                    job.fail(e)
+        finally:
+            for resource in held:
+                self._locks[resource].release()
+            for resource in registered:
+                self._lock_users[resource] -= 1
+                if not self._lock_users[resource]:
+                    del self._lock_users[resource]
+                    del self._locks[resource]
+            await self._global.release(exclusive)
+        return job
+
+    async def wait(self, job: Job) -> Job:
+        """Wait for a submitted job to finish"""
+        task = self._tasks.get(job.id)
+        if task is not None:
+            await asyncio.shield(task)
+        return job
+
+    def stats(self) -> dict:
+        active = [job for job in self.registry.list() if not job.done]
+        return {
+            "workers": self.workers,
+            "queued": sum(1 for job in active if job.status == "queued"),
+            "running": sum(1 for job in active if job.status == "running"),
+            "locked_resources": sorted(self._locks),
+        }
+
+
+# Shared registry for all background jobs
+jobs = JobRegistry()
+
+# Shared executor for mutating API operations
+executor = JobExecutor()
+
+
+async def job_response(job: Job, wait=False):
+    """
+    202 + job id for async callers; with ?wait=true the finished job's result
+    (the response the endpoint returned before it became a job)
+    """
+    if not wait:
+        return JSONResponse(status_code=202, content={
+            "status": "accepted", "job_id": job.id, "kind": job.kind,
+            "status_url": f"/api/firewall/jobs/{job.id}",
+        })
+    await executor.wait(job)
+    if job.status == "failed":
+        return {"status": "error", "message": job.error}
+    return job.result
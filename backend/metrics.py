@@ -0,0 +1,262 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+from backend import config
+
+# Latency buckets (seconds) shared by every histogram
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+# Spans kept per traced request
+MAX_SPANS = 200
+
+# Spans of the request being traced (set by MetricsMiddleware when the
+# client sent TRACE_HEADER); None when the request is not traced
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+                     for key, value in values)
+        return lines
+
+
+class Histogram:
+    """Bucket counts, sum and count per label set (cumulated when rendered)"""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [per-bucket counts..., +Inf count, sum]
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[position] += 1
+            series[-1] += value
+
+    def count(self) -> int:
+        """Observations over all label sets"""
+        with self._lock:
+            return sum(sum(series[:-1]) for series in self._series.values())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        bounds = self.buckets + (float("inf"),)
+        for key, series in items:
+            total = 0
+            for bound, count in zip(bounds, series):
+                total += count
+                lines.append(f"{self.name}_bucket"
+                             f"{_labels(self.labels, key, [('le', _number(bound))])} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {total}")
+        return lines
+
+
+class Gauge:
+    """
+    Value read when the metrics are scraped
+    fn returns a number, or {label tuple: number} for labelled series.
+    kind "counter" exposes a monotonically increasing count kept elsewhere.
+    """
+
+    def __init__(self, name, help_text, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        value = self.fn()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            lines.extend(f"{self.name}{_labels(self.labels, key)} {_number(item)}"
+                         for key, item in sorted(value.items()))
+        else:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics exposed at GET /metrics in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, fn, labels=(), kind="gauge") -> Gauge:
+        """Register a value computed at scrape time (replaces one of the same name)"""
+        metric = Gauge(name, help_text, fn, labels, kind)
+        self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            try:
+                lines.extend(self._metrics[name].render())
+            except Exception as e:
+                lines.append(f"# {name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared registry; the hot-path metrics are defined here so every module
+# records into the same series
+metrics = MetricsRegistry()
+http_duration = metrics.histogram(
+    "firewall_http_request_duration_seconds", "API request latency",
+    ("method", "route", "status"))
+subprocess_duration = metrics.histogram(
+    "firewall_subprocess_duration_seconds", "Subprocesses spawned, by command", ("command",))
+subprocess_failures = metrics.counter(
+    "firewall_subprocess_failures_total", "Subprocesses that exited non-zero", ("command",))
+helper_duration = metrics.histogram(
+    "firewall_helper_call_duration_seconds", "Privileged helper round trips, by first operation",
+    ("op",))
+dns_duration = metrics.histogram(
+    "firewall_dns_query_duration_seconds", "DNS queries sent (cache misses)",
+    ("rdtype", "outcome"))
+dns_resolve_duration = metrics.histogram(
+    "firewall_dns_resolve_duration_seconds", "A + AAAA resolution of one name, cache included")
+hosts_duration = metrics.histogram(
+    "firewall_hosts_file_duration_seconds", "Hosts file reads and rewrites", ("op",))
+
+
+def command_name(argv) -> str:
+    """'sudo ufw allow 22' / ['sudo', 'nft', ...] -> 'ufw' / 'nft'"""
+    words = argv.split() if isinstance(argv, str) else list(argv)
+    for word in words:
+        if word != "sudo" and not word.startswith("-"):
+            return word.rsplit("/", 1)[-1]
+    return "unknown"
+
+
+def add_span(kind, name, seconds):
+    """Append to the trace of the current request, if it is traced"""
+    trace = current_trace.get()
+    if trace is not None and len(trace) < MAX_SPANS:
+        trace.append((kind, name, seconds))
+
+
+@contextlib.contextmanager
+def timed(histogram, *labels, span=None):
+    """Observe the block's duration (and add it to the request trace as `span`)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, *labels)
+        if span is not None:
+            add_span(span, labels[0] if labels else span, elapsed)
+
+
+def record_subprocess(argv, seconds, returncode):
+    command = command_name(argv)
+    subprocess_duration.observe(seconds, command)
+    if returncode:
+        subprocess_failures.inc(command)
+    add_span("subprocess", command, seconds)
+
+
+def server_timing(trace, total) -> str:
+    """Spans as a Server-Timing header value (shown by browser dev tools)"""
+    entries = [f'total;dur={total * 1000:.3f}']
+    for index, (kind, name, seconds) in enumerate(trace):
+        entries.append(f'{kind}-{index};dur={seconds * 1000:.3f};desc="{_escape(name)}"')
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every request by route template
+    Requests carrying TRACE_HEADER get a Server-Timing response header
+    listing the subprocesses, helper calls, DNS queries and hosts file I/O
+    they caused.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.trace_header = config.TRACE_HEADER.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        traced = config.TRACE_ENABLED and any(
+            name == self.trace_header for name, _ in scope.get("headers", ()))
+        token = current_trace.set([] if traced else None)
+        trace = current_trace.get()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if traced:
+                    headers = list(message.get("headers", ()))
+                    value = server_timing(trace, time.perf_counter() - started)
+                    headers.append((b"server-timing", value.encode("latin-1", "replace")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_trace.reset(token)
+            route = scope.get("route")
+            http_duration.observe(time.perf_counter() - started, scope["method"],
+                                  getattr(route, "path", "unmatched"), str(status[0]))
@@ -0,0 +1,411 @@
+from fastapi.concurrency import run_in_threadpool
+
+from backend.blocklist import get_set_backend
+from backend.dns_resolver import resolver
+from backend.domain_index import domain_index
+from backend.domain_registry import domain_registry
+from backend.domain_sync import domain_sync
+from backend.domain_trie import format_pattern, parse_pattern
+from backend.firewall_domain import (
+    LOCALHOST_IPS, flush_dns_cache, normalize_domain, queue_ip_blocks, queue_ip_unblocks,
+)
+from backend.firewall_manager import FirewallManager
+from backend.hosts_file import hosts_file
+from backend.rule_state import rule_state
+from backend.ufw_batch import RuleBatch, RuleSpec, ipv6_enabled, resolve_service
+
+SERVICES = ("http", "https", "ssh", "dns", "ftp", "smtp")
+DIRECTIONS = ("in", "out")
+
+_fw = FirewallManager()
+
+
+def _verb(state) -> str:
+    """'on' / 'allow' -> 'allow', 'off' / 'deny' -> 'deny'"""
+    state = str(state).lower().strip()
+    if state in ("on", "allow"):
+        return "allow"
+    if state in ("off", "deny"):
+        return "deny"
+    raise ValueError(f"Invalid state: {state}. Use 'on' or 'off'")
+
+
+def _protected(port) -> bool:
+    # Imported here: port_ranges imports this module
+    from backend.port_ranges import covers_protected
+    return covers_protected(port)
+
+
+def parse_policy(body: dict) -> dict:
+    """
+    Validate a policy document and turn it into desired rule sets
+    Body:
+        {"services": {"http": "on", "ftp": "off"},
+         "ports": [{"port": 8081, "proto": "tcp", "action": "off"}],
+         "domains": ["youtube.com", "*.ads.example.com", ".tracker.io"]}
+    A section that is left out is not managed; a section that is present is
+    complete (anything it owns that is not listed gets removed). The domains
+    section owns manual blocks only, never bulk imports.
+    Returns: dict(services, ports, domains) with None for unmanaged sections
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Policy must be a JSON object")
+    unknown = set(body) - {"services", "ports", "domains"}
+    if unknown:
+        raise ValueError(f"Unknown policy section(s): {', '.join(sorted(unknown))}")
+
+    services = None
+    if body.get("services") is not None:
+        if not isinstance(body["services"], dict):
+            raise ValueError("services must be an object of service -> 'on' / 'off'")
+        services = {}
+        for service, state in body["services"].items():
+            is_valid, error = _fw.validate_service(service)
+            if not is_valid:
+                raise ValueError(error)
+            port, proto = resolve_service(service.lower().strip())
+            services[port, proto] = _verb(state)
+
+    ports = None
+    if body.get("ports") is not None:
+        if not isinstance(body["ports"], list):
+            raise ValueError("ports must be a list")
+        ports = {}
+        for entry in body["ports"]:
+            if not isinstance(entry, dict):
+                raise ValueError(f"Invalid port entry: {entry!r} (expected an object)")
+            port = entry.get("port")
+            proto = str(entry.get("proto", "tcp")).lower()
+            is_valid, error, _ = _fw.validate_port(port)
+            if not is_valid:
+                raise ValueError(error)
+            proto_valid, proto_error = _fw.validate_protocol(proto)
+            if not proto_valid:
+                raise ValueError(proto_error)
+            verb = _verb(entry.get("action", "on"))
+            port = int(port)
+            if verb == "deny" and port in _fw.PROTECTED_PORTS:
+                raise ValueError(f"Cannot block port {port} - {_fw.PROTECTED_PORTS[port]}")
+            key = (str(port), proto)
+            if ports.get(key, verb) != verb:
+                raise ValueError(f"Conflicting actions for port {port}/{proto}")
+            ports[key] = verb
+
+    if services is not None and ports is not None:
+        for key in services.keys() & ports.keys():
+            if services[key] != ports[key]:
+                raise ValueError(f"Service and port entries disagree on {key[0]}/{key[1]}")
+
+    domains = None
+    if body.get("domains") is not None:
+        if not isinstance(body["domains"], list):
+            raise ValueError("domains must be a list")
+        domains = {"names": {}, "patterns": set()}
+        for entry in body["domains"]:
+            rule_domain, kind = parse_pattern(str(entry))
+            if not rule_domain:
+                raise ValueError(f"Invalid domain: {entry}")
+            if kind != "exact":
+                domains["patterns"].add(format_pattern(rule_domain, kind))
+            if kind != "wildcard":
+                # Subtree rules also block the name itself, like the domain endpoint
+                base, www = normalize_domain(rule_domain)
+                domains["names"][base] = www
+
+    return {"services": services, "ports": ports, "domains": domains}
+
+
+def current_port_rules(snapshot) -> dict:
+    """
+    Plain port rules (no addresses, app or interface) in a rule snapshot
+    Returns: {(action, direction, port, proto): set of families}
+    """
+    current = {}
+    for rule in snapshot.rules:
+        if rule.action not in ("allow", "deny") or rule.direction not in DIRECTIONS:
+            continue
+        if not rule.to_port or rule.to_address or rule.from_address or rule.from_port \
+                or rule.app or rule.interface:
+            continue
+        key = (rule.action, rule.direction, rule.to_port, rule.proto)
+        current.setdefault(key, set()).add("v6" if rule.ipv6 else "v4")
+    return current
+
+
+class PolicyPlan:
+    """The minimal set of changes that takes the firewall to a policy"""
+
+    def __init__(self):
+        self.rules_add = []
+        self.rules_delete = []
+        self.block = {}
+        self.unblock = []
+        self.patterns_add = []
+        self.patterns_remove = []
+
+    def __bool__(self):
+        return bool(self.rules_add or self.rules_delete or self.block or self.unblock
+                    or self.patterns_add or self.patterns_remove)
+
+    def to_dict(self) -> dict:
+        def describe(spec):
+            return f"{spec.action} {spec.direction} {spec.port}/{spec.proto}"
+        return {
+            "rules_add": [describe(spec) for spec in self.rules_add],
+            "rules_delete": [describe(spec) for spec in self.rules_delete],
+            "domains_block": sorted(self.block),
+            "domains_unblock": sorted(self.unblock),
+            "patterns_add": sorted(self.patterns_add),
+            "patterns_remove": sorted(self.patterns_remove),
+        }
+
+
+def plan_policy(policy: dict, snapshot) -> PolicyPlan:
+    """Diff a parsed policy against the cached ruleset and the hosts index"""
+    plan = PolicyPlan()
+    service_keys = {resolve_service(service) for service in SERVICES}
+
+    if policy["services"] is not None or policy["ports"] is not None:
+        desired = {}
+        for section in ("services", "ports"):
+            for (port, proto), verb in (policy[section] or {}).items():
+                for direction in DIRECTIONS:
+                    desired[verb, direction, port, proto] = RuleSpec(
+                        verb, direction, port=port, proto=proto
+                    )
+
+        families = {"v4", "v6"} if ipv6_enabled() else {"v4"}
+        current = current_port_rules(snapshot)
+        for key, spec in desired.items():
+            if not families <= current.get(key, set()):
+                plan.rules_add.append(spec)
+
+        for key in current:
+            if key in desired:
+                continue
+            action, direction, port, proto = key
+            owned_by_services = (port, proto) in service_keys
+            if owned_by_services and policy["services"] is None:
+                continue
+            if not owned_by_services and policy["ports"] is None:
+                continue
+            if action == "allow" and _protected(port):
+                # Never drop a rule (or range) that keeps SSH / the app reachable
+                continue
+            plan.rules_delete.append(RuleSpec(action, direction, port=port, proto=proto))
+
+    if policy["domains"] is not None:
+        # The section owns the manual blocks only: bulk imports and hand
+        # edits of the hosts file are left alone
+        names = policy["domains"]["names"]
+        for base, www in names.items():
+            if base not in hosts_file or www not in hosts_file:
+                plan.block[base] = www
+        wanted = set(names) | set(names.values())
+        plan.unblock = sorted({name for base, recorded in domain_registry.managed().items()
+                               if base not in names
+                               for name in recorded if name in hosts_file} - wanted)
+
+        patterns = set(domain_index.patterns())
+        plan.patterns_add = sorted(policy["domains"]["patterns"] - patterns)
+        plan.patterns_remove = sorted(patterns - policy["domains"]["patterns"])
+
+    return plan
+
+
+def _apply_plan(plan: PolicyPlan, block_ips: dict, unblock_ips: dict) -> dict:
+    """Apply a plan with one hosts rewrite and one UFW reload (blocking I/O)"""
+    batch = RuleBatch()
+    for spec in plan.rules_delete:
+        batch.delete(spec)
+    for spec in plan.rules_add:
+        batch.add(spec)
+
+    set_backend = get_set_backend()
+    for base, ips in unblock_ips.items():
+        if set_backend is not None:
+            set_backend.unblock([ip for ip in ips if ip not in LOCALHOST_IPS])
+        else:
+            queue_ip_unblocks(batch, ips)
+    for base, ips in block_ips.items():
+        if set_backend is not None:
+            set_backend.block([ip for ip in ips if ip not in LOCALHOST_IPS], base)
+        else:
+            queue_ip_blocks(batch, ips, base)
+
+    hosts_changed = False
+    if plan.block or plan.unblock:
+        add = [name for base, www in plan.block.items() for name in (base, www)]
+        added, removed = hosts_file.apply(add=add, remove=plan.unblock)
+        hosts_changed = bool(added or removed)
+    for pattern in plan.patterns_remove:
+        domain_index.remove_pattern(pattern)
+    for pattern in plan.patterns_add:
+        domain_index.add_pattern(pattern)
+
+    stats = batch.apply()
+    rule_state.invalidate()
+    if hosts_changed:
+        flush_dns_cache()
+        stats["processes"] += 1
+    return stats
+
+
+async def execute_plan(plan: PolicyPlan) -> dict:
+    """
+    Resolve the domains a plan blocks / unblocks and apply it as one change
+    Returns the batch stats.
+    """
+    # Removed domains give back their recorded IPs; the rest are resolved
+    # together with the newly blocked ones
+    unblock_ips = {}
+    released = []
+    covered = set()
+    for name in plan.unblock:
+        recorded = domain_registry.releasable(name)
+        if recorded is not None:
+            unblock_ips[name] = recorded[1]
+            released.append(name)
+            covered.update(domain_registry.get(name).names)
+    # www. names are covered by their base domain's record
+    unrecorded = [name for name in plan.unblock if name not in covered]
+
+    to_block = [name for base, www in plan.block.items() for name in (base, www)]
+    resolved = await resolver.resolve_many(to_block + unrecorded)
+    block_ips = {}
+    for base, www in plan.block.items():
+        ips = resolved[base][0] + resolved[base][1] + resolved[www][0] + resolved[www][1]
+        block_ips[base] = sorted(set(ips))
+    for name in unrecorded:
+        unblock_ips[name] = resolved[name][0] + resolved[name][1]
+
+    stats = await run_in_threadpool(_apply_plan, plan, block_ips, unblock_ips)
+
+    # Records are only forgotten once their rules are gone (_apply_plan raises)
+    for name in released:
+        domain_registry.release(name)
+        domain_sync.forget(name)
+    for base, www in plan.block.items():
+        ttl = domain_sync.ttl_for([base, www])
+        domain_registry.record_block(base, [base, www], block_ips[base], ttl)
+        domain_sync.schedule(base, ttl)
+    return stats
+
+
+async def apply_policy(body: dict, dry_run=False, refresh=False) -> dict:
+    """
+    Bring the firewall to the desired policy with the fewest changes
+    Re-applying an unchanged policy reads only cached state and runs no
+    subprocesses (pass refresh=True to re-read `ufw status` first).
+    Raises ValueError for an invalid policy.
+    """
+    policy = parse_policy(body)
+    snapshot = await run_in_threadpool(rule_state.refresh if refresh else rule_state.snapshot)
+    if snapshot.error:
+        raise RuntimeError(snapshot.error)
+    plan = await run_in_threadpool(plan_policy, policy, snapshot)
+    response = {"status": "success", "changed": bool(plan), "dry_run": dry_run,
+                "plan": plan.to_dict()}
+    if dry_run or not plan:
+        return response
+    response["batch"] = await execute_plan(plan)
+    return response
+
+
+def target_states(ports, domains, snapshot) -> tuple:
+    """
+    Current state of individual targets
+    ports: (port, proto) pairs -> {(port, proto): "allow" | "deny" | None}
+    domains: patterns -> {pattern: True if blocked}
+    """
+    current = current_port_rules(snapshot)
+    port_states = {}
+    for port, proto in ports:
+        state = None
+        for action in ("allow", "deny"):
+            if (action, "in", port, proto) in current:
+                state = action
+        port_states[port, proto] = state
+
+    domain_states = {}
+    if domains:
+        patterns = set(domain_index.patterns())
+        for pattern in domains:
+            rule_domain, kind = parse_pattern(pattern)
+            state = True
+            if kind != "exact":
+                state = format_pattern(rule_domain, kind) in patterns
+            if kind != "wildcard":
+                base, www = normalize_domain(rule_domain)
+                state = state and base in hosts_file and www in hosts_file
+            domain_states[pattern] = state
+    return port_states, domain_states
+
+
+def plan_changes(ports: dict, domains: dict, snapshot) -> PolicyPlan:
+    """
+    Plan that sets individual targets and leaves everything else alone
+    ports: {(port, proto): "allow" | "deny" | None (neither rule)}, both directions
+    domains: {pattern: True to block, False to unblock}
+    Allow rules of protected ports are never removed.
+    """
+    plan = PolicyPlan()
+    families = {"v4", "v6"} if ipv6_enabled() else {"v4"}
+    current = current_port_rules(snapshot)
+    for (port, proto), verb in ports.items():
+        for direction in DIRECTIONS:
+            for action in ("allow", "deny"):
+                key = (action, direction, port, proto)
+                if action == verb:
+                    if action == "deny" and _protected(port):
+                        continue
+                    if not families <= current.get(key, set()):
+                        plan.rules_add.append(RuleSpec(action, direction, port=port, proto=proto))
+                elif key in current:
+                    if action == "allow" and _protected(port):
+                        continue
+                    plan.rules_delete.append(RuleSpec(action, direction, port=port, proto=proto))
+
+    if domains:
+        patterns = set(domain_index.patterns())
+        for pattern, block in domains.items():
+            rule_domain, kind = parse_pattern(pattern)
+            if kind != "exact":
+                name = format_pattern(rule_domain, kind)
+                if block and name not in patterns:
+                    plan.patterns_add.append(name)
+                elif not block and name in patterns:
+                    plan.patterns_remove.append(name)
+            if kind != "wildcard":
+                base, www = normalize_domain(rule_domain)
+                if block and (base not in hosts_file or www not in hosts_file):
+                    plan.block[base] = www
+                elif not block:
+                    plan.unblock.extend(name for name in (base, www) if name in hosts_file)
+    return plan
+
+
+def current_policy(snapshot) -> dict:
+    """
+    The policy document that describes the current state
+    Policy entries cover both directions, so ports with only an in or an
+    out rule are left out.
+    """
+    service_by_key = {resolve_service(service): service for service in SERVICES}
+    current = current_port_rules(snapshot)
+    services = {}
+    ports = []
+    for (action, direction, port, proto) in current:
+        if direction != "in" or (action, "out", port, proto) not in current:
+            continue
+        state = "on" if action == "allow" else "off"
+        if (port, proto) in service_by_key:
+            services[service_by_key[port, proto]] = state
+        elif port.isdigit():
+            ports.append({"port": int(port), "proto": proto, "action": state})
+    ports.sort(key=lambda entry: (entry["port"], entry["proto"]))
+
+    # Only what a domains section manages (see plan_policy), not bulk imports
+    domains = sorted(domain for domain in domain_registry.managed() if domain in hosts_file)
+    return {"services": services, "ports": ports,
+            "domains": domains + sorted(domain_index.patterns())}
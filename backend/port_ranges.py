@@ -0,0 +1,252 @@
+from fastapi.concurrency import run_in_threadpool
+
+from backend.firewall_manager import FirewallManager
+from backend.policy import DIRECTIONS, current_port_rules
+from backend.rule_state import rule_state
+from backend.ufw_batch import RuleBatch, RuleSpec, ipv6_enabled
+
+# iptables multiport takes at most 15 ports per rule, a range counts as two
+MULTIPORT_SLOTS = 15
+
+PROTO_CHOICES = {"tcp": ("tcp",), "udp": ("udp",), "both": ("tcp", "udp")}
+
+_fw = FirewallManager()
+
+
+def parse_ports(text) -> list:
+    """
+    Parse a port, range or list into sorted (low, high) intervals
+    Examples: 80, '6000-6100', '6000:6100', '80,443,8000-8010'
+    Raises ValueError for anything outside 1-65535
+    """
+    intervals = []
+    for part in str(text).replace(" ", "").split(","):
+        low, sep, high = part.replace("-", ":").partition(":")
+        try:
+            low = int(low)
+            high = int(high) if sep else low
+        except ValueError:
+            raise ValueError(f"Invalid port or range: {part or text!r}")
+        for port in (low, high):
+            if port < _fw.MIN_PORT or port > _fw.MAX_PORT:
+                raise ValueError(f"Invalid port: {port} is out of range. "
+                                 f"Valid range: {_fw.MIN_PORT}-{_fw.MAX_PORT}")
+        if low > high:
+            raise ValueError(f"Invalid range: {part} (start is above end)")
+        intervals.append((low, high))
+    return merge_intervals(intervals)
+
+
+def covers_protected(port) -> bool:
+    """Does a rule's port, range or list ('22', '20:30', '80,443') include a protected port?"""
+    try:
+        intervals = parse_ports(port)
+    except ValueError:
+        return False
+    return any(low <= protected <= high
+               for low, high in intervals for protected in _fw.PROTECTED_PORTS)
+
+
+def merge_intervals(intervals) -> list:
+    """Merge overlapping and adjacent intervals: [(1,5), (6,9)] -> [(1,9)]"""
+    merged = []
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + 1:
+            if high > merged[-1][1]:
+                merged[-1] = (merged[-1][0], high)
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def subtract_intervals(intervals, remove) -> list:
+    """Parts of `intervals` not covered by `remove` (both merged and sorted)"""
+    result = []
+    for low, high in intervals:
+        for r_low, r_high in remove:
+            if r_high < low or r_low > high:
+                continue
+            if r_low > low:
+                result.append((low, r_low - 1))
+            low = r_high + 1
+            if low > high:
+                break
+        if low <= high:
+            result.append((low, high))
+    return result
+
+
+def overlaps(intervals, other) -> bool:
+    return bool(intervals) and subtract_intervals(intervals, other) != intervals
+
+
+def pack_ports(intervals) -> list:
+    """
+    Group merged intervals into as few ufw port specs as multiport allows
+    Returns: ['80', '6000:6100', '22,80,443:445', ...]
+    """
+    specs = []
+    current, slots = [], 0
+    for low, high in intervals:
+        cost = 1 if low == high else 2
+        if slots + cost > MULTIPORT_SLOTS:
+            specs.append(",".join(current))
+            current, slots = [], 0
+        current.append(str(low) if low == high else f"{low}:{high}")
+        slots += cost
+    if current:
+        specs.append(",".join(current))
+    return specs
+
+
+def _count(intervals) -> int:
+    return sum(high - low + 1 for low, high in intervals)
+
+
+def _format(intervals) -> str:
+    return ",".join(str(low) if low == high else f"{low}-{high}" for low, high in intervals)
+
+
+def parse_bulk_request(body: dict) -> list:
+    """
+    Validate a bulk port request before anything is changed
+    Body:
+        {"action": "on", "proto": "tcp",
+         "ports": [80, "6000-6100", {"port": "5000:5010", "proto": "both", "action": "off"}]}
+    "proto" is tcp, udp or both; items may override "proto" and "action".
+    Returns: list of items dict(item, intervals, protos, action)
+    Raises ValueError listing every invalid item
+    """
+    if not isinstance(body, dict) or not isinstance(body.get("ports"), list) or not body["ports"]:
+        raise ValueError("Body must be an object with a non-empty 'ports' list")
+    default_action = str(body.get("action", "on")).lower()
+    default_proto = str(body.get("proto", "tcp")).lower()
+
+    items, errors = [], []
+    for index, entry in enumerate(body["ports"]):
+        if isinstance(entry, dict):
+            ports = entry.get("port", entry.get("ports"))
+            action = str(entry.get("action", default_action)).lower()
+            proto = str(entry.get("proto", default_proto)).lower()
+        else:
+            ports, action, proto = entry, default_action, default_proto
+        try:
+            if action not in ("on", "off"):
+                raise ValueError("Invalid action. Use 'on' or 'off'")
+            if proto not in PROTO_CHOICES:
+                raise ValueError(f"Invalid protocol: {proto}. Valid protocols: tcp, udp, both")
+            intervals = parse_ports(ports)
+            if action == "off":
+                for port, reason in _fw.PROTECTED_PORTS.items():
+                    if any(low <= port <= high for low, high in intervals):
+                        raise ValueError(f"Cannot block port {port} - {reason}")
+        except ValueError as e:
+            errors.append(f"ports[{index}] ({ports}): {e}")
+            continue
+        items.append({"item": entry, "intervals": intervals,
+                      "protos": PROTO_CHOICES[proto], "action": action})
+
+    # The same port cannot be opened and blocked by one request
+    for proto in ("tcp", "udp"):
+        on = merge_intervals(iv for item in items if item["action"] == "on"
+                             and proto in item["protos"] for iv in item["intervals"])
+        off = merge_intervals(iv for item in items if item["action"] == "off"
+                              and proto in item["protos"] for iv in item["intervals"])
+        clash = subtract_intervals(on, subtract_intervals(on, off))
+        if clash:
+            errors.append(f"Conflicting actions for {_format(clash)}/{proto}")
+    if errors:
+        raise ValueError("; ".join(errors))
+    return items
+
+
+def plan_bulk(items, snapshot) -> dict:
+    """
+    Rule changes that give every requested port its action
+    Existing plain port rules of the same protocol that overlap the request
+    are removed; the parts of them outside the request are re-added.
+    Returns: dict(add, delete) lists of RuleSpec
+    """
+    families = {"v4", "v6"} if ipv6_enabled() else {"v4"}
+    current = current_port_rules(snapshot)
+    add, delete = [], []
+    for proto in ("tcp", "udp"):
+        wanted = {}
+        for verb, action in (("allow", "on"), ("deny", "off")):
+            wanted[verb] = merge_intervals(iv for item in items if item["action"] == action
+                                           and proto in item["protos"]
+                                           for iv in item["intervals"])
+        requested = merge_intervals(wanted["allow"] + wanted["deny"])
+        if not requested:
+            continue
+
+        desired = {}
+        for verb, intervals in wanted.items():
+            for port in pack_ports(intervals):
+                for direction in DIRECTIONS:
+                    desired[verb, direction, port, proto] = RuleSpec(
+                        verb, direction, port=port, proto=proto)
+
+        for key, present in current.items():
+            action, direction, port, rule_proto = key
+            if rule_proto != proto or key in desired:
+                continue
+            try:
+                existing = parse_ports(port)
+            except ValueError:
+                continue
+            if not overlaps(existing, requested):
+                continue
+            delete.append(RuleSpec(action, direction, port=port, proto=proto))
+            for rest in pack_ports(subtract_intervals(existing, requested)):
+                add.append(RuleSpec(action, direction, port=rest, proto=proto))
+
+        for key, spec in desired.items():
+            if not families <= current.get(key, set()):
+                add.append(spec)
+    return {"add": add, "delete": delete}
+
+
+def _apply(plan) -> dict:
+    batch = RuleBatch()
+    for spec in plan["delete"]:
+        batch.delete(spec)
+    for spec in plan["add"]:
+        batch.add(spec)
+    stats = batch.apply()
+    rule_state.invalidate()
+    return stats
+
+
+async def apply_bulk_ports(body: dict, dry_run=False) -> dict:
+    """
+    Open or block lists and ranges of ports with one rules rewrite and one reload
+    Raises ValueError for an invalid request (nothing is changed)
+    """
+    items = parse_bulk_request(body)
+    snapshot = await run_in_threadpool(rule_state.snapshot)
+    if snapshot.error:
+        raise RuntimeError(snapshot.error)
+    plan = plan_bulk(items, snapshot)
+
+    def describe(spec):
+        return f"{spec.action} {spec.direction} {spec.port}/{spec.proto}"
+
+    response = {
+        "status": "success",
+        "dry_run": dry_run,
+        "changed": bool(plan["add"] or plan["delete"]),
+        "items": [{
+            "item": item["item"],
+            "ports": _format(item["intervals"]),
+            "port_count": _count(item["intervals"]),
+            "protocols": list(item["protos"]),
+            "action": item["action"],
+            "rule_ports": pack_ports(item["intervals"]),
+        } for item in items],
+        "rules_add": [describe(spec) for spec in plan["add"]],
+        "rules_delete": [describe(spec) for spec in plan["delete"]],
+    }
+    if not dry_run and response["changed"]:
+        response["batch"] = await run_in_threadpool(_apply, plan)
+    return response
@@ -0,0 +1,411 @@
+import bisect
+import ipaddress
+import logging
+import socket
+import threading
+import time
+
+from backend import config
+from backend.port_ranges import parse_ports
+from backend.rule_state import rule_state
+
+logger = logging.getLogger(__name__)
+
+FLOW_DIRECTIONS = ("in", "out", "fwd")
+FLOW_PROTOCOLS = ("tcp", "udp")
+# UFW defaults file key -> flow direction
+DEFAULT_POLICY_KEYS = {"DEFAULT_INPUT_POLICY": "in", "DEFAULT_OUTPUT_POLICY": "out",
+                       "DEFAULT_FORWARD_POLICY": "fwd"}
+POLICY_VERDICTS = {"DROP": "deny", "ACCEPT": "allow", "REJECT": "reject"}
+MAX_FLOWS = 1000000
+# evaluate() looks for repeated flows in windows of DEDUPE_WINDOW flows;
+# after a window where fewer than 1 in DEDUPE_MIN_HIT_RATIO were repeats it
+# skips the lookup for DEDUPE_BACKOFF windows, then samples again
+DEDUPE_WINDOW = 1024
+DEDUPE_MIN_HIT_RATIO = 8
+DEDUPE_BACKOFF = 8
+
+
+def read_default_policies() -> dict:
+    """Default verdict per direction from the UFW defaults file"""
+    policies = {"in": "deny", "out": "allow", "fwd": "deny"}
+    try:
+        with open(config.UFW_DEFAULTS_FILE, "r") as f:
+            for line in f:
+                key, sep, value = line.strip().partition("=")
+                if sep and key in DEFAULT_POLICY_KEYS:
+                    verdict = POLICY_VERDICTS.get(value.strip().strip('"').upper())
+                    if verdict:
+                        policies[DEFAULT_POLICY_KEYS[key]] = verdict
+    except OSError:
+        pass
+    return policies
+
+
+def address_range(text) -> tuple:
+    """'10.0.0.0/8' -> (version, first, last) as integers"""
+    network = ipaddress.ip_network(text, strict=False)
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+class IntervalIndex:
+    """
+    Static stabbing index over integer intervals (ports, CIDR ranges)
+    The interval end points split the number line into elementary segments,
+    each storing the sorted rule indexes covering it; a lookup is one bisect.
+    """
+
+    def __init__(self, entries):
+        """entries: (low, high, rule index) with inclusive bounds"""
+        starts, ends = {}, {}
+        for low, high, index in entries:
+            starts.setdefault(low, []).append(index)
+            ends.setdefault(high + 1, []).append(index)
+        self.points = sorted(set(starts) | set(ends))
+        self.segments = []
+        active = set()
+        for point in self.points:
+            active.difference_update(ends.get(point, ()))
+            active.update(starts.get(point, ()))
+            self.segments.append(tuple(sorted(active)))
+
+    def lookup(self, value) -> tuple:
+        position = bisect.bisect_right(self.points, value) - 1
+        return self.segments[position] if position >= 0 else ()
+
+    def __len__(self):
+        return len(self.points)
+
+
+class CompiledRule:
+    """
+    Match conditions of one UfwRule, independent of its position
+    Cached by rule key so a ruleset change only compiles the new rules.
+    """
+
+    __slots__ = ("rule", "version", "proto", "dst", "dport", "src", "sport", "interface")
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.version = 6 if rule.ipv6 else 4
+        self.dst = self.src = None
+        if rule.to_address:
+            self.version, low, high = address_range(rule.to_address)
+            self.dst = (low, high)
+        if rule.from_address:
+            self.version, low, high = address_range(rule.from_address)
+            self.src = (low, high)
+        self.dport = tuple(parse_ports(rule.to_port)) if rule.to_port else None
+        self.sport = tuple(parse_ports(rule.from_port)) if rule.from_port else None
+        self.proto = rule.proto or "any"
+        self.interface = rule.interface
+
+    def matches(self, src, dst, sport, dport, proto, interface) -> bool:
+        if self.proto != "any":
+            if proto != self.proto:
+                return False
+        elif (self.dport or self.sport) and proto not in ("tcp", "udp"):
+            # "ufw allow 53" means 53/tcp and 53/udp
+            return False
+        if self.dst and (dst is None or not self.dst[0] <= dst <= self.dst[1]):
+            return False
+        if self.src and (src is None or not self.src[0] <= src <= self.src[1]):
+            return False
+        if self.dport and not _in_ranges(dport, self.dport):
+            return False
+        if self.sport and not _in_ranges(sport, self.sport):
+            return False
+        if self.interface and interface != self.interface:
+            return False
+        return True
+
+
+def _in_ranges(value, ranges) -> bool:
+    if value is None:
+        return False
+    for low, high in ranges:
+        if low <= value <= high:
+            return True
+    return False
+
+
+class CompiledRuleset:
+    """
+    One ruleset generation compiled for first-match lookups
+    Rules are grouped by (direction, IP version); within a group each rule
+    is indexed under its most selective condition (destination address,
+    source address, destination port, or none). A flow only checks the
+    rules its indexes return, in ruleset order, and stops at the first match.
+    """
+
+    def __init__(self, rules, compiled, generation, active, defaults):
+        self.rules = rules
+        self.compiled = compiled
+        self.generation = generation
+        self.active = active
+        self.defaults = defaults
+        self.skipped = 0
+        self.groups = {}
+
+        entries = {}
+        for index, (rule, match) in enumerate(zip(rules, compiled)):
+            if match is None:
+                self.skipped += 1
+                continue
+            group = entries.setdefault((rule.direction, match.version),
+                                       {"dst": [], "src": [], "dport": [], "rest": []})
+            if match.dst:
+                group["dst"].append((match.dst[0], match.dst[1], index))
+            elif match.src:
+                group["src"].append((match.src[0], match.src[1], index))
+            elif match.dport:
+                group["dport"].extend((low, high, index) for low, high in match.dport)
+            else:
+                group["rest"].append(index)
+        for key, group in entries.items():
+            self.groups[key] = (IntervalIndex(group["dst"]), IntervalIndex(group["src"]),
+                                IntervalIndex(group["dport"]), tuple(group["rest"]))
+
+    def first_match(self, direction, version, src, dst, sport, dport, proto, interface):
+        """Index of the first rule matching the flow, or None"""
+        group = self.groups.get((direction, version))
+        if group is None:
+            return None
+        dst_index, src_index, dport_index, rest = group
+        candidates = list(rest)
+        if dst is not None:
+            candidates.extend(dst_index.lookup(dst))
+        if src is not None:
+            candidates.extend(src_index.lookup(src))
+        if dport is not None:
+            candidates.extend(dport_index.lookup(dport))
+        candidates.sort()
+        compiled = self.compiled
+        for index in candidates:
+            if compiled[index].matches(src, dst, sport, dport, proto, interface):
+                return index
+        return None
+
+
+def _parse_address(text) -> tuple:
+    """'1.2.3.4' -> (4, integer); inet_pton is much cheaper than ipaddress"""
+    for family, version in ((socket.AF_INET, 4), (socket.AF_INET6, 6)):
+        try:
+            return version, int.from_bytes(socket.inet_pton(family, text), "big")
+        except (OSError, TypeError):
+            pass
+    # Forms inet_pton does not take (scoped IPv6 addresses)
+    address = ipaddress.ip_address(text)
+    return address.version, int(address)
+
+
+def _parse_port(value, name):
+    if type(value) is int and 0 <= value <= 65535:
+        return value
+    if value is None or value == "":
+        return None
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if not 0 <= port <= 65535:
+        raise ValueError(f"Invalid {name}: {port} is out of range")
+    return port
+
+
+def parse_flow(flow: dict, addresses: dict) -> tuple:
+    """
+    Validate one flow
+    Flow: {"direction": "in", "src": "1.2.3.4", "dst": "10.0.0.5", "port": 22,
+           "proto": "tcp", "sport": 51000, "interface": "eth0"}
+    Missing addresses / ports only match rules that do not restrict them.
+    addresses caches parsed address strings across a batch.
+    Returns: (direction, version, src, dst, sport, dport, proto, interface)
+    """
+    if not isinstance(flow, dict):
+        raise ValueError("Each flow must be a JSON object")
+    # Already-canonical values (the common case) skip str() / lower()
+    direction = flow.get("direction", "in")
+    if direction not in FLOW_DIRECTIONS:
+        direction = str(direction).lower()
+        if direction not in FLOW_DIRECTIONS:
+            raise ValueError(f"Invalid direction: {direction}. Use in, out or fwd")
+    proto = flow.get("proto", "tcp")
+    if proto not in FLOW_PROTOCOLS:
+        proto = str(proto).lower()
+
+    src = _flow_address(flow, "src", addresses)
+    dst = _flow_address(flow, "dst", addresses)
+    if src is not None and dst is not None and src[0] != dst[0]:
+        raise ValueError("src and dst must be the same IP version")
+    if src is not None:
+        version = src[0]
+    elif dst is not None:
+        version = dst[0]
+    else:
+        version = 6 if flow.get("ipv6") else 4
+
+    return (direction, version, src and src[1], dst and dst[1],
+            _parse_port(flow.get("sport"), "sport"),
+            _parse_port(flow.get("port", flow.get("dport")), "port"),
+            proto, flow.get("interface"))
+
+
+def _flow_address(flow, name, addresses):
+    """(version, integer) of a flow's src / dst, or None if it is not set"""
+    text = flow.get(name)
+    if text in (None, "", "any", "Anywhere"):
+        return None
+    if not isinstance(text, str):
+        raise ValueError(f"Invalid {name} address: {text!r}")
+    parsed = addresses.get(text)
+    if parsed is None:
+        try:
+            parsed = addresses[text] = _parse_address(text)
+        except ValueError:
+            raise ValueError(f"Invalid {name} address: {text!r}")
+    return parsed
+
+
+class RuleEvaluator:
+    """
+    Answers "which rule decides this flow?" against the cached ruleset
+    The compiled index follows rule_state: when a new generation arrives
+    only rules not seen before are compiled and the indexes are rebuilt.
+    Evaluates UFW user rules and default policies (not before.rules).
+    """
+
+    def __init__(self, state=None):
+        self.state = state or rule_state
+        self._compiled = None
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.rules_compiled = 0
+        self.rules_reused = 0
+        self.last_build_ms = 0.0
+        self.state.add_listener(self._on_rules_changed)
+
+    def _on_rules_changed(self, previous, snapshot):
+        self.compile(snapshot)
+
+    def compile(self, snapshot) -> CompiledRuleset:
+        """Compiled ruleset for a snapshot (reused while its generation is current)"""
+        with self._lock:
+            current = self._compiled
+            if current is not None and current.generation == snapshot.generation:
+                return current
+            started = time.perf_counter()
+            cache, compiled = {}, []
+            for rule in snapshot.rules:
+                key = rule.key()
+                if key in self._cache:
+                    match = self._cache[key]
+                    self.rules_reused += 1
+                elif rule.app:
+                    # Application profiles are not expanded
+                    match = None
+                else:
+                    try:
+                        match = CompiledRule(rule)
+                    except ValueError:
+                        logger.warning("cannot compile rule %s", rule)
+                        match = None
+                    self.rules_compiled += 1
+                cache[key] = match
+                compiled.append(match)
+            self._cache = cache
+            current = CompiledRuleset(snapshot.rules, compiled, snapshot.generation,
+                                      snapshot.active, read_default_policies())
+            self._compiled = current
+            self.builds += 1
+            self.last_build_ms = round((time.perf_counter() - started) * 1000, 3)
+            return current
+
+    def evaluate(self, flows: list) -> dict:
+        """
+        First matching rule and verdict for each flow
+        Returns: dict(generation, results, rules) where each result is
+        {"verdict", "rule": rule number or None, "default": bool} and
+        rules maps the matched rule numbers to the rules
+        """
+        if len(flows) > MAX_FLOWS:
+            raise ValueError(f"Too many flows (at most {MAX_FLOWS})")
+        ruleset = self.compile(self.state.snapshot())
+        addresses, seen, results, matched, outcomes = {}, {}, [], {}, {}
+        evaluate_one = self._evaluate_one
+        dedupe = True
+        # Batches often repeat flows: evaluate each distinct one once, unless
+        # the batch turns out to be mostly distinct (then keys cost more than
+        # they save)
+        for start in range(0, len(flows), DEDUPE_WINDOW):
+            window = flows[start:start + DEDUPE_WINDOW]
+            if start // DEDUPE_WINDOW % (DEDUPE_BACKOFF + 1) and not dedupe:
+                for flow in window:
+                    results.append(evaluate_one(ruleset, parse_flow(flow, addresses),
+                                                matched, outcomes))
+                continue
+            hits = 0
+            for flow in window:
+                if not isinstance(flow, dict):
+                    raise ValueError("Each flow must be a JSON object")
+                key = (flow.get("direction"), flow.get("src"), flow.get("dst"), flow.get("port"),
+                       flow.get("dport"), flow.get("sport"), flow.get("proto"),
+                       flow.get("interface"), flow.get("ipv6"))
+                try:
+                    result = seen.get(key)
+                except TypeError:
+                    # Unhashable field: parse_flow rejects it below
+                    key, result = None, None
+                if result is None:
+                    result = evaluate_one(ruleset, parse_flow(flow, addresses), matched,
+                                          outcomes)
+                    seen[key] = result
+                else:
+                    hits += 1
+                results.append(result)
+            dedupe = hits * DEDUPE_MIN_HIT_RATIO >= len(window)
+        return {
+            "generation": ruleset.generation,
+            "active": ruleset.active,
+            "results": results,
+            "rules": {number: rule.to_dict() for number, rule in matched.items()},
+        }
+
+    @staticmethod
+    def _evaluate_one(ruleset, flow, matched, outcomes) -> dict:
+        """Flows with the same outcome share one result dict"""
+        if ruleset.active is False:
+            index = None
+        else:
+            index = ruleset.first_match(*flow)
+        key = flow[0] if index is None else index
+        result = outcomes.get(key)
+        if result is not None:
+            return result
+        if ruleset.active is False:
+            result = {"verdict": "allow", "rule": None, "default": True}
+        elif index is None:
+            result = {"verdict": ruleset.defaults[flow[0]], "rule": None, "default": True}
+        else:
+            rule = ruleset.rules[index]
+            matched.setdefault(rule.number, rule)
+            result = {"verdict": rule.action, "rule": rule.number, "default": False}
+        outcomes[key] = result
+        return result
+
+    def stats(self) -> dict:
+        ruleset = self._compiled
+        return {
+            "generation": ruleset.generation if ruleset else None,
+            "rules": len(ruleset.rules) if ruleset else 0,
+            "skipped": ruleset.skipped if ruleset else 0,
+            "builds": self.builds,
+            "rules_compiled": self.rules_compiled,
+            "rules_reused": self.rules_reused,
+            "last_build_ms": self.last_build_ms,
+        }
+
+
+# Shared evaluator used by the API server
+rule_evaluator = RuleEvaluator()
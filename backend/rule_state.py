@@ -0,0 +1,194 @@
+import json
+import logging
+import threading
+import time
+
+from backend import config
+from backend.firewall_manager import FirewallManager
+from backend.changelog import ChangeLog
+from backend.metrics import metrics
+from backend.ufw_rules import UfwRule, diff_rules, parse_status
+
+logger = logging.getLogger(__name__)
+
+
+class RuleSnapshot:
+    """Parsed `ufw status numbered` output captured at a point in time"""
+
+    def __init__(self, raw, generation):
+        parsed = parse_status(raw)
+        self.raw = raw
+        self.active = parsed["active"]
+        self.rules = parsed["rules"]
+        self.error = raw if raw.startswith("Error:") else None
+        self.generation = generation
+        self.fetched_at = time.time()
+        self._fetched_monotonic = time.monotonic()
+        # Serialized rules, built on first to_dict() and shared by every later call
+        self._rule_dicts = None
+        # Encoded status bodies by include_raw, built on first to_json()
+        self._json = {}
+
+    def age(self):
+        return time.monotonic() - self._fetched_monotonic
+
+    def to_dict(self, include_raw=False):
+        """Callers must not modify the returned "rules" list (it is cached)"""
+        if self._rule_dicts is None:
+            self._rule_dicts = [rule.to_dict() for rule in self.rules]
+        data = {
+            "active": self.active,
+            "rules": self._rule_dicts,
+            "total": len(self.rules),
+            "generation": self.generation,
+            "fetched_at": self.fetched_at,
+            "age": round(self.age(), 3),
+        }
+        if self.error:
+            data["error"] = self.error
+        if include_raw:
+            data["raw"] = self.raw
+        return data
+
+    def to_json(self, include_raw=False) -> bytes:
+        """
+        to_dict() encoded once per generation, without "age" so the bytes
+        match the generation's ETag
+        """
+        body = self._json.get(include_raw)
+        if body is None:
+            data = self.to_dict(include_raw)
+            del data["age"]
+            body = self._json[include_raw] = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        return body
+
+
+class RuleStateCache:
+    """
+    In-memory copy of the UFW ruleset.
+    Reads are served from memory; mutating code calls invalidate() and a
+    background thread re-reads `ufw status` right away (and at least every
+    max_age seconds to pick up changes made outside this app).
+    """
+
+    def __init__(self, fetch, max_age=None):
+        self._fetch = fetch
+        self.max_age = config.RULE_CACHE_MAX_AGE if max_age is None else max_age
+        self._snapshot = None
+        self._dirty = True
+        self._generation = 0
+        self._refresh_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self.changes = ChangeLog()
+
+    def add_listener(self, callback):
+        """Register callback(previous, snapshot), called when the ruleset changes"""
+        self._listeners.append(callback)
+
+    @property
+    def generation(self) -> int:
+        """Generation of the last snapshot read (no refresh)"""
+        return self._generation
+
+    @property
+    def stale(self) -> bool:
+        """A mutation happened that the last snapshot does not show yet"""
+        return self._snapshot is None or self._dirty
+
+    def snapshot(self) -> RuleSnapshot:
+        """Return the current snapshot, refreshing only if it was invalidated"""
+        snapshot = self._snapshot
+        if snapshot is None or self._dirty:
+            snapshot = self.refresh()
+        return snapshot
+
+    def refresh(self) -> RuleSnapshot:
+        """Re-read `ufw status` (concurrent callers share one read)"""
+        with self._refresh_lock:
+            if self._snapshot is not None and not self._dirty \
+                    and self._snapshot.age() < 0.05:
+                return self._snapshot
+            # Clear first so an invalidate() during the read is not lost
+            self._dirty = False
+            raw = self._fetch()
+            previous = self._snapshot
+            generation = self._generation
+            if previous is None or previous.raw != raw:
+                generation += 1
+            snapshot = RuleSnapshot(raw, generation)
+            if previous is not None and generation == previous.generation:
+                # Same rules: keep the serialized copy of this generation
+                snapshot._rule_dicts = previous._rule_dicts
+                snapshot.fetched_at = previous.fetched_at
+                snapshot._json = previous._json
+            self._generation = generation
+            self._snapshot = snapshot
+            if previous is None:
+                self.changes.reset(generation)
+            elif generation != previous.generation:
+                added, removed = diff_rules(previous.rules, snapshot.rules)
+                self.changes.record(generation, [rule.key() for rule in added],
+                                    [rule.key() for rule in removed])
+        if generation != (previous.generation if previous else 0):
+            for callback in self._listeners:
+                try:
+                    callback(previous, snapshot)
+                except Exception:
+                    logger.exception("rule state listener failed")
+        return snapshot
+
+    def changes_since(self, generation, until=None):
+        """
+        Rules added / removed after a generation (as key dicts, without numbers)
+        Returns: dict(added, removed), or None if that generation is too old
+        """
+        changes = self.changes.since(generation, until)
+        if changes is None:
+            return None
+        added, removed = changes
+        return {"added": [UfwRule.key_to_dict(key) for key in added],
+                "removed": [UfwRule.key_to_dict(key) for key in removed]}
+
+    def invalidate(self):
+        """Mark the snapshot stale after a mutation and wake the refresher"""
+        self._dirty = True
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="rule-state-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(timeout=self.max_age)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the last good snapshot
+                self._dirty = True
+
+
+# Shared by the API server and the domain router
+rule_state = RuleStateCache(FirewallManager().service_status)
+metrics.gauge("firewall_rules", "Rules in the cached UFW ruleset",
+              lambda: len(rule_state._snapshot.rules) if rule_state._snapshot else None)
+metrics.gauge("firewall_ruleset_generation", "Ruleset changes seen since start",
+              lambda: rule_state.generation, kind="counter")
@@ -0,0 +1,635 @@
+import asyncio
+import datetime
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from backend import config
+from backend.domain_trie import format_pattern, parse_pattern
+from backend.firewall_domain import normalize_domain
+from backend.firewall_manager import FirewallManager
+from backend.jobs import executor
+from backend.policy import execute_plan, plan_changes, target_states
+from backend.rule_state import rule_state
+from backend.ufw_batch import resolve_service
+
+logger = logging.getLogger(__name__)
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DAY_GROUPS = {"daily": DAYS, "weekdays": DAYS[:5], "weekends": DAYS[5:]}
+# "on" opens ports / unblocks domains, "off" blocks them
+ACTIONS = {"on": "on", "allow": "on", "unblock": "on", "off": "off", "deny": "off", "block": "off"}
+CLOCK_RE = re.compile(r"^(\d{1,2}):(\d{2})$")
+# A window that never changes state is re-evaluated after this long
+WINDOW_HORIZON = 7 * 86400
+MAX_PAGE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedules (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+_fw = FirewallManager()
+
+
+# -- parsing ----------------------------------------------------------------
+
+def parse_time(value) -> float:
+    """Unix time, or ISO 8601 (local time when it has no offset)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.datetime.fromisoformat(str(value).strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}. Use unix seconds or ISO 8601")
+
+
+def parse_clock(text) -> int:
+    """'09:30' -> minutes after midnight"""
+    match = CLOCK_RE.match(str(text).strip())
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError(f"Invalid time of day: {text}. Use HH:MM")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def _list(body, key) -> list:
+    value = body.get(key)
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValueError(f"{key} must be a list")
+    return value
+
+
+def parse_window(window) -> dict:
+    if not isinstance(window, dict):
+        raise ValueError("window must be an object with days, start and end")
+    days = window.get("days", "daily")
+    if isinstance(days, str):
+        if days.lower() not in DAY_GROUPS:
+            raise ValueError(f"Invalid days: {days}. Use a list or one of {', '.join(DAY_GROUPS)}")
+        days = DAY_GROUPS[days.lower()]
+    elif not isinstance(days, list):
+        raise ValueError("days must be a list or one of " + ", ".join(DAY_GROUPS))
+    days = [str(day).lower()[:3] for day in days]
+    unknown = [day for day in days if day not in DAYS]
+    if unknown or not days:
+        raise ValueError(f"Invalid days: {', '.join(unknown) or 'none'}")
+    start, end = parse_clock(window.get("start", "")), parse_clock(window.get("end", ""))
+    return {"days": [day for day in DAYS if day in days],
+            "start": f"{start // 60:02d}:{start % 60:02d}",
+            "end": f"{end // 60:02d}:{end % 60:02d}"}
+
+
+def parse_ports(entries, verb) -> list:
+    ports = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            port, proto = entry.get("port"), str(entry.get("proto", "tcp")).lower()
+        else:
+            port, _, proto = str(entry).partition("/")
+            proto = proto.lower() or "tcp"
+        is_valid, error, _ = _fw.validate_port(port)
+        if not is_valid:
+            raise ValueError(error)
+        proto_valid, proto_error = _fw.validate_protocol(proto)
+        if not proto_valid:
+            raise ValueError(proto_error)
+        if verb == "off" and int(port) in _fw.PROTECTED_PORTS:
+            raise ValueError(f"Cannot block port {port} - {_fw.PROTECTED_PORTS[int(port)]}")
+        ports.append(f"{int(port)}/{proto}")
+    return ports
+
+
+def parse_schedule(body: dict) -> dict:
+    """
+    Validate a schedule document
+    Body:
+        {"name": "work hours", "action": "block",
+         "domains": ["facebook.com", "*.tiktok.com"], "ports": [5432, "6000/udp"],
+         "services": ["ftp"],
+         "window": {"days": "weekdays", "start": "09:00", "end": "17:00"}}
+    or instead of a window a one-off span: "start_at" (default now) and
+    "end_at" or "duration" seconds; without an end the change is permanent.
+    Raises ValueError.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Schedule must be a JSON object")
+    unknown = set(body) - {"name", "action", "ports", "services", "domains", "window",
+                           "start_at", "end_at", "duration"}
+    if unknown:
+        raise ValueError(f"Unknown schedule field(s): {', '.join(sorted(unknown))}")
+    verb = ACTIONS.get(str(body.get("action", "")).lower().strip())
+    if verb is None:
+        raise ValueError("Invalid action. Use on/off, allow/deny or block/unblock")
+
+    ports = parse_ports(_list(body, "ports"), verb)
+    services = []
+    for service in _list(body, "services"):
+        is_valid, error = _fw.validate_service(service)
+        if not is_valid:
+            raise ValueError(error)
+        port, proto = resolve_service(service.lower().strip())
+        if verb == "off" and port.isdigit() and int(port) in _fw.PROTECTED_PORTS:
+            raise ValueError(f"Cannot block {service} - {_fw.PROTECTED_PORTS[int(port)]}")
+        services.append(service.lower().strip())
+        ports.append(f"{port}/{proto}")
+    domains = []
+    for entry in _list(body, "domains"):
+        rule_domain, kind = parse_pattern(str(entry))
+        if not rule_domain:
+            raise ValueError(f"Invalid domain: {entry}")
+        if kind == "exact":
+            rule_domain = normalize_domain(rule_domain)[0]
+        domains.append(format_pattern(rule_domain, kind))
+    if not ports and not domains:
+        raise ValueError("A schedule needs ports, services or domains")
+
+    schedule = {
+        "name": str(body.get("name") or ""),
+        "action": verb,
+        "ports": sorted(set(ports)),
+        "services": services,
+        "domains": sorted(set(domains)),
+        "window": None,
+        "start_at": None,
+        "end_at": None,
+    }
+    spans = [key for key in ("start_at", "end_at", "duration") if body.get(key) is not None]
+    if body.get("window") is not None:
+        if spans:
+            raise ValueError("Use either window or start_at / end_at / duration")
+        schedule["window"] = parse_window(body["window"])
+        return schedule
+    if not spans:
+        raise ValueError("A schedule needs a window, start_at, end_at or duration")
+    start = parse_time(body["start_at"]) if body.get("start_at") is not None else time.time()
+    end = None
+    if body.get("duration") is not None:
+        if body.get("end_at") is not None:
+            raise ValueError("Use either end_at or duration")
+        try:
+            duration = float(body["duration"])
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid duration: {body['duration']}. Use seconds")
+        if not math.isfinite(duration) or duration <= 0:
+            raise ValueError("duration must be positive")
+        end = start + duration
+    elif body.get("end_at") is not None:
+        end = parse_time(body["end_at"])
+        if end <= start:
+            raise ValueError("end_at must be after start_at")
+    schedule["start_at"], schedule["end_at"] = start, end
+    return schedule
+
+
+def targets(schedule) -> list:
+    return [f"port:{port}" for port in schedule["ports"]] + \
+           [f"domain:{domain}" for domain in schedule["domains"]]
+
+
+def action_state(schedule, target):
+    """State a target has while the schedule is active"""
+    if target.startswith("port:"):
+        return "allow" if schedule["action"] == "on" else "deny"
+    return schedule["action"] == "off"
+
+
+# -- time -------------------------------------------------------------------
+
+def window_spans(window, at) -> list:
+    """(start, end) unix times of the window's occurrences around `at`"""
+    start, end = parse_clock(window["start"]), parse_clock(window["end"])
+    length = datetime.timedelta(minutes=(end - start) % 1440 or 1440)
+    days = {DAYS.index(day) for day in window["days"]}
+    today = datetime.datetime.fromtimestamp(at).date()
+    spans = []
+    for offset in range(-2, 9):
+        day = today + datetime.timedelta(days=offset)
+        if day.weekday() in days:
+            begin = datetime.datetime.combine(day, datetime.time(start // 60, start % 60))
+            spans.append((begin.timestamp(), (begin + length).timestamp()))
+    return spans
+
+
+def is_active(schedule, at) -> bool:
+    if schedule["window"] is not None:
+        return any(begin <= at < end for begin, end in window_spans(schedule["window"], at))
+    return schedule["start_at"] <= at and (schedule["end_at"] is None or at < schedule["end_at"])
+
+
+def next_change(schedule, at):
+    """When the schedule next turns on or off after `at` (None: never again)"""
+    if schedule["window"] is not None:
+        spans = window_spans(schedule["window"], at)
+        active = any(begin <= at < end for begin, end in spans)
+        for boundary in sorted({edge for span in spans for edge in span if edge > at}):
+            if any(begin <= boundary < end for begin, end in spans) != active:
+                return boundary
+        return at + WINDOW_HORIZON
+    if at < schedule["start_at"]:
+        return schedule["start_at"]
+    if schedule["end_at"] is not None and at < schedule["end_at"]:
+        return schedule["end_at"]
+    return None
+
+
+class Scheduler:
+    """
+    Time-based rules: recurring windows ("block these domains 09:00-17:00
+    on weekdays") and one-off spans / TTLs ("open 5432 for 30 minutes").
+
+    Every schedule has one pending timer (its next on/off boundary) in a
+    heap with lazy deletion, so adding, moving and cancelling timers is
+    O(log n). Timers falling due within SCHEDULE_BATCH_WINDOW of each
+    other fire as one job: the target states of all of them become a
+    single plan (one rules rewrite, one hosts rewrite, one reload).
+
+    When a schedule turns on it records the state its targets had, and
+    restores it when it turns off. Schedules overlapping on a target stack:
+    the newer one's record is handed down when an older one ends first.
+    Schedules live in SQLite; on start every schedule whose state should
+    have changed while the backend was down is applied at once.
+    """
+
+    def __init__(self, path=None, batch_window=None, retry=None):
+        self.path = path or config.SCHEDULE_DB
+        self.batch_window = config.SCHEDULE_BATCH_WINDOW if batch_window is None \
+            else batch_window
+        self.retry = retry or config.SCHEDULE_RETRY
+        self._schedules = {}
+        self._active = {}
+        self._heap = []
+        self._due = {}
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+        self.batches = 0
+        self.fired = 0
+        self.last_batch = None
+        self.last_error = None
+
+    # -- storage ------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _store(self, schedules=(), deleted=(), known_only=False):
+        """
+        Write changed schedules and drop finished ones in one transaction
+        known_only: skip schedules removed in the meantime (checked under the
+        lock, so a concurrent remove() cannot be undone by this write)
+        """
+        with self._db_lock:
+            if known_only:
+                schedules = [s for s in schedules if s["id"] in self._schedules]
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO schedules (id, data) VALUES (?, ?)",
+                                 [(s["id"], json.dumps(s)) for s in schedules])
+                conn.executemany("DELETE FROM schedules WHERE id = ?",
+                                 [(schedule_id,) for schedule_id in deleted])
+
+    def load(self):
+        """Read every schedule and set its timer (due now if it missed a change)"""
+        with self._db_lock:
+            rows = self._connect().execute("SELECT data FROM schedules ORDER BY rowid").fetchall()
+        now = time.time()
+        for (data,) in rows:
+            schedule = json.loads(data)
+            self._schedules[schedule["id"]] = schedule
+            if schedule["active"]:
+                for target in targets(schedule):
+                    self._active.setdefault(target, set()).add(schedule["id"])
+            if is_active(schedule, now) != schedule["active"]:
+                self._push(schedule["id"], now)
+            elif schedule.get("next_fire") is not None:
+                self._push(schedule["id"], schedule["next_fire"])
+
+    # -- timers -------------------------------------------------------------
+
+    def _push(self, schedule_id, when):
+        self._due[schedule_id] = when
+        heapq.heappush(self._heap, (when, schedule_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _pop_due(self) -> list:
+        horizon = time.time() + self.batch_window
+        due = []
+        while self._heap and self._heap[0][0] <= horizon:
+            when, schedule_id = heapq.heappop(self._heap)
+            # Entries are skipped lazily once the schedule has moved or gone
+            if self._due.get(schedule_id) == when:
+                del self._due[schedule_id]
+                due.append(schedule_id)
+        return due
+
+    # -- api ----------------------------------------------------------------
+
+    def get(self, schedule_id):
+        return self._schedules.get(schedule_id)
+
+    def list(self, offset=0, limit=100, active=None) -> dict:
+        limit = max(1, min(int(limit), MAX_PAGE))
+        offset = max(0, int(offset))
+        items = [s for s in self._schedules.values()
+                 if active is None or s["active"] == active]
+        return {"items": items[offset:offset + limit], "total": len(items),
+                "offset": offset, "limit": limit,
+                "next_offset": offset + limit if offset + limit < len(items) else None}
+
+    async def add(self, body: dict) -> tuple:
+        """
+        Create a schedule (ValueError if invalid)
+        Returns (schedule, job): job applies it now when it is already due
+        """
+        schedule = parse_schedule(body)
+        schedule.update({
+            "id": uuid.uuid4().hex[:12],
+            "created_at": time.time(),
+            "active": False,
+            "activated_at": None,
+            "revert": {},
+            "next_fire": None,
+            "fired": 0,
+            "last_fired": None,
+            "last_error": None,
+        })
+        at = time.time() + self.batch_window
+        if not is_active(schedule, at):
+            schedule["next_fire"] = next_change(schedule, at)
+            if schedule["next_fire"] is None:
+                raise ValueError("The schedule has already ended")
+        await run_in_threadpool(self._store, [schedule])
+        self._schedules[schedule["id"]] = schedule
+        if schedule["next_fire"] is None:
+            return schedule, self.fire([schedule["id"]])
+        self._push(schedule["id"], schedule["next_fire"])
+        return schedule, None
+
+    async def remove(self, schedule_id, revert=True) -> tuple:
+        """
+        Delete a schedule (KeyError if unknown)
+        An active one restores its targets first unless revert=False.
+        Returns (schedule, job or None)
+        """
+        schedule = self._schedules[schedule_id]
+        if schedule["active"] and revert:
+            return schedule, self.fire([schedule_id], cancelled={schedule_id})
+        # Forgotten before the delete: a batch running meanwhile then neither
+        # stores nor commits it again
+        self._forget(schedule)
+        try:
+            await run_in_threadpool(self._store, (), [schedule_id])
+        except Exception:
+            self._register(schedule)
+            raise
+        return schedule, None
+
+    def _forget(self, schedule):
+        self._schedules.pop(schedule["id"], None)
+        self._due.pop(schedule["id"], None)
+        for target in targets(schedule):
+            ids = self._active.get(target)
+            if ids is not None:
+                ids.discard(schedule["id"])
+                if not ids:
+                    del self._active[target]
+
+    def fire(self, schedule_ids, cancelled=()):
+        """Apply the due state of these schedules as one job on the whole ruleset"""
+        return executor.submit("schedule", self._apply, list(schedule_ids), set(cancelled),
+                               resources=[executor.GLOBAL],
+                               params={"schedules": list(schedule_ids)[:20],
+                                       "count": len(schedule_ids),
+                                       "cancel": sorted(cancelled)})
+
+    # -- applying -----------------------------------------------------------
+
+    async def _apply(self, schedule_ids, cancelled=()) -> dict:
+        now = time.time()
+        try:
+            return await self._transition(schedule_ids, cancelled, now)
+        except Exception as e:
+            self.last_error = str(e)
+            for schedule_id in schedule_ids:
+                schedule = self._schedules.get(schedule_id)
+                if schedule is not None:
+                    schedule["last_error"] = str(e)
+                    if schedule_id not in self._due:
+                        self._push(schedule_id, now + self.retry)
+            raise
+
+    async def _transition(self, schedule_ids, cancelled, now) -> dict:
+        at = now + self.batch_window
+        updates = {}
+
+        def edit(schedule_id):
+            # Changes stay on copies until the firewall change went through
+            if schedule_id not in updates:
+                updates[schedule_id] = json.loads(json.dumps(self._schedules[schedule_id]))
+            return updates[schedule_id]
+
+        fired = [edit(schedule_id) for schedule_id in schedule_ids
+                 if schedule_id in self._schedules]
+        ending = [s for s in fired if s["active"]
+                  and (s["id"] in cancelled or not is_active(s, at))]
+        starting = [s for s in fired if not s["active"]
+                    and s["id"] not in cancelled and is_active(s, at)]
+
+        touched = {target for s in ending + starting for target in targets(s)}
+        snapshot = await run_in_threadpool(rule_state.snapshot)
+        if snapshot.error:
+            raise RuntimeError(snapshot.error)
+        ports = [tuple(t[5:].split("/")) for t in touched if t.startswith("port:")]
+        domains = [t[7:] for t in touched if t.startswith("domain:")]
+        port_states, domain_states = await run_in_threadpool(
+            target_states, ports, domains, snapshot)
+        state = {f"port:{port}/{proto}": value for (port, proto), value in port_states.items()}
+        state.update((f"domain:{domain}", value) for domain, value in domain_states.items())
+        desired = {}
+
+        for schedule in ending:
+            for target in targets(schedule):
+                newer = [other for other in (edit(other_id) for other_id
+                                             in self._active.get(target, ())
+                                             if other_id != schedule["id"])
+                         if other["active"] and other["activated_at"] > schedule["activated_at"]]
+                if newer:
+                    # The next schedule up recorded our state: hand it ours
+                    above = min(newer, key=lambda other: other["activated_at"])
+                    above["revert"][target] = schedule["revert"].get(target)
+                elif target in schedule["revert"]:
+                    desired[target] = state[target] = schedule["revert"][target]
+            schedule.update(active=False, activated_at=None, revert={})
+
+        for index, schedule in enumerate(starting):
+            schedule["revert"] = {target: state[target] for target in targets(schedule)}
+            schedule["active"] = True
+            schedule["activated_at"] = now + index * 1e-6
+            for target in targets(schedule):
+                desired[target] = state[target] = action_state(schedule, target)
+
+        port_changes = {tuple(t[5:].split("/")): value for t, value in desired.items()
+                        if t.startswith("port:")}
+        domain_changes = {t[7:]: value for t, value in desired.items()
+                          if t.startswith("domain:")}
+        plan = await run_in_threadpool(plan_changes, port_changes, domain_changes, snapshot)
+        result = {"status": "success", "started": [s["id"] for s in starting],
+                  "ended": [s["id"] for s in ending], "changed": bool(plan),
+                  "plan": plan.to_dict()}
+        if plan:
+            result["batch"] = await execute_plan(plan)
+
+        for schedule in fired:
+            schedule["fired"] += 1
+            schedule["last_fired"] = now
+            schedule["last_error"] = None
+        finished = []
+        for schedule in updates.values():
+            schedule["next_fire"] = next_change(schedule, at)
+            if schedule["id"] in cancelled or schedule["next_fire"] is None:
+                finished.append(schedule["id"])
+        await run_in_threadpool(self._store, [s for s in updates.values()
+                                              if s["id"] not in finished], finished, True)
+        self._commit(updates, finished)
+        self.batches += 1
+        self.fired += len(fired)
+        self.last_batch = now
+        self.last_error = None
+        result["finished"] = finished
+        return result
+
+    def _commit(self, updates, finished):
+        for schedule_id, schedule in updates.items():
+            previous = self._schedules.get(schedule_id)
+            if previous is None:
+                # Removed while the batch ran
+                continue
+            self._forget(previous)
+            if schedule_id not in finished:
+                self._register(schedule)
+
+    def _register(self, schedule):
+        self._schedules[schedule["id"]] = schedule
+        if schedule["active"]:
+            for target in targets(schedule):
+                self._active.setdefault(target, set()).add(schedule["id"])
+        if schedule["next_fire"] is not None:
+            self._push(schedule["id"], schedule["next_fire"])
+
+    # -- background ---------------------------------------------------------
+
+    async def tick(self) -> int:
+        """Fire every timer that is due; returns how many schedules fired"""
+        due = self._pop_due()
+        if due:
+            job = self.fire(due)
+            await executor.wait(job)
+            if job.status == "failed":
+                logger.warning("scheduled change failed: %s", job.error)
+        return len(due)
+
+    async def _run(self):
+        while True:
+            try:
+                if not await self.tick():
+                    # Capped so a wall clock change is noticed within a minute
+                    delay = 60.0
+                    if self._heap:
+                        delay = min(delay, max(0.05, self._heap[0][0] - time.time()))
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("scheduler tick failed: %s", e)
+                await asyncio.sleep(1.0)
+
+    def start(self):
+        """Load the schedules and start the timer loop on the running event loop"""
+        if self._task is not None and not self._task.done():
+            return
+        self.load()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def next_fire(self):
+        # Drop moved / cancelled entries from the top of the heap
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "schedules": len(self._schedules),
+            "active": sum(1 for s in self._schedules.values() if s["active"]),
+            "pending_timers": len(self._due),
+            "next_fire": self.next_fire(),
+            "batches": self.batches,
+            "fired": self.fired,
+            "last_batch": self.last_batch,
+            "last_error": self.last_error,
+        }
+
+
+# Shared scheduler of time-based rules
+scheduler = Scheduler()
+
+
+async def create_schedule(body: dict, wait=False) -> dict:
+    """
+    Endpoint helper: add a schedule (400 if invalid, 503 if disabled)
+    With wait, also returns the result of applying it when it is due now.
+    """
+    if not config.SCHEDULE_ENABLED:
+        raise HTTPException(status_code=503, detail="Scheduled rules are disabled")
+    try:
+        schedule, job = await scheduler.add(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response = {"status": "scheduled", "schedule": schedule}
+    if job is not None:
+        response["job_id"] = job.id
+        if wait:
+            await executor.wait(job)
+            response["result"] = job.result if job.status == "succeeded" else \
+                {"status": "error", "message": job.error}
+    return response
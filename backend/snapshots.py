@@ -0,0 +1,251 @@
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from backend import config
+from backend.blocklist import get_set_backend
+from backend.cidr_aggregate import cidr_aggregator
+from backend.domain_index import domain_index
+from backend.domain_registry import domain_registry
+from backend.domain_sync import domain_sync
+from backend.events import events
+from backend.hosts_file import hosts_file
+from backend.rule_state import rule_state
+from backend.system_files import read_file
+from backend.ufw_batch import RuleBatch
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ID_RE = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{6}$")
+
+
+def ufw_files() -> dict:
+    """Files a snapshot captures, by the name they are stored under"""
+    return {
+        "user.rules": os.path.join(config.UFW_RULES_DIR, "user.rules"),
+        "user6.rules": os.path.join(config.UFW_RULES_DIR, "user6.rules"),
+        "defaults": config.UFW_DEFAULTS_FILE,
+    }
+
+
+class SnapshotStore:
+    """
+    Versioned snapshots of everything the backend manages: UFW's rules and
+    defaults files, the managed hosts section, wildcard rules, domain -> IP
+    records and the CIDR / nftables blocklist state.
+    Each snapshot is one gzipped JSON file in the state dir; a small index
+    keeps listings from opening them. Restoring writes the rules files
+    wholesale and loads them with a single `ufw reload`, instead of
+    replaying one command per rule.
+    """
+
+    def __init__(self, directory=None, keep=None):
+        self.directory = directory or os.path.join(config.STATE_DIR, "snapshots")
+        self.keep = config.SNAPSHOT_KEEP if keep is None else keep
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _path(self, snapshot_id):
+        if not SNAPSHOT_ID_RE.match(str(snapshot_id)):
+            raise KeyError(snapshot_id)
+        return os.path.join(self.directory, f"{snapshot_id}.json.gz")
+
+    def _write_atomic(self, name, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".snapshot-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self.directory, name))
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        try:
+            with open(os.path.join(self.directory, "index.json"), "r") as f:
+                for meta in json.load(f).get("snapshots", []):
+                    self._index[meta["id"]] = meta
+            return
+        except (OSError, ValueError, KeyError):
+            pass
+        # Index lost: rebuild it from the snapshot files
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".json.gz"):
+                try:
+                    meta = self._read(name[:-len(".json.gz")])["meta"]
+                except (OSError, ValueError, KeyError):
+                    continue
+                self._index[meta["id"]] = meta
+
+    def _save_index(self):
+        data = {"version": SNAPSHOT_VERSION, "snapshots": list(self._index.values())}
+        self._write_atomic("index.json", json.dumps(data).encode("utf-8"))
+
+    def _read(self, snapshot_id) -> dict:
+        with gzip.open(self._path(snapshot_id), "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {data.get('version')}")
+        return data
+
+    # -- capture ----------------------------------------------------------
+
+    def capture(self, label=None, reason="manual") -> dict:
+        """
+        Snapshot the current state (blocking I/O)
+        Returns: the snapshot metadata
+        """
+        files = {}
+        for name, path in ufw_files().items():
+            if not os.path.exists(path):
+                # e.g. no user6.rules when IPv6 is disabled
+                continue
+            try:
+                files[name] = read_file(path)[0]
+            except (OSError, RuntimeError) as e:
+                logger.warning("snapshot cannot read %s: %s", path, e)
+                continue
+        snapshot = rule_state.snapshot()
+        set_backend = get_set_backend()
+        created_at = time.time()
+        snapshot_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(created_at)) \
+            + "-" + uuid.uuid4().hex[:6]
+        hosts = sorted(hosts_file.blocked())
+        patterns = domain_index.patterns()
+        domains = domain_registry.export()
+        meta = {
+            "id": snapshot_id,
+            "label": label,
+            "reason": reason,
+            "created_at": created_at,
+            "generation": snapshot.generation,
+            "rules": len(snapshot.rules),
+            "hosts": len(hosts),
+            "patterns": len(patterns),
+            "domains": len(domains),
+        }
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "meta": meta,
+            "ufw": {"active": snapshot.active, "files": files},
+            "hosts": hosts,
+            "patterns": patterns,
+            "domains": domains,
+            "cidr": cidr_aggregator.export(),
+            "nft": sorted(set_backend.members[4] | set_backend.members[6]) if set_backend else None,
+        }
+        payload = gzip.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+        meta["size"] = len(payload)
+
+        with self._lock:
+            self._load_index()
+            self._write_atomic(f"{snapshot_id}.json.gz", payload)
+            self._index[snapshot_id] = meta
+            oldest = sorted(self._index, key=lambda i: self._index[i]["created_at"])
+            for old in oldest[:max(0, len(oldest) - self.keep)] if self.keep > 0 else ():
+                self._index.pop(old)
+                try:
+                    os.unlink(self._path(old))
+                except OSError:
+                    pass
+            self._save_index()
+        return meta
+
+    # -- queries ----------------------------------------------------------
+
+    def list(self, reason=None) -> list:
+        """Snapshot metadata, newest first"""
+        with self._lock:
+            self._load_index()
+            metas = [dict(meta) for meta in self._index.values()
+                     if reason is None or meta["reason"] == reason]
+        return sorted(metas, key=lambda meta: meta["created_at"], reverse=True)
+
+    def get(self, snapshot_id):
+        with self._lock:
+            self._load_index()
+            meta = self._index.get(snapshot_id)
+            return dict(meta) if meta else None
+
+    def latest(self, reason=None):
+        metas = self.list(reason)
+        return metas[0] if metas else None
+
+    def delete(self, snapshot_id) -> bool:
+        with self._lock:
+            self._load_index()
+            if self._index.pop(snapshot_id, None) is None:
+                return False
+            try:
+                os.unlink(self._path(snapshot_id))
+            except OSError:
+                pass
+            self._save_index()
+        return True
+
+    # -- restore ----------------------------------------------------------
+
+    def restore(self, snapshot_id) -> dict:
+        """
+        Put the firewall and blocklists back to a snapshot (blocking I/O)
+        UFW rules are loaded first with one write + reload (rolled back if
+        the reload fails); the hosts section is then rewritten once.
+        """
+        started = time.monotonic()
+        try:
+            data = self._read(snapshot_id)
+        except (KeyError, FileNotFoundError):
+            raise KeyError(snapshot_id)
+
+        paths = ufw_files()
+        contents = {paths[name]: text for name, text in data["ufw"]["files"].items()
+                    if name in paths}
+        current = rule_state.refresh()
+        batch = RuleBatch()
+        batch.replace_files(contents, enable=bool(data["ufw"]["active"]) and current.active is False)
+        cidr_aggregator.replace(data.get("cidr"))
+        rule_state.invalidate()
+
+        wanted = set(data["hosts"])
+        blocked = hosts_file.blocked()
+        hosts_added, hosts_removed = hosts_file.apply(add=sorted(wanted - blocked),
+                                                      remove=sorted(blocked - wanted))
+        patterns_added, patterns_removed = domain_index.replace_patterns(data["patterns"])
+
+        domains_added, domains_removed = domain_registry.replace(data["domains"])
+        for domain in domains_removed:
+            domain_sync.forget(domain)
+        if config.SYNC_ENABLED:
+            domain_sync.schedule_many_threadsafe(domains_added)
+
+        set_backend = get_set_backend()
+        nft = None
+        if set_backend is not None and data.get("nft") is not None:
+            nft = set_backend.replace(data["nft"])
+
+        result = {
+            "snapshot": data["meta"],
+            "ufw": batch.stats(),
+            "hosts": {"added": len(hosts_added), "removed": len(hosts_removed)},
+            "patterns": {"added": patterns_added, "removed": patterns_removed},
+            "domains": {"added": len(domains_added), "removed": len(domains_removed)},
+            "nft": nft,
+            "elapsed": round(time.monotonic() - started, 3),
+        }
+        events.publish("snapshot_restored", {"snapshot": data["meta"]["id"]})
+        return result
+
+
+# Shared store in the state dir
+snapshot_store = SnapshotStore()
@@ -0,0 +1,127 @@
+import contextvars
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+from backend.helper_client import HelperError, helper
+from backend.helper_protocol import defaults_settings, render_defaults
+from backend.metrics import record_subprocess
+
+logger = logging.getLogger(__name__)
+
+# Job whose code is running in this context (set by the job executor);
+# subprocesses spawned on its behalf are counted on it
+running_job = contextvars.ContextVar("running_job", default=None)
+
+
+def count_process(count=1):
+    """Record spawned subprocesses against the running job, if any"""
+    job = running_job.get()
+    if job is not None:
+        job.processes += count
+
+
+def run_process(args, **kwargs):
+    """subprocess.run, counted on the running job and timed in the metrics"""
+    count_process()
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(args, **kwargs)
+    except subprocess.CalledProcessError as e:
+        record_subprocess(args, time.perf_counter() - started, e.returncode)
+        raise
+    record_subprocess(args, time.perf_counter() - started, result.returncode)
+    return result
+
+
+def read_file(path: str) -> tuple:
+    """
+    Read a (possibly root-only) file
+    Returns: (text, processes spawned)
+    """
+    if os.access(path, os.R_OK):
+        with open(path, "r") as f:
+            return f.read(), 0
+    if helper.available():
+        try:
+            return helper.call("read_file", path=path)["text"], 0
+        except OSError as e:
+            logger.warning("helper unreachable (%s), reading %s through sudo", e, path)
+    result = run_process(["sudo", "cat", path], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"Cannot read {path}")
+    return result.stdout, 1
+
+
+def write_files_atomic(contents: dict, mode: int = 0o644, use_helper=True) -> int:
+    """
+    Replace each file with new text via write-to-temp + rename, so readers
+    never see a partial file. When the backend cannot write the directories
+    itself, uses the privileged helper or else one sudo call for all files.
+    Returns: processes spawned
+    """
+    if all(os.access(os.path.dirname(path) or ".", os.W_OK) for path in contents):
+        for path, text in contents.items():
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".fw-")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(text)
+                os.chmod(tmp, mode)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+        return 0
+
+    if use_helper and helper.available():
+        try:
+            helper.call("write_files", contents=contents, mode=mode)
+            return 0
+        except OSError as e:
+            # Rewriting the same text through sudo is harmless if it did land
+            logger.warning("helper unreachable (%s), writing through sudo", e)
+
+    # Stage in /tmp and move everything into place with a single sudo call
+    staged = []
+    script = []
+    try:
+        for path, text in contents.items():
+            fd, tmp = tempfile.mkstemp(prefix="fw-stage-")
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            staged.append(tmp)
+            script.append(
+                f"install -m {mode:o} -o root -g root '{tmp}' '{path}.fwtmp' "
+                f"&& mv -f '{path}.fwtmp' '{path}'"
+            )
+        result = run_process(["sudo", "sh", "-c", " && ".join(script)],
+                             capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or "Writing files failed")
+        return 1
+    finally:
+        for tmp in staged:
+            os.unlink(tmp)
+
+
+def write_ufw_defaults(path: str, text: str) -> int:
+    """
+    Replace the UFW defaults file. The helper never takes the file's text:
+    when only the default policies / IPV6 differ it sets those (and refuses
+    loosening them); anything else goes through sudo.
+    Returns: processes spawned
+    """
+    if os.access(os.path.dirname(path) or ".", os.W_OK) or not helper.available():
+        return write_files_atomic({path: text}, mode=0o644, use_helper=False)
+    current, processes = read_file(path)
+    settings = defaults_settings(text)
+    if render_defaults(current, settings) == text:
+        try:
+            helper.call("set_defaults", settings=settings)
+            return processes
+        except (OSError, HelperError) as e:
+            logger.warning("helper did not set the defaults (%s), writing through sudo", e)
+    return processes + write_files_atomic({path: text}, mode=0o644, use_helper=False)
@@ -0,0 +1,278 @@
+import heapq
+import logging
+import operator
+import threading
+import time
+
+from backend import config
+from backend.domain_registry import domain_registry
+from backend.ufw_log import ufw_log
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_ACTIONS = ("block", "limit")
+# (name, bucket seconds, buckets kept)
+LEVELS = (("minute", 60, 180), ("hour", 3600, 72), ("day", 86400, 31))
+MAX_TOP = 100
+
+
+class TopK:
+    """
+    Space-Saving heavy-hitter summary of at most `size` keys
+    A new key arriving when the summary is full replaces the key with the
+    smallest count and inherits that count as its error, so every listed
+    count is at most `errors[key]` above the true one. A key that is not
+    listed has a true count of at most bound() (0 while the summary is not
+    full): any key with more hits than bound() is guaranteed to be listed.
+    """
+
+    __slots__ = ("size", "counts", "errors", "_heap")
+
+    def __init__(self, size):
+        self.size = size
+        self.counts = {}
+        self.errors = {}
+        # (count, key) entries, refreshed lazily when they reach the top
+        self._heap = []
+
+    def bound(self) -> int:
+        """Largest possible true count of a key that is not listed"""
+        if len(self.counts) < self.size:
+            return 0
+        return self._min()[0]
+
+    def _min(self):
+        heap = self._heap
+        while True:
+            count, key = heap[0]
+            actual = self.counts[key]
+            if actual == count:
+                return count, key
+            heapq.heapreplace(heap, (actual, key))
+
+    def add(self, counts: dict):
+        current = self.counts
+        for key, count in counts.items():
+            if key in current:
+                current[key] += count
+            elif len(current) < self.size:
+                current[key] = count
+                self.errors[key] = 0
+                heapq.heappush(self._heap, (count, key))
+            else:
+                smallest, evicted = self._min()
+                heapq.heappop(self._heap)
+                del current[evicted], self.errors[evicted]
+                current[key] = smallest + count
+                self.errors[key] = smallest
+                heapq.heappush(self._heap, (smallest + count, key))
+
+    def merge(self, other):
+        """
+        Combine two summaries (mergeable Space-Saving): a key missing from
+        one side may have had up to that side's bound() there, which is added
+        to its count and error before keeping the `size` largest
+        """
+        own_bound, other_bound = self.bound(), other.bound()
+        counts, errors = {}, {}
+        for key in self.counts.keys() | other.counts.keys():
+            count = error = 0
+            for summary, bound in ((self, own_bound), (other, other_bound)):
+                if key in summary.counts:
+                    count += summary.counts[key]
+                    error += summary.errors[key]
+                else:
+                    count += bound
+                    error += bound
+            counts[key] = count
+            errors[key] = error
+        kept = heapq.nlargest(self.size, counts.items(), key=operator.itemgetter(1))
+        self.counts = dict(kept)
+        self.errors = {key: errors[key] for key in self.counts}
+        self._heap = [(count, key) for key, count in kept]
+        heapq.heapify(self._heap)
+
+    def top(self, n) -> list:
+        """[(key, count, error), ...] largest counts first"""
+        return [(key, count, self.errors[key]) for key, count in
+                heapq.nlargest(n, self.counts.items(), key=operator.itemgetter(1))]
+
+
+class Bucket:
+    """Totals and blocked heavy hitters of one time slot"""
+
+    __slots__ = ("start", "packets", "blocked", "allowed", "bytes", "sources", "ports", "domains")
+
+    def __init__(self, start, sketch_size):
+        self.start = start
+        self.packets = self.blocked = self.allowed = self.bytes = 0
+        self.sources = TopK(sketch_size)
+        self.ports = TopK(sketch_size)
+        self.domains = TopK(sketch_size)
+
+    def add(self, partial):
+        packets, blocked, allowed, length, sources, ports, domains = partial
+        self.packets += packets
+        self.blocked += blocked
+        self.allowed += allowed
+        self.bytes += length
+        self.sources.add(sources)
+        self.ports.add(ports)
+        self.domains.add(domains)
+
+    def totals(self) -> dict:
+        return {"ts": self.start, "packets": self.packets, "blocked": self.blocked,
+                "allowed": self.allowed, "bytes": self.bytes}
+
+
+class TrafficStats:
+    """
+    Rolling traffic aggregates fed by the UFW log tailer
+    Each batch of log records is summed per minute once, then added to the
+    minute, hour and day bucket it falls in, so every resolution is always
+    current and no raw records are kept. Blocked packets are counted per
+    remote IP (source of inbound / destination of outbound packets), per
+    destination port and per blocked domain owning the remote IP.
+    Memory is bounded by the bucket counts times the sketch size.
+    """
+
+    def __init__(self, sketch_size=None, registry=None):
+        self.sketch_size = sketch_size or config.STATS_SKETCH_SIZE
+        self.registry = registry or domain_registry
+        self.levels = {name: {} for name, _, _ in LEVELS}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._cache = {}
+        self.records = 0
+
+    # -- ingest -------------------------------------------------------------
+
+    def on_records(self, records):
+        """UfwLogTailer listener"""
+        partials = {}
+        for record in records:
+            minute = int(record.ts) // 60 * 60
+            partial = partials.get(minute)
+            if partial is None:
+                partial = partials[minute] = [0, 0, 0, 0, {}, {}, {}]
+            partial[0] += 1
+            partial[3] += record.length or 0
+            if record.action in BLOCKED_ACTIONS:
+                partial[1] += 1
+                remote = record.dst if record.direction == "out" else record.src
+                if remote:
+                    sources = partial[4]
+                    sources[remote] = sources.get(remote, 0) + 1
+                if record.dpt is not None:
+                    port = f"{record.dpt}/{record.proto}"
+                    ports = partial[5]
+                    ports[port] = ports.get(port, 0) + 1
+            elif record.action == "allow":
+                partial[2] += 1
+
+        for partial in partials.values():
+            # Attribute blocked IPs to the blocked domains that resolved to them
+            domains = partial[6]
+            for ip, count in partial[4].items():
+                for domain in self.registry.owners(ip):
+                    domains[domain] = domains.get(domain, 0) + count
+
+        with self._lock:
+            for minute, partial in partials.items():
+                for name, size, keep in LEVELS:
+                    buckets = self.levels[name]
+                    start = minute // size * size
+                    bucket = buckets.get(start)
+                    if bucket is None:
+                        if buckets and start <= max(buckets) - size * keep:
+                            continue
+                        bucket = buckets[start] = Bucket(start, self.sketch_size)
+                        newest = max(buckets)
+                        for old in [s for s in buckets if s <= newest - size * keep]:
+                            del buckets[old]
+                    bucket.add(partial)
+            self.records += len(records)
+            self._version += 1
+            self._cache.clear()
+
+    # -- queries ------------------------------------------------------------
+
+    @staticmethod
+    def resolution(window) -> tuple:
+        """Finest level whose retention covers the window"""
+        for level in LEVELS:
+            if window <= level[1] * level[2]:
+                return level
+        return LEVELS[-1]
+
+    def query(self, window=3600, top=10, now=None) -> dict:
+        """
+        Totals, top blocked sources / ports / domains and a time series
+        over the last `window` seconds
+        Top counts come from the sketches: each may be up to its "error"
+        above the true count, and the top-level "error" is the most hits an
+        unlisted key can have.
+        """
+        window = max(60, int(window))
+        top = max(1, min(int(top), MAX_TOP))
+        now = time.time() if now is None else now
+        name, size, keep = self.resolution(window)
+        first = (int(now) - window) // size * size + size
+        key = (window, top, name, first)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            buckets = [bucket for start, bucket in self.levels[name].items() if start >= first]
+            merged = Bucket(first, self.sketch_size)
+            for bucket in buckets:
+                merged.packets += bucket.packets
+                merged.blocked += bucket.blocked
+                merged.allowed += bucket.allowed
+                merged.bytes += bucket.bytes
+                merged.sources.merge(bucket.sources)
+                merged.ports.merge(bucket.ports)
+                merged.domains.merge(bucket.domains)
+            by_start = {bucket.start: bucket for bucket in buckets}
+            series = []
+            for start in range(first, int(now) // size * size + size, size):
+                bucket = by_start.get(start)
+                series.append(bucket.totals() if bucket else
+                              {"ts": start, "packets": 0, "blocked": 0, "allowed": 0, "bytes": 0})
+
+        totals = merged.totals()
+        del totals["ts"]
+        result = {
+            "window": window,
+            "resolution": name,
+            "from": first,
+            "totals": totals,
+            "top": {
+                "sources": [{"ip": ip, "count": count, "error": error,
+                             "domains": sorted(self.registry.owners(ip))}
+                            for ip, count, error in merged.sources.top(top)],
+                "ports": [{"port": port, "count": count, "error": error}
+                          for port, count, error in merged.ports.top(top)],
+                "domains": [{"domain": domain, "count": count, "error": error}
+                            for domain, count, error in merged.domains.top(top)],
+            },
+            "error": {"sources": merged.sources.bound(), "ports": merged.ports.bound(),
+                      "domains": merged.domains.bound()},
+            "series": series,
+        }
+        with self._lock:
+            self._cache[key] = result
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "records": self.records,
+            "sketch_size": self.sketch_size,
+            "buckets": {name: len(buckets) for name, buckets in self.levels.items()},
+        }
+
+
+# Shared aggregates of the UFW log
+traffic_stats = TrafficStats()
+ufw_log.add_listener(traffic_stats.on_records)
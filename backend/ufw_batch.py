@@ -0,0 +1,363 @@
+import binascii
+import ipaddress
+import os
+import socket
+import threading
+
+from backend import config
+from backend.cidr_aggregate import cidr_aggregator
+from backend.helper_client import helper
+from backend.system_files import read_file, run_process, write_files_atomic, write_ufw_defaults
+
+# Service names understood by the API that /etc/services knows by another name
+SERVICE_ALIASES = {"dns": "domain"}
+
+RULES_BEGIN = "### RULES ###"
+RULES_END = "### END RULES ###"
+TUPLE_PREFIX = "### tuple ###"
+
+IPTABLES_TARGETS = {"allow": "ACCEPT", "deny": "DROP", "reject": "REJECT"}
+
+# Only one batch may rewrite the rules files at a time
+_apply_lock = threading.Lock()
+
+
+def hex_encode(text: str) -> str:
+    """Encode a rule comment the way UFW stores it in user.rules"""
+    return binascii.hexlify(text.encode("utf-8")).decode("ascii")
+
+
+def resolve_service(service: str) -> tuple:
+    """
+    Resolve a service name to (port, proto) like `ufw allow <service>` does
+    Examples: 'http' -> ('80', 'tcp'), 'dns' -> ('53', 'any')
+    """
+    name = SERVICE_ALIASES.get(service.lower(), service.lower())
+    protos = []
+    port = None
+    for proto in ("tcp", "udp"):
+        try:
+            port = socket.getservbyname(name, proto)
+            protos.append(proto)
+        except OSError:
+            continue
+    if port is None:
+        raise ValueError(f"Unknown service: {service}")
+    return str(port), protos[0] if len(protos) == 1 else "any"
+
+
+def ipv6_enabled() -> bool:
+    """Check IPV6=yes in the UFW defaults file (UFW's own default is yes)"""
+    try:
+        with open(config.UFW_DEFAULTS_FILE, "r") as f:
+            for line in f:
+                if line.strip().startswith("IPV6="):
+                    return line.split("=", 1)[1].strip().strip('"').lower() == "yes"
+    except OSError:
+        pass
+    return True
+
+
+class RuleSpec:
+    """
+    One UFW rule in the form the CLI accepts, e.g.
+        RuleSpec("deny", "out", dst="1.2.3.4")     == ufw deny out to 1.2.3.4
+        RuleSpec("allow", "in", port="80", proto="tcp")  == ufw allow in 80/tcp
+    """
+
+    def __init__(self, action, direction, port=None, proto="any",
+                 dst=None, src=None, comment=""):
+        self.action = action
+        self.direction = direction
+        self.port = str(port) if port is not None else None
+        self.proto = proto or "any"
+        self.dst = dst
+        self.src = src
+        self.comment = comment or ""
+
+    def families(self, with_v6=True):
+        """IP versions ("v4"/"v6") this rule is written for"""
+        for address in (self.dst, self.src):
+            if address:
+                version = ipaddress.ip_network(address, strict=False).version
+                return ["v6"] if version == 6 else ["v4"]
+        return ["v4", "v6"] if with_v6 else ["v4"]
+
+    def tuple_fields(self, family):
+        anywhere = "::/0" if family == "v6" else "0.0.0.0/0"
+        return (
+            self.action, self.proto, self.port or "any", self.dst or anywhere,
+            "any", self.src or anywhere, self.direction,
+        )
+
+    def render(self, family):
+        """The `### tuple ###` block UFW would write for this rule"""
+        fields = self.tuple_fields(family)
+        header = f"{TUPLE_PREFIX} {' '.join(fields)}"
+        if self.comment:
+            header += f" comment={hex_encode(self.comment)}"
+
+        chain_prefix = "ufw6" if family == "v6" else "ufw"
+        chain = f"{chain_prefix}-user-{'output' if self.direction == 'out' else 'input'}"
+        protos = [self.proto]
+        if self.proto == "any" and self.port:
+            protos = ["tcp", "udp"]
+
+        lines = [header]
+        for proto in protos:
+            parts = [f"-A {chain}"]
+            if proto != "any":
+                parts.append(f"-p {proto}")
+            if self.dst:
+                parts.append(f"-d {self.dst}")
+            if self.port:
+                if "," in self.port or ":" in self.port:
+                    parts.append(f"-m multiport --dports {self.port}")
+                else:
+                    parts.append(f"--dport {self.port}")
+            if self.src:
+                parts.append(f"-s {self.src}")
+            parts.append(f"-j {IPTABLES_TARGETS[self.action]}")
+            if self.action == "reject" and proto == "tcp":
+                parts.append("--reject-with tcp-reset")
+            lines.append(" ".join(parts))
+        return lines
+
+    def __repr__(self):
+        return f"RuleSpec({' '.join(self.tuple_fields('v4'))})"
+
+
+def _tuple_key(tuple_line: str):
+    """Rule identity from a tuple line, ignoring the comment"""
+    fields = tuple_line[len(TUPLE_PREFIX):].split()
+    return tuple(f for f in fields if not f.startswith("comment="))
+
+
+class RulesFile:
+    """
+    A UFW user.rules / user6.rules file split into header, rule blocks and footer.
+    Blocks are kept in a dict keyed by rule identity (insertion ordered), so
+    adds and removes are O(1) even for very large rulesets.
+    """
+
+    def __init__(self, text: str):
+        lines = text.splitlines()
+        try:
+            begin = lines.index(RULES_BEGIN)
+            end = lines.index(RULES_END)
+        except ValueError:
+            raise ValueError("Not a UFW rules file (missing ### RULES ### section)")
+        self.header = lines[:begin + 1]
+        self.footer = lines[end:]
+        self.blocks = {}
+        current = None
+        for line in lines[begin + 1:end]:
+            if line.startswith(TUPLE_PREFIX):
+                current = [line]
+                # Duplicate tuples (hand-edited files) stay grouped under one key
+                self.blocks.setdefault(_tuple_key(line), []).append(current)
+            elif line.strip() and current is not None:
+                current.append(line)
+
+    def __len__(self):
+        return sum(len(blocks) for blocks in self.blocks.values())
+
+    def add(self, spec: RuleSpec, family: str) -> bool:
+        """Append a rule unless an identical one exists (like ufw's 'Skipping')"""
+        key = spec.tuple_fields(family)
+        if key in self.blocks:
+            return False
+        self.blocks[key] = [spec.render(family)]
+        return True
+
+    def remove(self, spec: RuleSpec, family: str) -> int:
+        """Remove every rule matching the spec, return how many were removed"""
+        return len(self.blocks.pop(spec.tuple_fields(family), []))
+
+    def render(self) -> str:
+        out = list(self.header)
+        for blocks in self.blocks.values():
+            for block in blocks:
+                out.append("")
+                out.extend(block)
+        out.append("")
+        out.extend(self.footer)
+        return "\n".join(out) + "\n"
+
+
+class RuleBatch:
+    """
+    Collects rule additions and deletions for one request and applies them
+    as a single transaction: both rules files are rewritten once and UFW is
+    reloaded once. If the reload fails the previous files are put back.
+
+    Operations are applied in the order they were queued, so
+        batch.delete(...); batch.add(...)
+    ends in the same state as the equivalent sequence of ufw commands.
+    """
+
+    def __init__(self, rules_dir=None):
+        self.rules_dir = rules_dir or config.UFW_RULES_DIR
+        self.operations = []
+        self.processes = 0
+        self.reloads = 0
+        self.added = 0
+        self.removed = 0
+        self.applied = False
+
+    def add(self, spec: RuleSpec):
+        self.operations.append(("add", spec))
+        return self
+
+    def delete(self, spec: RuleSpec):
+        self.operations.append(("delete", spec))
+        return self
+
+    def block_addresses(self, ips: list, comment=""):
+        """Deny in/out for addresses, merged into CIDR rules by the aggregator"""
+        self.operations.append(("block", (list(ips), comment)))
+        return self
+
+    def unblock_addresses(self, ips: list):
+        self.operations.append(("unblock", (list(ips), None)))
+        return self
+
+    def _expand_addresses(self):
+        """
+        Turn aggregated address operations into CIDR rule changes
+        Called under the apply lock so plans are computed one at a time
+        Returns: (rule operations, aggregation plan or None)
+        """
+        address_ops = [(op, arg[0], arg[1]) for op, arg in self.operations
+                       if op in ("block", "unblock")]
+        if not address_ops:
+            return self.operations, None
+        plan = cidr_aggregator.plan(address_ops)
+        operations = [(op, spec) for op, spec in self.operations
+                      if op not in ("block", "unblock")]
+        for network in plan.delete:
+            operations.append(("delete", RuleSpec("deny", "out", dst=network)))
+            operations.append(("delete", RuleSpec("deny", "in", src=network)))
+        for network in plan.add:
+            comment = plan.comment(network)
+            operations.append(("add", RuleSpec("deny", "out", dst=network, comment=comment)))
+            operations.append(("add", RuleSpec("deny", "in", src=network, comment=comment)))
+        return operations, plan
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _path(self, family):
+        name = "user6.rules" if family == "v6" else "user.rules"
+        return os.path.join(self.rules_dir, name)
+
+    def _run(self, argv, input_text=None):
+        self.processes += 1
+        result = run_process(argv, input=input_text, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f"{argv[0]} failed")
+        return result.stdout
+
+    def _read(self, path):
+        text, processes = read_file(path)
+        self.processes += processes
+        return text
+
+    def _write(self, contents: dict):
+        """Atomically replace each rules file (temp file + rename)"""
+        rules = {path: text for path, text in contents.items() if path.endswith(".rules")}
+        if rules:
+            self.processes += write_files_atomic(rules, mode=0o640)
+        for path, text in contents.items():
+            if path not in rules:
+                # The defaults file (world-readable, see ipv6_enabled)
+                self.processes += write_ufw_defaults(path, text)
+
+    def _reload(self, argv=("reload",)):
+        self.reloads += 1
+        if helper.available():
+            result = helper.call("ufw", argv=list(argv))
+            if result["returncode"] != 0:
+                raise RuntimeError(result["stderr"].strip() or f"ufw {argv[-1]} failed")
+            return result["stdout"]
+        return self._run(["sudo", "ufw", *argv])
+
+    def replace_files(self, contents: dict, enable=False) -> dict:
+        """
+        Load complete rules files (and the defaults file) with one write and
+        one reload, e.g. to restore a snapshot. Files missing from contents
+        are left alone; on a failed reload the previous files are put back.
+        enable: load with `ufw --force enable` (when UFW is currently off)
+        """
+        if self.applied:
+            raise RuntimeError("Batch already applied")
+        self.applied = True
+        argv = ("--force", "enable") if enable else ("reload",)
+        with _apply_lock:
+            original = {}
+            for path in contents:
+                original[path] = self._read(path) if os.path.exists(path) else None
+            changed = {path: text for path, text in contents.items() if original[path] != text}
+            if not changed and not enable:
+                return self.stats()
+            self._write(changed)
+            try:
+                self._reload(argv)
+            except RuntimeError:
+                self._write({path: text for path, text in original.items()
+                             if path in changed and text is not None})
+                self._reload(argv)
+                raise
+        return self.stats()
+
+    def apply(self) -> dict:
+        """Apply all queued operations with one write and one reload"""
+        if self.applied:
+            raise RuntimeError("Batch already applied")
+        self.applied = True
+        if not self.operations:
+            return self.stats()
+
+        families = ["v4", "v6"] if ipv6_enabled() else ["v4"]
+        with _apply_lock:
+            original = {family: self._read(self._path(family)) for family in families}
+            files = {family: RulesFile(text) for family, text in original.items()}
+
+            operations, aggregation = self._expand_addresses()
+            touched = set()
+            for op, spec in operations:
+                for family in spec.families(with_v6="v6" in families):
+                    if family not in files:
+                        # IPv6 disabled in UFW: ufw itself skips these rules too
+                        continue
+                    if op == "add":
+                        count = files[family].add(spec, family)
+                        self.added += count
+                    else:
+                        count = files[family].remove(spec, family)
+                        self.removed += count
+                    if count:
+                        touched.add(family)
+
+            if touched:
+                changed = {self._path(family): files[family].render() for family in touched}
+                self._write(changed)
+                try:
+                    self._reload()
+                except RuntimeError:
+                    # Roll back to the previous rules so the firewall is never half-applied
+                    self._write({self._path(f): original[f] for f in families})
+                    self._reload()
+                    raise
+            if aggregation is not None:
+                cidr_aggregator.commit(aggregation)
+        return self.stats()
+
+    def stats(self) -> dict:
+        return {
+            "operations": len(self.operations),
+            "rules_added": self.added,
+            "rules_removed": self.removed,
+            "processes": self.processes,
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,376 @@
+import collections
+import datetime
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+from backend import config
+
+logger = logging.getLogger(__name__)
+
+# "Oct 16 10:00:00 host kernel: [ 123.456] [UFW BLOCK] IN=eth0 OUT= ... SRC=1.2.3.4 ..."
+# "2025-10-16T10:00:00.123456+00:00 host kernel: [UFW ALLOW] IN= OUT=eth0 ..."
+# netfilter LOG prints the fields in a fixed order; FIELD_RE covers anything else
+LINE_RE = re.compile(r"IN=(\S*) OUT=(\S*).*? SRC=(\S+) DST=(\S+) LEN=(\d+).*? PROTO=(\S+)"
+                     r"(?: SPT=(\d+) DPT=(\d+))?")
+FIELD_RE = re.compile(r"\b(IN|OUT|SRC|DST|LEN|PROTO|SPT|DPT)=(\S*)")
+ACTIONS = {"BLOCK": "block", "ALLOW": "allow", "AUDIT": "audit", "LIMIT BLOCK": "limit"}
+READ_CHUNK = 1 << 20
+
+
+class LogRecord:
+    """One packet logged by UFW"""
+
+    __slots__ = ("seq", "ts", "action", "direction", "interface", "src", "dst",
+                 "proto", "spt", "dpt", "length")
+
+    def __init__(self, seq, ts, action, direction, interface, src, dst, proto, spt, dpt, length):
+        self.seq = seq
+        self.ts = ts
+        self.action = action
+        self.direction = direction
+        self.interface = interface
+        self.src = src
+        self.dst = dst
+        self.proto = proto
+        self.spt = spt
+        self.dpt = dpt
+        self.length = length
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+MONTHS = {name: number for number, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+
+
+class TimestampParser:
+    """Syslog / ISO timestamps -> unix time, caching the last minute seen"""
+
+    def __init__(self):
+        self._last_minute = None
+        self._last_value = None
+
+    def parse(self, line: str, now: float) -> float:
+        if line[:1].isdigit():
+            # ISO 8601 (rsyslog high-precision format)
+            text = line.split(" ", 1)[0]
+            try:
+                return datetime.datetime.fromisoformat(text).timestamp()
+            except ValueError:
+                return now
+        # "Oct 16 10:00:00"
+        minute = line[:12]
+        if minute != self._last_minute:
+            try:
+                month = MONTHS[line[:3]]
+                fields = (int(line[4:6]), int(line[7:9]), int(line[10:12]))
+            except (KeyError, ValueError):
+                return now
+            # Classic syslog has no year: take the one that is not in the future
+            year = time.localtime(now).tm_year
+            value = time.mktime((year, month, *fields, 0, 0, 0, -1))
+            if value > now + 86400:
+                value = time.mktime((year - 1, month, *fields, 0, 0, 0, -1))
+            self._last_minute, self._last_value = minute, value
+        try:
+            return self._last_value + int(line[13:15])
+        except ValueError:
+            return now
+
+
+def parse_line(line: str, seq: int, timestamps: TimestampParser, now: float):
+    """A UFW log line -> LogRecord, or None for any other line"""
+    start = line.find("[UFW ")
+    if start < 0:
+        return None
+    end = line.find("]", start)
+    action = ACTIONS.get(line[start + 5:end])
+    if action is None:
+        return None
+    match = LINE_RE.search(line, end)
+    if match is not None:
+        interface_in, interface_out, src, dst, length, proto, spt, dpt = match.groups()
+    else:
+        fields = dict(FIELD_RE.findall(line, end))
+        interface_in, interface_out = fields.get("IN"), fields.get("OUT")
+        src, dst, length, proto = (fields.get("SRC"), fields.get("DST"), fields.get("LEN"),
+                                   fields.get("PROTO"))
+        spt, dpt = fields.get("SPT"), fields.get("DPT")
+    if interface_in and interface_out:
+        direction, interface = "fwd", interface_in
+    elif interface_out:
+        direction, interface = "out", interface_out
+    else:
+        direction, interface = "in", interface_in
+    intern = sys.intern
+    return LogRecord(
+        seq, timestamps.parse(line, now), action, direction,
+        intern(interface) if interface else None,
+        intern(src) if src else None,
+        intern(dst) if dst else None,
+        intern(proto.lower()) if proto else None,
+        int(spt) if spt and spt.isdigit() else None,
+        int(dpt) if dpt and dpt.isdigit() else None,
+        int(length) if length and length.isdigit() else None,
+    )
+
+
+class UfwLogTailer:
+    """
+    Follows the UFW kernel log like `tail -F` and keeps the newest parsed
+    packets in a ring buffer (capacity records, oldest dropped first).
+
+    The read position (inode + byte offset) is saved in the state dir, so a
+    restart continues where it stopped and nothing is read twice. A renamed
+    log (logrotate) is read to its end before switching to the new file; a
+    truncated one (copytruncate) is read again from its start. On first use
+    only the last `backfill` bytes are read.
+    Records are numbered; `seq` is the pagination cursor.
+    """
+
+    def __init__(self, path=None, capacity=None, state_path=None, backfill=None,
+                 poll_interval=None):
+        self.path = path or config.UFW_LOG_FILE
+        self.capacity = capacity or config.UFW_LOG_BUFFER
+        self.state_path = state_path or os.path.join(config.STATE_DIR, "ufw_log_position.json")
+        self.backfill = config.UFW_LOG_BACKFILL if backfill is None else backfill
+        self.poll_interval = poll_interval or config.UFW_LOG_POLL_INTERVAL
+        self.records = collections.deque(maxlen=self.capacity)
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._partial = b""
+        self._seq = 0
+        self._timestamps = TimestampParser()
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stopping = threading.Event()
+        self._thread = None
+        self.lines = 0
+        self.parsed = 0
+        self.bytes_read = 0
+        self.rotations = 0
+        self.last_error = None
+
+    def add_listener(self, callback):
+        """Register callback(records), called with each batch of new records"""
+        self._listeners.append(callback)
+
+    # -- position -----------------------------------------------------------
+
+    def _load_position(self):
+        try:
+            with open(self.state_path, "r") as f:
+                data = json.load(f)
+            return data.get("path"), data.get("inode"), int(data.get("offset", 0))
+        except (OSError, ValueError):
+            return None, None, None
+
+    def _save_position(self):
+        data = {"path": self.path, "inode": self._inode,
+                "offset": self._offset - len(self._partial)}
+        directory = os.path.dirname(self.state_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".ufw_log_position-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.state_path)
+
+    def _open(self, first=False):
+        """Open the log; on first open resume the saved position if it is the same file"""
+        try:
+            handle = open(self.path, "rb")
+        except OSError as e:
+            self.last_error = str(e)
+            return False
+        st = os.fstat(handle.fileno())
+        offset, mid_line = 0, False
+        if first:
+            path, inode, saved = self._load_position()
+            if path == self.path and inode == st.st_ino and saved is not None \
+                    and saved <= st.st_size:
+                offset = saved
+            elif path is None:
+                offset = max(0, st.st_size - self.backfill)
+                mid_line = offset > 0
+        handle.seek(offset)
+        self._file, self._inode, self._offset = handle, st.st_ino, offset
+        self._partial = b""
+        if mid_line:
+            # Backfill starts inside a line: skip to the next one
+            self._offset += len(handle.readline())
+        self.last_error = None
+        return True
+
+    # -- reading ------------------------------------------------------------
+
+    def _read_available(self) -> int:
+        """
+        Read to the end of the open file, parsing complete lines
+        Each chunk's records go to the buffer and the listeners before the
+        next chunk is read, so a large backlog never piles up in memory.
+        """
+        now = time.time()
+        timestamps = self._timestamps
+        count = 0
+        while True:
+            chunk = self._file.read(READ_CHUNK)
+            if not chunk:
+                break
+            self._offset += len(chunk)
+            self.bytes_read += len(chunk)
+            data = self._partial + chunk
+            cut = data.rfind(b"\n") + 1
+            self._partial = data[cut:]
+            lines = data[:cut].decode("utf-8", errors="replace").splitlines()
+            self.lines += len(lines)
+            new = []
+            for line in lines:
+                record = parse_line(line, self._seq + 1, timestamps, now)
+                if record is not None:
+                    self._seq += 1
+                    new.append(record)
+            if new:
+                self._ingest(new)
+                count += len(new)
+        return count
+
+    def _ingest(self, new):
+        self.parsed += len(new)
+        self.records.extend(new)
+        self._save_position()
+        # Still under the lock: listeners see batches in order, and a
+        # poll() returns only once they have been fed
+        for callback in self._listeners:
+            try:
+                callback(new)
+            except Exception:
+                logger.exception("ufw log listener failed")
+
+    def poll(self) -> int:
+        """Ingest whatever was appended since the last poll; returns new records"""
+        with self._lock:
+            if self._file is None and not self._open(first=self._inode is None):
+                return 0
+            count = self._read_available()
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                # Rotated away and not recreated yet: keep the old handle
+                st = None
+            if st is not None and st.st_ino != self._inode:
+                self._file.close()
+                self._file = None
+                self.rotations += 1
+                if self._open():
+                    count += self._read_available()
+            elif st is not None and st.st_size < self._offset - len(self._partial):
+                # Truncated in place
+                self.rotations += 1
+                self._file.seek(0)
+                self._offset = 0
+                self._partial = b""
+                count += self._read_available()
+        return count
+
+    # -- queries ------------------------------------------------------------
+
+    def query(self, limit=100, before=None, after=None, ip=None, port=None, action=None,
+              direction=None, proto=None) -> dict:
+        """
+        Buffered records matching the filters
+        Newest first, paged with before=<next_before>; or oldest first after
+        a cursor (after=<seq>) to follow new records.
+        ip matches source or destination, port source or destination port.
+        """
+        limit = max(1, min(int(limit), 1000))
+        checks = []
+        if ip:
+            checks.append(lambda r: r.src == ip or r.dst == ip)
+        if port is not None:
+            checks.append(lambda r: r.dpt == port or r.spt == port)
+        if action:
+            checks.append(lambda r: r.action == action)
+        if direction:
+            checks.append(lambda r: r.direction == direction)
+        if proto:
+            checks.append(lambda r: r.proto == proto)
+
+        with self._lock:
+            records = self.records
+            if not records:
+                return {"items": [], "next_before": None, "last_seq": self._seq, "limit": limit}
+            first = records[0].seq
+            last_seq = self._seq
+            # Iterate instead of indexing: a deque index costs O(n) away from its ends
+            if after is not None:
+                start = max(0, after + 1 - first)
+                candidates = itertools.islice(records, start, None)
+            else:
+                end = len(records) if before is None else max(0, min(len(records), before - first))
+                candidates = itertools.islice(reversed(records), len(records) - end, None)
+            items = []
+            more = False
+            for record in candidates:
+                if all(check(record) for check in checks):
+                    if len(items) == limit:
+                        more = True
+                        break
+                    items.append(record)
+        result = {"items": [record.to_dict() for record in items], "last_seq": last_seq,
+                  "limit": limit}
+        if after is not None:
+            result["next_after"] = items[-1].seq if items else after
+        else:
+            result["next_before"] = items[-1].seq if more else None
+        return result
+
+    # -- background ---------------------------------------------------------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="ufw-log-tailer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception("ufw log poll failed")
+            self._stopping.wait(self.poll_interval)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "offset": self._offset - len(self._partial),
+            "buffered": len(self.records),
+            "capacity": self.capacity,
+            "last_seq": self._seq,
+            "lines": self.lines,
+            "parsed": self.parsed,
+            "bytes_read": self.bytes_read,
+            "rotations": self.rotations,
+            "error": self.last_error,
+        }
+
+
+# Shared tailer of the configured UFW log
+ufw_log = UfwLogTailer()
@@ -0,0 +1,190 @@
+import collections
+import ipaddress
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# "[ 4] 142.250.1.1                DENY OUT    Anywhere                   (out) # Blocked youtube.com"
+RULE_LINE_RE = re.compile(
+    r"^\[\s*(?P<number>\d+)\]\s+(?P<to>.+?)\s+"
+    r"(?P<action>ALLOW|DENY|REJECT|LIMIT)(?:\s+(?P<direction>IN|OUT|FWD))?\s+"
+    r"(?P<rest>.*)$"
+)
+
+
+@dataclass
+class UfwRule:
+    """
+    One parsed line of `ufw status numbered`.
+    Addresses are None for "Anywhere", ports are strings because UFW
+    allows lists and ranges ("80,443", "6000:6100").
+    """
+    number: int
+    action: str
+    direction: str
+    to_address: Optional[str] = None
+    to_port: Optional[str] = None
+    from_address: Optional[str] = None
+    from_port: Optional[str] = None
+    proto: str = "any"
+    app: Optional[str] = None
+    interface: Optional[str] = None
+    ipv6: bool = False
+    log: bool = False
+    comment: Optional[str] = None
+
+    # Fields that identify a rule regardless of its number / comment
+    KEY_FIELDS = (
+        "action", "direction", "to_address", "to_port", "from_address",
+        "from_port", "proto", "app", "interface", "ipv6",
+    )
+
+    def to_dict(self):
+        # All fields are scalars: a shallow copy equals asdict() without the deepcopy
+        return dict(self.__dict__)
+
+    def key(self):
+        """Identity of the rule ignoring its position in the ruleset"""
+        return (
+            self.action, self.direction, self.to_address, self.to_port,
+            self.from_address, self.from_port, self.proto, self.app,
+            self.interface, self.ipv6,
+        )
+
+    @classmethod
+    def key_to_dict(cls, key) -> dict:
+        return dict(zip(cls.KEY_FIELDS, key))
+
+
+def _is_address(token: str) -> bool:
+    try:
+        ipaddress.ip_network(token, strict=False)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_endpoint(field: str) -> dict:
+    """
+    Parse the To/From column of `ufw status`
+    Examples: 'Anywhere', '22/tcp (v6)', '10.0.0.1 22/tcp', 'Anywhere on eth0'
+    Returns: dict(address, port, proto, app, interface, ipv6)
+    """
+    endpoint = {"address": None, "port": None, "proto": None,
+                "app": None, "interface": None, "ipv6": False}
+    field = field.strip()
+
+    if field.endswith("(v6)"):
+        endpoint["ipv6"] = True
+        field = field[:-4].strip()
+
+    iface_match = re.search(r"\s+on\s+(\S+)$", field)
+    if iface_match:
+        endpoint["interface"] = iface_match.group(1)
+        field = field[:iface_match.start()].strip()
+
+    app_tokens = []
+    for token in field.split():
+        if token == "Anywhere":
+            continue
+        if _is_address(token):
+            endpoint["address"] = token
+            if ":" in token:
+                endpoint["ipv6"] = True
+            continue
+        port, _, proto = token.partition("/")
+        if port and re.fullmatch(r"[\d,:]+", port):
+            endpoint["port"] = port
+            endpoint["proto"] = proto.lower() if proto else None
+            continue
+        app_tokens.append(token)
+
+    if app_tokens:
+        endpoint["app"] = " ".join(app_tokens)
+    return endpoint
+
+
+def parse_rule_line(line: str) -> Optional[UfwRule]:
+    """Parse a single numbered rule line, or None if it is not a rule"""
+    match = RULE_LINE_RE.match(line.strip())
+    if not match:
+        return None
+
+    rest = match.group("rest")
+    comment = None
+    if " # " in f" {rest}":
+        rest, _, comment = f" {rest}".partition(" # ")
+        rest = rest.strip()
+        comment = comment.strip() or None
+
+    direction = (match.group("direction") or "in").lower()
+    log = False
+    # Trailing markers: "(out)", "(log)", "(log-all)"
+    while rest.endswith(")"):
+        marker_start = rest.rfind("(")
+        marker = rest[marker_start + 1:-1]
+        if marker == "out":
+            direction = "out"
+        elif marker.startswith("log"):
+            log = True
+        else:
+            break
+        rest = rest[:marker_start].strip()
+
+    to = parse_endpoint(match.group("to"))
+    src = parse_endpoint(rest)
+
+    return UfwRule(
+        number=int(match.group("number")),
+        action=match.group("action").lower(),
+        direction=direction,
+        to_address=to["address"],
+        to_port=to["port"],
+        from_address=src["address"],
+        from_port=src["port"],
+        proto=to["proto"] or src["proto"] or "any",
+        app=to["app"] or src["app"],
+        interface=to["interface"] or src["interface"],
+        ipv6=to["ipv6"] or src["ipv6"],
+        log=log,
+        comment=comment,
+    )
+
+
+def parse_status(text: str) -> dict:
+    """
+    Parse the output of `ufw status numbered`
+    Returns: dict(active, rules) where rules is a list of UfwRule
+    """
+    active = None
+    rules = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("Status:"):
+            active = stripped.split(":", 1)[1].strip() == "active"
+            continue
+        rule = parse_rule_line(stripped)
+        if rule is not None:
+            rules.append(rule)
+    return {"active": active, "rules": rules}
+
+
+def diff_rules(before: list, after: list) -> tuple:
+    """
+    Rules added / removed between two rule lists, ignoring numbering
+    Returns: (added, removed) lists of UfwRule
+    """
+    before_counts = collections.Counter(rule.key() for rule in before)
+    after_counts = collections.Counter(rule.key() for rule in after)
+    added, removed = [], []
+    seen = collections.Counter()
+    for rule in after:
+        seen[rule.key()] += 1
+        if seen[rule.key()] > before_counts[rule.key()]:
+            added.append(rule)
+    seen = collections.Counter()
+    for rule in before:
+        seen[rule.key()] += 1
+        if seen[rule.key()] > after_counts[rule.key()]:
+            removed.append(rule)
+    return added, removed
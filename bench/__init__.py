@@ -0,0 +1 @@
+"""Benchmark suite: python -m bench --help"""
@@ -0,0 +1,224 @@
+"""
+Reproducible benchmark of the backend against fake ufw / sudo / DNS
+
+    python -m bench                          # sizes 10,1000,10000,100000
+    python -m bench --sizes 10,1000 --iterations 5
+    python -m bench --compare bench/results/<old>.json
+
+Each ruleset size runs in a fresh worker process with its own temp dir
+(rules files, hosts file, state dir) so sizes do not influence each other.
+Results are written as JSON (bench/results/<commit>.json by default);
+--compare prints the change against an earlier file and exits 1 when a
+scenario got slower than --threshold or spawns more subprocesses.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.scenarios import SCENARIOS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = "10,1000,10000,100000"
+
+
+def git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def iterations_for(size, requested) -> int:
+    """Fewer repetitions where one operation takes seconds"""
+    if requested:
+        return requested
+    return 20 if size <= 10000 else 5
+
+
+def worker_env(args, workdir) -> dict:
+    from bench.stand_ins import make_fakebin
+
+    env = dict(os.environ)
+    env.update({
+        "PATH": make_fakebin(os.path.join(workdir, "bin")) + os.pathsep + env.get("PATH", ""),
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "FIREWALL_STATE_DIR": os.path.join(workdir, "state"),
+        "FIREWALL_UFW_RULES_DIR": os.path.join(workdir, "ufw"),
+        "FIREWALL_UFW_DEFAULTS_FILE": os.path.join(workdir, "default-ufw"),
+        "FIREWALL_HOSTS_FILE": os.path.join(workdir, "hosts"),
+        "FIREWALL_UFW_LOG_FILE": os.path.join(workdir, "ufw.log"),
+        "FIREWALL_HELPER_SOCKET": os.path.join(workdir, "no-helper.sock"),
+        "FIREWALL_SYNC_ENABLED": "0",
+        "FIREWALL_COALESCE_WINDOW": str(args.coalesce_window),
+        "FAKE_UFW_LATENCY": str(args.ufw_latency),
+        "FAKE_UFW_RELOAD_PER_RULE": str(args.reload_per_rule),
+    })
+    return env
+
+
+def run_worker(args):
+    """Seed one ruleset, drive the app through every scenario, write the results"""
+    from bench.stand_ins import ScriptedResolver, seed_rules, write_defaults, write_hosts
+    from backend import config
+
+    write_defaults(config.UFW_DEFAULTS_FILE)
+    write_hosts(config.HOSTS_FILE)
+    seed_rules(config.UFW_RULES_DIR, args.size)
+
+    from fastapi.testclient import TestClient
+    from backend.api_server import app
+    from backend.dns_resolver import resolver
+    from bench.scenarios import Runner
+
+    ScriptedResolver(latency=args.dns_latency).install(resolver)
+    with TestClient(app) as client:
+        runner = Runner(client, args.size, iterations_for(args.size, args.iterations))
+        results = runner.run(args.scenarios.split(","))
+    with open(args.worker_output, "w") as f:
+        json.dump(results, f)
+
+
+def run_size(args, size) -> list:
+    workdir = tempfile.mkdtemp(prefix=f"fw-bench-{size}-")
+    output = os.path.join(workdir, "results.json")
+    command = [sys.executable, "-m", "bench", "--worker", "--size", str(size),
+               "--worker-output", output, "--scenarios", args.scenarios,
+               "--dns-latency", str(args.dns_latency)]
+    if args.iterations:
+        command += ["--iterations", str(args.iterations)]
+    try:
+        completed = subprocess.run(command, cwd=ROOT, env=worker_env(args, workdir))
+        if completed.returncode != 0:
+            raise SystemExit(f"benchmark worker for size {size} failed "
+                             f"(exit {completed.returncode})")
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        if args.keep:
+            print(f"  kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_results(results):
+    print(f"{'size':>7} {'scenario':<16} {'ops':>5} {'err':>4} {'ops/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'procs/op':>8}")
+    for r in results:
+        latency = r["latency_ms"]
+        print(f"{r['size']:>7} {r['scenario']:<16} {r['ops']:>5} {r['errors']:>4} "
+              f"{r['ops_per_sec'] or 0:>9.2f} {latency['p50']:>9.2f} {latency['p95']:>9.2f} "
+              f"{latency['p99']:>9.2f} {r['subprocesses_per_op']:>8.2f}")
+
+
+def compare(baseline, results, threshold) -> int:
+    """Print the change per scenario; returns the number of regressions"""
+    old = {(r["size"], r["scenario"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\nagainst {baseline['meta'].get('commit', '?')[:12]} "
+          f"(regression: > {threshold:.0%} slower or more subprocesses)")
+    print(f"{'size':>7} {'scenario':<16} {'p50 ms':>26} {'p99 ms':>26} {'procs/op':>14}")
+    for r in results:
+        before = old.get((r["size"], r["scenario"]))
+        if before is None:
+            continue
+        flags = []
+        cells = []
+        for key in ("p50", "p99"):
+            a, b = before["latency_ms"][key], r["latency_ms"][key]
+            change = (b - a) / a if a else 0.0
+            if change > threshold:
+                flags.append(key)
+            cells.append(f"{a:.1f} -> {b:.1f} ({change:+.0%})".rjust(26))
+        a, b = before["subprocesses_per_op"], r["subprocesses_per_op"]
+        if b > a + 1e-9:
+            flags.append("procs")
+        cells.append(f"{a:.2f} -> {b:.2f}".rjust(14))
+        regressions += bool(flags)
+        print(f"{r['size']:>7} {r['scenario']:<16} {' '.join(cells)}"
+              f"{'  REGRESSION ' + ','.join(flags) if flags else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma separated ruleset sizes (default %(default)s)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=0,
+                        help="operations per scenario (default 20, 5 for sizes over 10000)")
+    parser.add_argument("--ufw-latency", type=float, default=0.05,
+                        help="seconds every fake ufw call takes (default %(default)s)")
+    parser.add_argument("--reload-per-rule", type=float, default=0.00002,
+                        help="extra seconds per rule when the fake ufw loads the ruleset "
+                             "(default %(default)s)")
+    parser.add_argument("--dns-latency", type=float, default=0.02,
+                        help="seconds per scripted DNS query (default %(default)s)")
+    parser.add_argument("--coalesce-window", type=float, default=0.0,
+                        help="FIREWALL_COALESCE_WINDOW for the app (default %(default)s)")
+    parser.add_argument("--output", help="results file (default bench/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative latency increase counted as a regression (default %(default)s)")
+    parser.add_argument("--keep", action="store_true", help="keep the per-size temp dirs")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.worker:
+        return run_worker(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    commit = git("rev-parse", "HEAD")
+    meta = {
+        "commit": commit,
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "sizes": [int(size) for size in args.sizes.split(",")],
+            "iterations": args.iterations or "auto",
+            "ufw_latency": args.ufw_latency,
+            "reload_per_rule": args.reload_per_rule,
+            "dns_latency": args.dns_latency,
+            "coalesce_window": args.coalesce_window,
+        },
+    }
+
+    results = []
+    for size in meta["settings"]["sizes"]:
+        print(f"ruleset size {size} ...", flush=True)
+        size_results = run_size(args, size)
+        print_results(size_results)
+        results.extend(size_results)
+
+    output = args.output or os.path.join(ROOT, "bench", "results",
+                                         f"{commit[:12] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if baseline is not None and compare(baseline, results, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
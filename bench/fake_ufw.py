@@ -0,0 +1,318 @@
+"""
+Stand-in for the ufw CLI used by the benchmarks (stdlib only, run with -S)
+
+State lives where the backend expects it: user.rules / user6.rules in
+FIREWALL_UFW_RULES_DIR (same `### tuple ###` format ufw writes, so RuleBatch
+edits and CLI edits see one ruleset), the enabled flag in ufw.conf there
+and default policies in FIREWALL_UFW_DEFAULTS_FILE.
+Every call sleeps FAKE_UFW_LATENCY seconds; commands that load rules into
+the kernel (reload, enable, rule changes) add FAKE_UFW_RELOAD_PER_RULE per rule.
+"""
+import binascii
+import os
+import socket
+import sys
+import time
+
+RULES_DIR = os.environ.get("FIREWALL_UFW_RULES_DIR", "/etc/ufw")
+DEFAULTS_FILE = os.environ.get("FIREWALL_UFW_DEFAULTS_FILE", "/etc/default/ufw")
+LATENCY = float(os.environ.get("FAKE_UFW_LATENCY", "0.05"))
+RELOAD_PER_RULE = float(os.environ.get("FAKE_UFW_RELOAD_PER_RULE", "0.00002"))
+
+RULES_BEGIN = "### RULES ###"
+RULES_END = "### END RULES ###"
+TUPLE_PREFIX = "### tuple ###"
+ACTIONS = ("allow", "deny", "reject", "limit")
+TARGETS = {"allow": "ACCEPT", "deny": "DROP", "reject": "REJECT", "limit": "ACCEPT"}
+ANYWHERE = {"v4": "0.0.0.0/0", "v6": "::/0"}
+
+
+def rules_template(family) -> str:
+    chain = "ufw6" if family == "v6" else "ufw"
+    return (f"*filter\n:{chain}-user-input - [0:0]\n:{chain}-user-output - [0:0]\n"
+            f":{chain}-user-forward - [0:0]\n{RULES_BEGIN}\n\n{RULES_END}\n\n"
+            f"### LOGGING ###\n### END LOGGING ###\n\n### RATE LIMITING ###\n"
+            f"### END RATE LIMITING ###\nCOMMIT\n")
+
+
+def rules_path(family):
+    return os.path.join(RULES_DIR, "user6.rules" if family == "v6" else "user.rules")
+
+
+def families():
+    try:
+        with open(DEFAULTS_FILE) as f:
+            for line in f:
+                if line.startswith("IPV6="):
+                    if line.split("=", 1)[1].strip().strip('"').lower() != "yes":
+                        return ("v4",)
+    except OSError:
+        pass
+    return ("v4", "v6")
+
+
+class RulesFile:
+    def __init__(self, family):
+        self.family = family
+        try:
+            with open(rules_path(family)) as f:
+                text = f.read()
+        except FileNotFoundError:
+            text = rules_template(family)
+        lines = text.splitlines()
+        if RULES_BEGIN not in lines or RULES_END not in lines:
+            raise SystemExit(f"ERROR: problem in {rules_path(family)}")
+        begin, end = lines.index(RULES_BEGIN), lines.index(RULES_END)
+        self.header, self.footer = lines[:begin + 1], lines[end:]
+        self.blocks = []
+        for line in lines[begin + 1:end]:
+            if line.startswith(TUPLE_PREFIX):
+                self.blocks.append([line])
+            elif line.strip() and self.blocks:
+                self.blocks[-1].append(line)
+
+    @staticmethod
+    def fields(block):
+        """(action, proto, dport, dst, sport, src, direction), comment"""
+        parts = block[0][len(TUPLE_PREFIX):].split()
+        comment = next((p[8:] for p in parts if p.startswith("comment=")), None)
+        return tuple(p for p in parts if not p.startswith("comment="))[:7], comment
+
+    def save(self):
+        out = list(self.header)
+        for block in self.blocks:
+            out.append("")
+            out.extend(block)
+        out.append("")
+        out.extend(self.footer)
+        path = rules_path(self.family)
+        tmp = path + ".fake-tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(out) + "\n")
+        os.replace(tmp, path)
+
+
+def conf_enabled() -> bool:
+    try:
+        with open(os.path.join(RULES_DIR, "ufw.conf")) as f:
+            return "ENABLED=yes" in f.read()
+    except OSError:
+        return True
+
+
+def set_enabled(enabled):
+    with open(os.path.join(RULES_DIR, "ufw.conf"), "w") as f:
+        f.write(f"ENABLED={'yes' if enabled else 'no'}\n")
+
+
+def load_cost():
+    """Time the kernel takes to load the current ruleset"""
+    count = sum(len(RulesFile(family).blocks) for family in families())
+    time.sleep(count * RELOAD_PER_RULE)
+
+
+def port_text(port, proto):
+    return port if proto == "any" else f"{port}/{proto}"
+
+
+def status(verbose=False):
+    if not conf_enabled():
+        print("Status: inactive")
+        return
+    print("Status: active")
+    if verbose:
+        print("Logging: on (low)\nDefault: deny (incoming), allow (outgoing), deny (routed)\n"
+              "New profiles: skip")
+    print("\n     To                         Action      From\n"
+          "     --                         ------      ----")
+    number = 0
+    for family in families():
+        v6 = " (v6)" if family == "v6" else ""
+        for block in RulesFile(family).blocks:
+            (action, proto, dport, dst, sport, src, direction), comment = RulesFile.fields(block)
+            number += 1
+            anywhere = ANYWHERE[family]
+            if dst == anywhere:
+                to = (port_text(dport, proto) if dport != "any" else "Anywhere") + v6
+            else:
+                to = dst + (f" {port_text(dport, proto)}" if dport != "any" else "")
+            if src == anywhere:
+                frm = "Anywhere" + v6
+            else:
+                frm = src + (f" {port_text(sport, proto)}" if sport != "any" else "")
+            line = f"[{number:>2}] {to:<27}{action.upper() + ' ' + direction.upper():<12}{frm}"
+            if direction == "out":
+                line = f"{line:<72}(out)"
+            if comment:
+                line += " # " + binascii.unhexlify(comment).decode("utf-8", "replace")
+            print(line)
+
+
+def parse_rule(args):
+    """ufw rule syntax -> (tuple fields per family, comment)"""
+    action = args.pop(0)
+    direction = "in"
+    if args and args[0] in ("in", "out"):
+        direction = args.pop(0)
+    proto, dport, sport, dst, src, comment = "any", "any", "any", None, None, None
+    if len(args) == 1 or (len(args) == 3 and args[1] == "comment"):
+        # Simple form: PORT[/PROTO] or service name
+        spec = args[0]
+        port, _, proto = spec.partition("/")
+        proto = proto or "any"
+        if not port.replace(":", "").replace(",", "").isdigit():
+            found = []
+            for candidate in ("tcp", "udp"):
+                try:
+                    port_number = socket.getservbyname(port, candidate)
+                    found.append(candidate)
+                except OSError:
+                    continue
+            if not found:
+                raise SystemExit(f"ERROR: Could not find a profile matching '{spec}'")
+            port, proto = str(port_number), found[0] if len(found) == 1 else "any"
+        dport = port
+        if len(args) == 3:
+            comment = args[2]
+    else:
+        tokens = iter(args)
+        last = None
+        for token in tokens:
+            if token in ("to", "from", "port", "proto", "comment"):
+                value = next(tokens, None)
+                if token == "to":
+                    dst, last = (None if value == "any" else value), "to"
+                elif token == "from":
+                    src, last = (None if value == "any" else value), "from"
+                elif token == "port":
+                    if last == "from":
+                        sport = value
+                    else:
+                        dport = value
+                elif token == "proto":
+                    proto = value
+                else:
+                    comment = value
+            else:
+                raise SystemExit(f"ERROR: Invalid syntax near '{token}'")
+    address = dst or src
+    rule_families = families() if address is None else ("v6" if ":" in address else "v4",)
+    rules = {}
+    for family in rule_families:
+        rules[family] = (action, proto, dport, dst or ANYWHERE[family], sport,
+                         src or ANYWHERE[family], direction)
+    return rules, comment
+
+
+def render_block(fields, comment, family):
+    action, proto, dport, dst, sport, src, direction = fields
+    header = f"{TUPLE_PREFIX} {' '.join(fields)}"
+    if comment:
+        header += " comment=" + binascii.hexlify(comment.encode("utf-8")).decode("ascii")
+    chain = f"{'ufw6' if family == 'v6' else 'ufw'}-user-{'output' if direction == 'out' else 'input'}"
+    rule = [f"-A {chain}"]
+    if proto != "any":
+        rule.append(f"-p {proto}")
+    if dst != ANYWHERE[family]:
+        rule.append(f"-d {dst}")
+    if dport != "any":
+        rule.append(f"--dport {dport}")
+    if src != ANYWHERE[family]:
+        rule.append(f"-s {src}")
+    rule.append(f"-j {TARGETS[action]}")
+    return [header, " ".join(rule)]
+
+
+def change_rule(args, delete=False):
+    rules, comment = parse_rule(args)
+    for family, fields in rules.items():
+        suffix = " (v6)" if family == "v6" else ""
+        current = RulesFile(family)
+        matches = [block for block in current.blocks if RulesFile.fields(block)[0] == fields]
+        if delete:
+            if not matches:
+                print("Could not delete non-existent rule" + suffix)
+                continue
+            current.blocks = [block for block in current.blocks if block not in matches]
+            current.save()
+            print("Rule deleted" + suffix)
+        elif matches:
+            print("Skipping adding existing rule" + suffix)
+        else:
+            current.blocks.append(render_block(fields, comment, family))
+            current.save()
+            print("Rule added" + suffix)
+    if conf_enabled():
+        load_cost()
+
+
+def delete_number(number):
+    remaining = number
+    for family in families():
+        current = RulesFile(family)
+        if remaining <= len(current.blocks):
+            del current.blocks[remaining - 1]
+            current.save()
+            print("Rule deleted")
+            return
+        remaining -= len(current.blocks)
+    raise SystemExit("ERROR: Could not find rule '%d'" % number)
+
+
+def set_default(policy, direction):
+    key = {"incoming": "DEFAULT_INPUT_POLICY", "outgoing": "DEFAULT_OUTPUT_POLICY",
+           "routed": "DEFAULT_FORWARD_POLICY"}[direction]
+    value = {"deny": "DROP", "allow": "ACCEPT", "reject": "REJECT"}[policy]
+    try:
+        with open(DEFAULTS_FILE) as f:
+            lines = [line for line in f.read().splitlines() if not line.startswith(key + "=")]
+    except OSError:
+        lines = ["IPV6=yes"]
+    lines.append(f'{key}="{value}"')
+    with open(DEFAULTS_FILE, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    print(f"Default {direction} policy changed to '{policy}'")
+
+
+def main(argv):
+    time.sleep(LATENCY)
+    args = [arg for arg in argv if arg != "--force"]
+    if not args:
+        raise SystemExit("ERROR: not enough args")
+    command = args[0]
+    if command == "status":
+        status(verbose="verbose" in args)
+    elif command == "reload":
+        if conf_enabled():
+            load_cost()
+            print("Firewall reloaded")
+        else:
+            print("Firewall not enabled (skipping reload)")
+    elif command == "enable":
+        set_enabled(True)
+        load_cost()
+        print("Firewall is active and enabled on system startup")
+    elif command == "disable":
+        set_enabled(False)
+        print("Firewall stopped and disabled on system startup")
+    elif command == "reset":
+        for family in ("v4", "v6"):
+            with open(rules_path(family), "w") as f:
+                f.write(rules_template(family))
+        set_enabled(False)
+        print("Resetting all rules to installed defaults.")
+    elif command == "default":
+        set_default(args[1], args[2])
+    elif command == "delete":
+        if len(args) == 2 and args[1].isdigit():
+            delete_number(int(args[1]))
+        else:
+            change_rule(args[1:], delete=True)
+    elif command in ACTIONS:
+        change_rule(args)
+    else:
+        raise SystemExit(f"ERROR: Invalid syntax: {command}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
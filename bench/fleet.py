@@ -0,0 +1,228 @@
+"""
+Fleet fan-out against several local agents
+Starts --agents backends (uvicorn, each with its own fake ufw / sudo / DNS
+stand-ins, temp dirs and --size seeded rules) on consecutive ports from
+--base-port, registers them with a controller and times fleet-wide port
+toggles, domain blocks and emergency stops:
+
+    python -m bench.fleet --agents 8 --iterations 5
+    python -m bench.fleet --agents 8 --keep-running    # then drive them by hand
+
+`fan-out` is the time until every agent answered; `sum of hosts` is what
+sending the same requests one host after another would have taken.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.__main__ import ROOT, worker_env
+from bench.scenarios import percentile
+
+SCENARIOS = ("port_toggle", "domain_block", "emergency_stop")
+
+
+def run_agent(args):
+    """One agent: seed its ruleset, script DNS, serve the app on --port"""
+    import uvicorn
+    from bench.stand_ins import ScriptedResolver, seed_rules, write_defaults, write_hosts
+    from backend import config
+
+    write_defaults(config.UFW_DEFAULTS_FILE)
+    write_hosts(config.HOSTS_FILE)
+    seed_rules(config.UFW_RULES_DIR, args.size)
+
+    from backend.api_server import app
+    from backend.dns_resolver import resolver
+
+    ScriptedResolver(latency=args.dns_latency).install(resolver)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def start_agents(args) -> list:
+    agents = []
+    for index in range(args.agents):
+        port = args.base_port + index
+        workdir = tempfile.mkdtemp(prefix=f"fw-fleet-{port}-")
+        command = [sys.executable, "-m", "bench.fleet", "--agent", "--port", str(port),
+                   "--size", str(args.size), "--dns-latency", str(args.dns_latency)]
+        log = open(os.path.join(workdir, "agent.log"), "w")
+        process = subprocess.Popen(command, cwd=ROOT, env=worker_env(args, workdir),
+                                   stdout=log, stderr=subprocess.STDOUT)
+        agents.append({"name": f"agent-{index + 1}", "url": f"http://127.0.0.1:{port}",
+                       "process": process, "workdir": workdir, "log": log})
+    return agents
+
+
+async def wait_ready(agents, timeout=60):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        for agent in agents:
+            while True:
+                if agent["process"].poll() is not None:
+                    raise SystemExit(f"{agent['name']} exited; see {agent['workdir']}/agent.log")
+                try:
+                    if (await client.get(agent["url"] + "/")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise SystemExit(f"{agent['name']} did not start within {timeout}s")
+                await asyncio.sleep(0.2)
+
+
+def stop_agents(agents, keep):
+    for agent in agents:
+        agent["process"].terminate()
+    for agent in agents:
+        try:
+            agent["process"].wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            agent["process"].kill()
+        agent["log"].close()
+        if keep:
+            print(f"  kept {agent['workdir']}")
+        else:
+            shutil.rmtree(agent["workdir"], ignore_errors=True)
+
+
+def operations(name, index) -> list:
+    """(label, fleet method, args) pairs making up one iteration of a scenario"""
+    if name == "port_toggle":
+        port = 20000 + index
+        return [("port_on", "POST", f"/api/firewall/port/{port}/on"),
+                ("port_off", "POST", f"/api/firewall/port/{port}/off")]
+    if name == "domain_block":
+        domain = f"fleet-{index}.example"
+        return [("domain_block", "POST", f"/api/firewall/domain/{domain}/block"),
+                ("domain_unblock", "POST", f"/api/firewall/domain/{domain}/unblock")]
+    return [("emergency_stop", "POST", "/api/firewall/emergency-stop"),
+            ("emergency_undo", "POST", "/api/firewall/emergency-stop/undo")]
+
+
+async def measure(fleet, args) -> list:
+    samples = {}
+    for name in args.scenarios.split(","):
+        iterations = min(args.iterations, 3) if name == "emergency_stop" else args.iterations
+        for index in range(iterations):
+            for label, method, path in operations(name, index):
+                idempotent = label != "emergency_stop"
+                result = await fleet.broadcast(method, path, params={"wait": True},
+                                               idempotent=idempotent)
+                entry = samples.setdefault(label, {"fan_out": [], "hosts": [], "errors": 0})
+                entry["fan_out"].append(result["elapsed_ms"])
+                entry["hosts"].append(sum(r["elapsed_ms"] for r in result["results"]))
+                entry["errors"] += result["failed"]
+    results = []
+    for label, entry in samples.items():
+        fan_out = sorted(entry["fan_out"])
+        hosts = sorted(entry["hosts"])
+        results.append({
+            "operation": label,
+            "agents": args.agents,
+            "ops": len(fan_out),
+            "host_errors": entry["errors"],
+            "fan_out_ms": {"p50": round(percentile(fan_out, 0.5), 3),
+                           "p95": round(percentile(fan_out, 0.95), 3),
+                           "max": round(fan_out[-1], 3)},
+            "sum_of_hosts_ms": {"p50": round(percentile(hosts, 0.5), 3)},
+            "speedup": round(percentile(hosts, 0.5) / percentile(fan_out, 0.5), 2)
+            if percentile(fan_out, 0.5) else None,
+        })
+    return results
+
+
+async def run_controller(args, agents) -> list:
+    from backend.fleet import Fleet
+
+    registry = os.path.join(tempfile.mkdtemp(prefix="fw-fleet-controller-"), "fleet.json")
+    fleet = Fleet(path=registry, concurrency=args.concurrency, timeout=args.timeout)
+    for agent in agents:
+        fleet.add(agent["name"], agent["url"])
+    try:
+        await wait_ready(agents)
+        check = await fleet.broadcast("GET", "/")
+        if check["failed"]:
+            raise SystemExit(f"agents not healthy: {json.dumps(check['results'])[:500]}")
+        if args.keep_running:
+            print("agents:\n" + "\n".join(f"  {a['name']} {a['url']}" for a in agents))
+            print("register them with a controller, e.g.:")
+            print(f"  FIREWALL_FLEET_AGENTS={','.join(a['name'] + '=' + a['url'] for a in agents)}")
+            print("Ctrl-C to stop")
+            while True:
+                await asyncio.sleep(3600)
+        return await measure(fleet, args)
+    finally:
+        await fleet.stop()
+        shutil.rmtree(os.path.dirname(registry), ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.fleet",
+                                     description=__doc__.split("\n")[1])
+    parser.add_argument("--agents", type=int, default=8, help="local agents (default %(default)s)")
+    parser.add_argument("--base-port", type=int, default=18100,
+                        help="port of the first agent (default %(default)s)")
+    parser.add_argument("--size", type=int, default=1000,
+                        help="seeded rules per agent (default %(default)s)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=5,
+                        help="rounds per scenario (default %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="controller requests in flight (default %(default)s)")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="per-host timeout in seconds (default %(default)s)")
+    parser.add_argument("--ufw-latency", type=float, default=0.05,
+                        help="seconds every fake ufw call takes (default %(default)s)")
+    parser.add_argument("--reload-per-rule", type=float, default=0.00002,
+                        help="extra seconds per rule on a fake ufw reload (default %(default)s)")
+    parser.add_argument("--dns-latency", type=float, default=0.02,
+                        help="seconds per scripted DNS query (default %(default)s)")
+    parser.add_argument("--coalesce-window", type=float, default=0.0,
+                        help="FIREWALL_COALESCE_WINDOW for the agents (default %(default)s)")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="keep the agents' temp dirs")
+    parser.add_argument("--keep-running", action="store_true",
+                        help="start the agents and wait instead of measuring")
+    parser.add_argument("--agent", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.agent:
+        return run_agent(args)
+
+    print(f"starting {args.agents} agents ({args.size} rules each) ...", flush=True)
+    agents = start_agents(args)
+    try:
+        results = asyncio.run(run_controller(args, agents))
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        stop_agents(agents, args.keep)
+
+    print(f"{'operation':<16} {'agents':>6} {'ops':>4} {'err':>4} {'fan-out p50':>12} "
+          f"{'p95':>9} {'sum of hosts':>13} {'speedup':>8}")
+    for r in results:
+        print(f"{r['operation']:<16} {r['agents']:>6} {r['ops']:>4} {r['host_errors']:>4} "
+              f"{r['fan_out_ms']['p50']:>12.1f} {r['fan_out_ms']['p95']:>9.1f} "
+              f"{r['sum_of_hosts_ms']['p50']:>13.1f} {r['speedup'] or 0:>7.1f}x")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+        print(f"\nresults written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
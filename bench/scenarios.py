@@ -0,0 +1,196 @@
+"""
+Benchmark scenarios, run in a worker process against one seeded ruleset
+The FastAPI app is driven in-process with TestClient; every scenario
+reports latency percentiles, throughput and the subprocesses it spawned
+(including the background `ufw status` refresh its changes cause).
+"""
+import time
+
+SCENARIOS = ("status_cached", "status_refresh", "evaluate", "toggle_port", "bulk_ports",
+             "domain_block", "domain_unblock", "domain_import", "emergency_stop", "emergency_undo")
+
+# Ports toggled by the scenarios (clear of protected and seeded ports)
+TOGGLE_PORT_BASE = 20000
+BULK_PORT_BASE = 21000
+IMPORT_DOMAINS = 10000
+# Distinct flows per /evaluate batch
+EVALUATE_FLOWS = 10000
+
+
+def percentile(ordered, fraction) -> float:
+    """Nearest-rank percentile of a sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def failed(response) -> bool:
+    if response.status_code >= 400:
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get("status") in ("error", "failed")
+
+
+def summarise(size, name, latencies, errors, elapsed, processes) -> dict:
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "size": size,
+        "scenario": name,
+        "ops": count,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "ops_per_sec": round(count / elapsed, 3) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / count * 1000, 3) if count else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if count else 0.0,
+        },
+        "subprocesses": processes,
+        "subprocesses_per_op": round(processes / count, 3) if count else 0.0,
+    }
+
+
+class Runner:
+    def __init__(self, client, size, iterations):
+        from backend.metrics import subprocess_duration
+        from backend.rule_state import rule_state
+
+        self.client = client
+        self.size = size
+        self.iterations = iterations
+        self.subprocesses = subprocess_duration
+        self.rule_state = rule_state
+
+    def timed(self, operation) -> tuple:
+        """(seconds, failed, subprocesses) of one call, status re-read included"""
+        before = self.subprocesses.count()
+        started = time.perf_counter()
+        response = operation()
+        elapsed = time.perf_counter() - started
+        # Charge the status re-read the change triggered to the operation
+        self.rule_state.snapshot()
+        return elapsed, failed(response), self.subprocesses.count() - before
+
+    def measure(self, name, operations) -> dict:
+        """Run the operations one after another and summarise them"""
+        before = self.subprocesses.count()
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for operation in operations:
+            op_started = time.perf_counter()
+            response = operation()
+            latencies.append(time.perf_counter() - op_started)
+            if failed(response):
+                errors += 1
+        elapsed = time.perf_counter() - started
+        self.rule_state.snapshot()
+        return summarise(self.size, name, latencies, errors, elapsed,
+                         self.subprocesses.count() - before)
+
+    # -- scenarios ----------------------------------------------------------
+
+    def status_cached(self):
+        get = self.client.get
+        # Cheap on small rulesets, so sample more of them
+        repeat = 10 if self.size <= 10000 else 1
+        return [lambda: get("/api/firewall/status")] * (self.iterations * repeat)
+
+    def status_refresh(self):
+        get = self.client.get
+        return [lambda: get("/api/firewall/status", params={"refresh": "true"})] * self.iterations
+
+    def evaluate(self):
+        """Batches of distinct flows (no repeats to deduplicate)"""
+        post = self.client.post
+        operations = []
+        for index in range(self.iterations):
+            flows = [{"direction": "out" if i % 2 else "in",
+                      "src": f"192.0.2.{i % 250 + 1}",
+                      "dst": f"10.{index % 250}.{i // 250 % 256}.{i % 250}",
+                      "port": 1024 + i % 60000, "proto": "tcp"}
+                     for i in range(EVALUATE_FLOWS)]
+            operations.append(lambda flows=flows: post("/api/firewall/evaluate",
+                                                       json={"flows": flows}))
+        return operations
+
+    def toggle_port(self):
+        post = self.client.post
+        operations = []
+        for index in range(self.iterations):
+            port = TOGGLE_PORT_BASE + index
+            operations.append(lambda port=port: post(f"/api/firewall/port/{port}/on?wait=true"))
+            operations.append(lambda port=port: post(f"/api/firewall/port/{port}/off?wait=true"))
+        return operations
+
+    def bulk_ports(self):
+        post = self.client.post
+        operations = []
+        for index in range(max(1, self.iterations // 2)):
+            base = BULK_PORT_BASE + index * 100
+            ports = [f"{base}-{base + 49}"] + [base + 60 + i for i in range(10)]
+            for action in ("on", "off"):
+                body = {"action": action, "proto": "tcp", "ports": ports}
+                operations.append(lambda body=body: post("/api/firewall/ports?wait=true", json=body))
+        return operations
+
+    def _domain_operations(self, action):
+        post = self.client.post
+        return [lambda index=index: post(f"/api/firewall/domain/bench-{index}.example/{action}"
+                                         f"?wait=true")
+                for index in range(self.iterations)]
+
+    def domain_block(self):
+        return self._domain_operations("block")
+
+    def domain_unblock(self):
+        return self._domain_operations("unblock")
+
+    def domain_import(self):
+        def run(index):
+            body = "\n".join(f"bench-import-{index}-{i}.example" for i in range(IMPORT_DOMAINS))
+            response = self.client.post("/api/firewall/domain/import?format=plain",
+                                        content=body.encode("utf-8"))
+            if response.status_code >= 400:
+                return response
+            url = response.json()["status_url"]
+            while True:
+                response = self.client.get(url)
+                if response.status_code >= 400 or response.json().get("status") not in (
+                        "pending", "running", "queued"):
+                    return response
+                time.sleep(0.01)
+
+        return [lambda index=index: run(index) for index in range(2)]
+
+    def emergency(self) -> list:
+        """Stop, then undo (restoring the seeded ruleset for the next stop)"""
+        stops, undos = [], []
+        for _ in range(max(1, min(3, self.iterations))):
+            stops.append(self.timed(
+                lambda: self.client.post("/api/firewall/emergency-stop?wait=true")))
+            undos.append(self.timed(
+                lambda: self.client.post("/api/firewall/emergency-stop/undo?wait=true")))
+        return [summarise(self.size, name, [seconds for seconds, _, _ in samples],
+                          sum(1 for _, error, _ in samples if error),
+                          sum(seconds for seconds, _, _ in samples),
+                          sum(processes for _, _, processes in samples))
+                for name, samples in (("emergency_stop", stops), ("emergency_undo", undos))]
+
+    def run(self, names) -> list:
+        results = []
+        self.client.get("/api/firewall/status")
+        for name in names:
+            if name in ("emergency_stop", "emergency_undo"):
+                if not any(r["scenario"] == name for r in results):
+                    results.extend(r for r in self.emergency() if r["scenario"] in names)
+                continue
+            results.append(self.measure(name, getattr(self, name)()))
+        return results
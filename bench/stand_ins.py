@@ -0,0 +1,115 @@
+"""
+Stand-ins for the privileged parts of the system the backend talks to
+A temp dir with sudo / ufw / resolvectl executables (put first on PATH),
+seeded UFW rules files, a temp hosts file and a scripted DNS resolver.
+"""
+import asyncio
+import ipaddress
+import os
+import stat
+import sys
+import zlib
+
+FAKE_UFW = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_ufw.py")
+
+# Ports used by the seeded allow rules (clear of everything the scenarios touch)
+SEED_PORT_BASE = 40000
+# Seeded deny rules block consecutive addresses from here
+SEED_NETWORK = ipaddress.ip_address("10.0.0.0")
+
+
+def _executable(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def make_fakebin(directory) -> str:
+    """Create the fake executables; returns the directory to prepend to PATH"""
+    os.makedirs(directory, exist_ok=True)
+    _executable(os.path.join(directory, "sudo"), '#!/bin/sh\nexec "$@"\n')
+    _executable(os.path.join(directory, "ufw"),
+                f'#!/bin/sh\nexec "{sys.executable}" -S "{FAKE_UFW}" "$@"\n')
+    for name in ("systemd-resolve", "resolvectl"):
+        _executable(os.path.join(directory, name), "#!/bin/sh\nexit 0\n")
+    return directory
+
+
+def seed_rules(rules_dir, count):
+    """
+    Write user.rules / user6.rules holding `count` rules, shaped like a
+    firewall that has blocked many domains: mostly `deny out to <ip>` with
+    a comment, plus one allowed port per ten rules (both families).
+    Call with the backend importable (FIREWALL_* already set).
+    """
+    from backend.ufw_batch import RULES_BEGIN, RULES_END, RuleSpec
+
+    blocks = {"v4": [], "v6": []}
+    written = 0
+    index = 0
+    while written < count:
+        if index % 10 == 0:
+            spec = RuleSpec("allow", "in", port=SEED_PORT_BASE + index // 10, proto="tcp")
+        else:
+            address = str(SEED_NETWORK + index)
+            spec = RuleSpec("deny", "out", dst=address, comment=f"Blocked seed-{index}.example")
+        for family in spec.families():
+            if written < count:
+                blocks[family].append(spec.render(family))
+                written += 1
+        index += 1
+
+    os.makedirs(rules_dir, exist_ok=True)
+    for family, name in (("v4", "user.rules"), ("v6", "user6.rules")):
+        chain = "ufw6" if family == "v6" else "ufw"
+        lines = ["*filter", f":{chain}-user-input - [0:0]", f":{chain}-user-output - [0:0]",
+                 f":{chain}-user-forward - [0:0]", RULES_BEGIN]
+        for block in blocks[family]:
+            lines.append("")
+            lines.extend(block)
+        lines += ["", RULES_END, "", "### LOGGING ###", "### END LOGGING ###", "",
+                  "### RATE LIMITING ###", "### END RATE LIMITING ###", "COMMIT"]
+        with open(os.path.join(rules_dir, name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+    with open(os.path.join(rules_dir, "ufw.conf"), "w") as f:
+        f.write("ENABLED=yes\n")
+
+
+def write_defaults(path):
+    with open(path, "w") as f:
+        f.write('IPV6=yes\nDEFAULT_INPUT_POLICY="DROP"\nDEFAULT_OUTPUT_POLICY="ACCEPT"\n'
+                'DEFAULT_FORWARD_POLICY="DROP"\n')
+
+
+def write_hosts(path):
+    with open(path, "w") as f:
+        f.write("127.0.0.1 localhost\n::1 localhost ip6-localhost ip6-loopback\n")
+
+
+class ScriptedResolver:
+    """
+    Deterministic DNS answers after a fixed delay
+    Every name gets two A records in 198.18.0.0/15 (the benchmarking range)
+    and one AAAA in 2001:db8::/32, derived from a hash of the name; names
+    starting with "nx" do not exist.
+    """
+
+    def __init__(self, latency=0.02, ttl=300):
+        self.latency = latency
+        self.ttl = ttl
+        self.queries = 0
+
+    async def query(self, name, rdtype):
+        self.queries += 1
+        await asyncio.sleep(self.latency)
+        if name.startswith("nx"):
+            return [], 60
+        h = zlib.crc32(name.encode("utf-8"))
+        if rdtype == "A":
+            return [f"198.18.{(h >> 8) & 255}.{h & 255}",
+                    f"198.19.{(h >> 16) & 255}.{(h >> 24) & 255}"], self.ttl
+        return [f"2001:db8::{h >> 16:x}:{h & 0xffff:x}"], self.ttl
+
+    def install(self, resolver):
+        """Answer the resolver's cache misses from the script"""
+        resolver._query = self.query
@@ -5,6 +5,7 @@ import {
   togglePort, 
   controlDomain, 
   getBlockedDomains,
+  subscribeFirewallEvents,
   FirewallRuleResponse 
 } from "../services/firewallAPI";
 import { Button } from "./ui/button";
@@ -29,7 +30,7 @@ const FirewallDashboard: React.FC = () => {
   const fetchStatus = async () => {
     try {
       const data: FirewallRuleResponse = await getFirewallStatus();
-      setStatus(data.rules);
+      setStatus(data.raw ?? "");
     } catch (error) {
       console.error(error);
       setStatus("Error fetching status");
@@ -48,14 +49,24 @@ const FirewallDashboard: React.FC = () => {
   };
 
   useEffect(() => {
-    fetchStatus();
-    fetchBlockedDomains();
-    // Auto-refresh every 10 seconds
-    const interval = setInterval(() => {
-      fetchStatus();
-      fetchBlockedDomains();
-    }, 10000);
-    return () => clearInterval(interval);
+    // Live updates: a full snapshot on connect, then only changes
+    const unsubscribe = subscribeFirewallEvents({
+      onSnapshot: (snapshot) => {
+        setStatus(snapshot.status.raw ?? "");
+        setBlockedDomains(snapshot.blocked_domains);
+      },
+      // The status text is served from the backend's rule cache
+      onRulesChanged: () => fetchStatus(),
+      onDomainsBlocked: (domains) =>
+        setBlockedDomains((current) => Array.from(new Set([...current, ...domains])).sort()),
+      onDomainsUnblocked: (domains) =>
+        setBlockedDomains((current) => current.filter((d) => !domains.includes(d))),
+      onEmergencyStop: () => {
+        fetchStatus();
+        fetchBlockedDomains();
+      },
+    });
+    return unsubscribe;
   }, []);
 
   const handleToggleService = async (service: string, action: "on" | "off") => {
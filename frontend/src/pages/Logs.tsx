@@ -1,4 +1,4 @@
-import { useState } from "react";
+import { useCallback, useEffect, useMemo, useState } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
@@ -19,111 +19,36 @@ import {
   TableHeader,
   TableRow,
 } from "@/components/ui/table";
-import { FileText, Download, Filter, Search, Calendar, Shield } from "lucide-react";
+import { FileText, Download, Filter, Search, Calendar, Shield, History } from "lucide-react";
+import {
+  getHistory,
+  getLogs,
+  getTrafficStats,
+  HistoryEntry,
+  PacketLogEntry,
+  TrafficStatsResponse,
+} from "@/services/firewallAPI";
+
+const ACTION_LABELS: Record<PacketLogEntry["action"], string> = {
+  allow: "Allowed",
+  block: "Blocked",
+  audit: "Audit",
+  limit: "Rate limited",
+};
 
-interface LogEntry {
-  id: string;
-  timestamp: string;
-  sourceIp: string;
-  destIp: string;
-  protocol: string;
-  port: number;
-  action: "Allowed" | "Blocked";
-  bytes: number;
-  country: string;
-}
+const TIME_RANGES: Record<string, number> = {
+  "1h": 3600,
+  "24h": 86400,
+  "7d": 7 * 86400,
+  "30d": 30 * 86400,
+};
+
+const IP_PATTERN = /^[0-9a-fA-F:.]+$/;
 
 const Logs = () => {
-  const [logs] = useState<LogEntry[]>([
-    {
-      id: "1",
-      timestamp: "2024-01-20 14:32:15",
-      sourceIp: "192.168.1.100",
-      destIp: "8.8.8.8",
-      protocol: "UDP",
-      port: 53,
-      action: "Allowed",
-      bytes: 64,
-      country: "US"
-    },
-    {
-      id: "2", 
-      timestamp: "2024-01-20 14:31:42",
-      sourceIp: "203.0.113.45",
-      destIp: "192.168.1.10",
-      protocol: "TCP",
-      port: 22,
-      action: "Blocked",
-      bytes: 0,
-      country: "CN"
-    },
-    {
-      id: "3",
-      timestamp: "2024-01-20 14:30:18",
-      sourceIp: "192.168.1.50",
-      destIp: "140.82.114.4",
-      protocol: "TCP",
-      port: 443,
-      action: "Allowed",
-      bytes: 2048,
-      country: "US"
-    },
-    {
-      id: "4",
-      timestamp: "2024-01-20 14:29:33",
-      sourceIp: "198.51.100.23",
-      destIp: "192.168.1.10",
-      protocol: "TCP",
-      port: 80,
-      action: "Blocked",
-      bytes: 0,
-      country: "RU"
-    },
-    {
-      id: "5",
-      timestamp: "2024-01-20 14:28:55",
-      sourceIp: "192.168.1.20",
-      destIp: "172.217.14.142",
-      protocol: "TCP",
-      port: 443,
-      action: "Allowed",
-      bytes: 1536,
-      country: "US"
-    },
-    {
-      id: "6",
-      timestamp: "2024-01-20 14:27:12",
-      sourceIp: "10.0.0.15",
-      destIp: "1.1.1.1",
-      protocol: "UDP",
-      port: 53,
-      action: "Allowed",
-      bytes: 84,
-      country: "US"
-    },
-    {
-      id: "7",
-      timestamp: "2024-01-20 14:26:41",
-      sourceIp: "185.220.101.47",
-      destIp: "192.168.1.10",
-      protocol: "TCP",
-      port: 9050,
-      action: "Blocked",
-      bytes: 0,
-      country: "DE"
-    },
-    {
-      id: "8",
-      timestamp: "2024-01-20 14:25:03",
-      sourceIp: "192.168.1.75",
-      destIp: "13.107.42.14",
-      protocol: "TCP",
-      port: 443,
-      action: "Allowed",
-      bytes: 3072,
-      country: "US"
-    }
-  ]);
+  const [logs, setLogs] = useState<PacketLogEntry[]>([]);
+  const [logCursor, setLogCursor] = useState<number | null>(null);
+  const [logError, setLogError] = useState<string | null>(null);
 
   const [filters, setFilters] = useState({
     timeRange: "1h",
@@ -132,18 +57,105 @@ const Logs = () => {
     search: ""
   });
 
+  // The search box takes a port number or a full IP address (filtered by
+  // the backend); anything else matches IP substrings in the loaded page
+  const logFilters = useMemo(() => {
+    const search = filters.search.trim();
+    const port = /^\d+$/.test(search) ? Number(search) : undefined;
+    return {
+      proto: filters.protocol !== "all" ? filters.protocol.toLowerCase() : undefined,
+      action: filters.action !== "all" ? filters.action : undefined,
+      port,
+      ip: port === undefined && IP_PATTERN.test(search) && (search.includes(".") || search.includes(":"))
+        ? search : undefined,
+    };
+  }, [filters.protocol, filters.action, filters.search]);
+
+  const loadLogs = useCallback(async (before?: number) => {
+    try {
+      const page = await getLogs({ limit: 200, before, ...logFilters });
+      setLogs(prev => before ? [...prev, ...page.items] : page.items);
+      setLogCursor(page.next_before ?? null);
+      setLogError(null);
+    } catch (e) {
+      setLogError((e as Error).message);
+    }
+  }, [logFilters]);
+
+  useEffect(() => {
+    loadLogs();
+  }, [loadLogs]);
+
+  // Follow new packets while the page is open
+  useEffect(() => {
+    const timer = setInterval(async () => {
+      const newest = logs[0]?.seq;
+      if (newest === undefined) return loadLogs();
+      try {
+        const page = await getLogs({ limit: 1000, after: newest, ...logFilters });
+        if (page.items.length) setLogs(prev => [...page.items.reverse(), ...prev]);
+      } catch (e) {
+        setLogError((e as Error).message);
+      }
+    }, 5000);
+    return () => clearInterval(timer);
+  }, [logs, logFilters, loadLogs]);
+
   const filteredLogs = logs.filter(log => {
-    if (filters.protocol !== "all" && log.protocol !== filters.protocol) return false;
-    if (filters.action !== "all" && log.action !== filters.action) return false;
-    if (filters.search && !log.sourceIp.includes(filters.search) && !log.destIp.includes(filters.search)) return false;
+    if (log.ts < Date.now() / 1000 - TIME_RANGES[filters.timeRange]) return false;
+    const search = filters.search.trim();
+    if (search && logFilters.port === undefined && !logFilters.ip
+        && !(log.src ?? "").includes(search) && !(log.dst ?? "").includes(search)) return false;
     return true;
   });
 
+  const [traffic, setTraffic] = useState<TrafficStatsResponse | null>(null);
+
+  useEffect(() => {
+    const load = () => getTrafficStats(TIME_RANGES[filters.timeRange], 5)
+      .then(setTraffic)
+      .catch(() => setTraffic(null));
+    load();
+    const timer = setInterval(load, 30000);
+    return () => clearInterval(timer);
+  }, [filters.timeRange]);
+
+  const [history, setHistory] = useState<HistoryEntry[]>([]);
+  const [historyCursor, setHistoryCursor] = useState<number | null>(null);
+  const [historyResource, setHistoryResource] = useState("");
+  const [historyError, setHistoryError] = useState<string | null>(null);
+
+  const loadHistory = useCallback(async (before?: number) => {
+    try {
+      const page = await getHistory({ limit: 50, before, resource: historyResource || undefined });
+      setHistory(prev => before ? [...prev, ...page.items] : page.items);
+      setHistoryCursor(page.next_before);
+      setHistoryError(null);
+    } catch (e) {
+      setHistoryError((e as Error).message);
+    }
+  }, [historyResource]);
+
+  useEffect(() => {
+    loadHistory();
+  }, [loadHistory]);
+
+  const describeDiff = (entry: HistoryEntry) => {
+    const parts: string[] = [];
+    const rules = entry.diff?.rules;
+    const domains = entry.diff?.domains;
+    if (rules?.added?.count) parts.push(`+${rules.added.count} rules`);
+    if (rules?.removed?.count) parts.push(`-${rules.removed.count} rules`);
+    if (domains?.added?.count) parts.push(`+${domains.added.count} domains`);
+    if (domains?.removed?.count) parts.push(`-${domains.removed.count} domains`);
+    return parts.join(", ") || "-";
+  };
+
   const exportLogs = (format: "csv" | "json") => {
     const data = format === "csv" 
-      ? "Timestamp,Source IP,Destination IP,Protocol,Port,Action,Bytes,Country\n" +
-        filteredLogs.map(log => 
-          `${log.timestamp},${log.sourceIp},${log.destIp},${log.protocol},${log.port},${log.action},${log.bytes},${log.country}`
+      ? "Timestamp,Direction,Interface,Source IP,Source Port,Destination IP,Destination Port,Protocol,Action,Bytes\n" +
+        filteredLogs.map(log =>
+          `${new Date(log.ts * 1000).toISOString()},${log.direction},${log.interface ?? ""},${log.src ?? ""},${log.spt ?? ""},${log.dst ?? ""},${log.dpt ?? ""},${log.proto ?? ""},${log.action},${log.length ?? ""}`
         ).join("\n")
       : JSON.stringify(filteredLogs, null, 2);
     
@@ -184,7 +196,7 @@ const Logs = () => {
             <div className="flex items-center justify-between">
               <div>
                 <p className="text-muted-foreground text-sm font-medium">Total Connections</p>
-                <p className="text-foreground text-2xl font-bold">{logs.length}</p>
+                <p className="text-foreground text-2xl font-bold">{filteredLogs.length}</p>
               </div>
               <FileText className="h-8 w-8 text-primary" />
             </div>
@@ -197,7 +209,7 @@ const Logs = () => {
               <div>
                 <p className="text-muted-foreground text-sm font-medium">Allowed</p>
                 <p className="text-foreground text-2xl font-bold">
-                  {logs.filter(log => log.action === "Allowed").length}
+                  {filteredLogs.filter(log => log.action === "allow").length}
                 </p>
               </div>
               <Shield className="h-8 w-8 text-success" />
@@ -211,7 +223,7 @@ const Logs = () => {
               <div>
                 <p className="text-muted-foreground text-sm font-medium">Blocked</p>
                 <p className="text-foreground text-2xl font-bold">
-                  {logs.filter(log => log.action === "Blocked").length}
+                  {filteredLogs.filter(log => log.action === "block" || log.action === "limit").length}
                 </p>
               </div>
               <Shield className="h-8 w-8 text-destructive" />
@@ -225,7 +237,7 @@ const Logs = () => {
               <div>
                 <p className="text-muted-foreground text-sm font-medium">Data Transfer</p>
                 <p className="text-foreground text-2xl font-bold">
-                  {(logs.reduce((sum, log) => sum + log.bytes, 0) / 1024).toFixed(1)}KB
+                  {(filteredLogs.reduce((sum, log) => sum + (log.length ?? 0), 0) / 1024).toFixed(1)}KB
                 </p>
               </div>
               <Download className="h-8 w-8 text-accent" />
@@ -282,14 +294,16 @@ const Logs = () => {
                 </SelectTrigger>
                 <SelectContent>
                   <SelectItem value="all">All Actions</SelectItem>
-                  <SelectItem value="Allowed">Allowed</SelectItem>
-                  <SelectItem value="Blocked">Blocked</SelectItem>
+                  <SelectItem value="allow">Allowed</SelectItem>
+                  <SelectItem value="block">Blocked</SelectItem>
+                  <SelectItem value="limit">Rate limited</SelectItem>
+                  <SelectItem value="audit">Audit</SelectItem>
                 </SelectContent>
               </Select>
             </div>
             
             <div>
-              <Label htmlFor="search">Search IP</Label>
+              <Label htmlFor="search">Search IP or Port</Label>
               <div className="relative">
                 <Search className="absolute left-3 top-1/2 transform -translate-y-1/2 h-4 w-4 text-muted-foreground" />
                 <Input
@@ -305,6 +319,107 @@ const Logs = () => {
         </CardContent>
       </Card>
 
+      {/* Top Blocked */}
+      {traffic && (
+        <div className="grid grid-cols-1 md:grid-cols-3 gap-6">
+          {([
+            ["Top Blocked Sources", traffic.top.sources.map(s => [s.ip, s.count, s.domains.join(", ")])],
+            ["Top Blocked Ports", traffic.top.ports.map(p => [p.port, p.count, ""])],
+            ["Top Blocked Domains", traffic.top.domains.map(d => [d.domain, d.count, ""])],
+          ] as [string, [string, number, string][]][]).map(([title, rows]) => (
+            <Card key={title} className="shadow-card">
+              <CardHeader>
+                <CardTitle className="flex items-center gap-2">
+                  <Shield className="h-5 w-5 text-destructive" />
+                  {title}
+                </CardTitle>
+              </CardHeader>
+              <CardContent>
+                {rows.length === 0 && <p className="text-muted-foreground text-sm">Nothing blocked</p>}
+                {rows.map(([name, count, note]) => (
+                  <div key={name} className="flex justify-between py-1">
+                    <span className="font-mono text-sm" title={note || undefined}>{name}</span>
+                    <Badge variant="secondary">{count}</Badge>
+                  </div>
+                ))}
+              </CardContent>
+            </Card>
+          ))}
+        </div>
+      )}
+
+      {/* Change History */}
+      <Card className="shadow-card">
+        <CardHeader>
+          <CardTitle className="flex items-center justify-between gap-2">
+            <span className="flex items-center gap-2">
+              <History className="h-5 w-5 text-primary" />
+              Change History
+            </span>
+            <Input
+              placeholder="Resource, e.g. port:8080/tcp or domain:*"
+              value={historyResource}
+              onChange={(e) => setHistoryResource(e.target.value)}
+              className="max-w-xs"
+            />
+          </CardTitle>
+        </CardHeader>
+        <CardContent>
+          {historyError && <p className="text-destructive text-sm mb-2">{historyError}</p>}
+          <div className="overflow-x-auto">
+            <Table>
+              <TableHeader>
+                <TableRow>
+                  <TableHead>Time</TableHead>
+                  <TableHead>Change</TableHead>
+                  <TableHead>Endpoint</TableHead>
+                  <TableHead>Client</TableHead>
+                  <TableHead>Diff</TableHead>
+                  <TableHead>Processes</TableHead>
+                  <TableHead>Duration</TableHead>
+                  <TableHead>Outcome</TableHead>
+                </TableRow>
+              </TableHeader>
+              <TableBody>
+                {history.map((entry) => (
+                  <TableRow key={entry.id}>
+                    <TableCell className="font-mono text-sm">
+                      {new Date(entry.ts * 1000).toLocaleString()}
+                    </TableCell>
+                    <TableCell>
+                      <Badge variant="outline">{entry.kind}</Badge>
+                    </TableCell>
+                    <TableCell className="font-mono text-sm">{entry.endpoint ?? "-"}</TableCell>
+                    <TableCell className="font-mono">{entry.client ?? "-"}</TableCell>
+                    <TableCell className="text-sm">{describeDiff(entry)}</TableCell>
+                    <TableCell className="font-mono">{entry.processes ?? 0}</TableCell>
+                    <TableCell className="font-mono">
+                      {entry.duration != null ? `${(entry.duration * 1000).toFixed(0)}ms` : "-"}
+                    </TableCell>
+                    <TableCell>
+                      <Badge
+                        className={entry.outcome === "succeeded"
+                          ? "bg-success text-success-foreground"
+                          : "bg-destructive text-destructive-foreground"
+                        }
+                        title={entry.error ?? undefined}
+                      >
+                        {entry.outcome}
+                      </Badge>
+                    </TableCell>
+                  </TableRow>
+                ))}
+              </TableBody>
+            </Table>
+          </div>
+          {historyCursor !== null && (
+            <Button variant="outline" className="mt-4" onClick={() => loadHistory(historyCursor)}>
+              Load more
+            </Button>
+          )}
+        </CardContent>
+      </Card>
+
       {/* Logs Table */}
       <Card className="shadow-card">
         <CardHeader>
@@ -314,6 +429,7 @@ const Logs = () => {
           </CardTitle>
         </CardHeader>
         <CardContent>
+          {logError && <p className="text-destructive text-sm mb-2">{logError}</p>}
           <div className="overflow-x-auto">
             <Table>
               <TableHeader>
@@ -325,38 +441,45 @@ const Logs = () => {
                   <TableHead>Port</TableHead>
                   <TableHead>Action</TableHead>
                   <TableHead>Bytes</TableHead>
-                  <TableHead>Country</TableHead>
+                  <TableHead>Direction</TableHead>
                 </TableRow>
               </TableHeader>
               <TableBody>
                 {filteredLogs.map((log) => (
-                  <TableRow key={log.id}>
-                    <TableCell className="font-mono text-sm">{log.timestamp}</TableCell>
-                    <TableCell className="font-mono">{log.sourceIp}</TableCell>
-                    <TableCell className="font-mono">{log.destIp}</TableCell>
+                  <TableRow key={log.seq}>
+                    <TableCell className="font-mono text-sm">
+                      {new Date(log.ts * 1000).toLocaleString()}
+                    </TableCell>
+                    <TableCell className="font-mono">{log.src ?? "-"}</TableCell>
+                    <TableCell className="font-mono">{log.dst ?? "-"}</TableCell>
                     <TableCell>
-                      <Badge variant="outline">{log.protocol}</Badge>
+                      <Badge variant="outline">{(log.proto ?? "-").toUpperCase()}</Badge>
                     </TableCell>
-                    <TableCell className="font-mono">{log.port}</TableCell>
+                    <TableCell className="font-mono">{log.dpt ?? "-"}</TableCell>
                     <TableCell>
-                      <Badge 
-                        className={log.action === "Allowed" 
-                          ? "bg-success text-success-foreground" 
+                      <Badge
+                        className={log.action === "allow"
+                          ? "bg-success text-success-foreground"
                           : "bg-destructive text-destructive-foreground"
                         }
                       >
-                        {log.action}
+                        {ACTION_LABELS[log.action]}
                       </Badge>
                     </TableCell>
-                    <TableCell className="font-mono">{log.bytes}B</TableCell>
+                    <TableCell className="font-mono">{log.length ?? 0}B</TableCell>
                     <TableCell>
-                      <Badge variant="secondary">{log.country}</Badge>
+                      <Badge variant="secondary">{log.direction}{log.interface ? ` (${log.interface})` : ""}</Badge>
                     </TableCell>
                   </TableRow>
                 ))}
               </TableBody>
             </Table>
           </div>
+          {logCursor !== null && (
+            <Button variant="outline" className="mt-4" onClick={() => loadLogs(logCursor)}>
+              Load more
+            </Button>
+          )}
         </CardContent>
       </Card>
     </div>
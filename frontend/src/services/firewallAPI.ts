@@ -1,5 +1,36 @@
+export interface FirewallRule {
+  number: number;
+  action: string;
+  direction: string;
+  to_address: string | null;
+  to_port: string | null;
+  from_address: string | null;
+  from_port: string | null;
+  proto: string;
+  app: string | null;
+  interface: string | null;
+  ipv6: boolean;
+  log: boolean;
+  comment: string | null;
+}
+
 export interface FirewallRuleResponse {
-  rules: string;
+  active: boolean | null;
+  rules: FirewallRule[];
+  total: number;
+  generation: number;
+  fetched_at: number;
+  age?: number;
+  error?: string;
+  raw?: string;
+}
+
+export interface BatchStats {
+  operations: number;
+  rules_added: number;
+  rules_removed: number;
+  processes: number;
+  reloads: number;
 }
 
 export interface FirewallActionResponse {
@@ -22,26 +53,30 @@ export interface FirewallActionResponse {
   success?: boolean;
   warning?: string;
   protocol?: string;
+  batch?: BatchStats;
 }
 
 export interface BlockedDomainsResponse {
   status: string;
   blocked_domains: string[];
   total: number;
+  offset?: number;
+  limit?: number;
+  next_offset?: number | null;
 }
 
 const API_BASE = "http://127.0.0.1:8000/api/firewall";
 
 // Get firewall status
 export async function getFirewallStatus(): Promise<FirewallRuleResponse> {
-  const res = await fetch(`${API_BASE}/status`);
+  const res = await fetch(`${API_BASE}/status?raw=true`);
   if (!res.ok) throw new Error("Failed to fetch firewall status");
   return res.json();
 }
 
 // Toggle service (http, https, ssh, etc.)
 export async function toggleService(service: string, action: "on" | "off"): Promise<FirewallActionResponse> {
-  const res = await fetch(`${API_BASE}/${service}/${action}`, {
+  const res = await fetch(`${API_BASE}/${service}/${action}?wait=true`, {
     method: "POST",
   });
   if (!res.ok) throw new Error(`Failed to toggle service ${service}`);
@@ -50,7 +85,7 @@ export async function toggleService(service: string, action: "on" | "off"): Prom
 
 // Toggle port (allow/deny)
 export async function togglePort(port: number, action: "on" | "off"): Promise<FirewallActionResponse> {
-  const res = await fetch(`${API_BASE}/port/${port}/${action}`, {
+  const res = await fetch(`${API_BASE}/port/${port}/${action}?wait=true`, {
     method: "POST",
   });
   
@@ -67,7 +102,7 @@ export async function togglePort(port: number, action: "on" | "off"): Promise<Fi
 
 // Block or unblock a domain
 export async function controlDomain(domain: string, action: "block" | "unblock"): Promise<FirewallActionResponse> {
-  const res = await fetch(`${API_BASE}/domain/${domain}/${action}`, {
+  const res = await fetch(`${API_BASE}/domain/${domain}/${action}?wait=true`, {
     method: "POST",
   });
   if (!res.ok) throw new Error(`Failed to ${action} domain ${domain}`);
@@ -83,9 +118,171 @@ export async function getBlockedDomains(): Promise<BlockedDomainsResponse> {
 
 // Emergency Stop - Reset all firewall rules
 export async function emergencyStop(): Promise<FirewallActionResponse> {
-  const res = await fetch(`${API_BASE}/emergency-stop`, {
+  const res = await fetch(`${API_BASE}/emergency-stop?wait=true`, {
     method: "POST",
   });
   if (!res.ok) throw new Error("Failed to execute emergency stop");
   return res.json();
 }
+
+export interface HistoryDiffPart {
+  count: number;
+  items: unknown[];
+  truncated?: boolean;
+}
+
+export interface HistoryEntry {
+  id: number;
+  ts: number;
+  started_at: number | null;
+  duration: number | null;
+  kind: string;
+  endpoint: string | null;
+  client: string | null;
+  params: Record<string, unknown> | null;
+  resources: string[] | null;
+  diff: {
+    rules?: { added?: HistoryDiffPart; removed?: HistoryDiffPart; reset?: boolean };
+    domains?: { added?: HistoryDiffPart; removed?: HistoryDiffPart; reset?: boolean };
+  } | null;
+  processes: number | null;
+  outcome: string;
+  error: string | null;
+  job_id: string | null;
+}
+
+export interface HistoryResponse {
+  items: HistoryEntry[];
+  next_before: number | null;
+  limit: number;
+}
+
+export interface HistoryFilters {
+  limit?: number;
+  before?: number;
+  since?: number;
+  until?: number;
+  kind?: string;
+  resource?: string;
+  outcome?: string;
+}
+
+// Audit log of firewall changes, newest first (page with next_before)
+export async function getHistory(filters: HistoryFilters = {}): Promise<HistoryResponse> {
+  const params = new URLSearchParams();
+  Object.entries(filters).forEach(([key, value]) => {
+    if (value !== undefined && value !== "") params.set(key, String(value));
+  });
+  const res = await fetch(`${API_BASE}/history?${params}`);
+  if (!res.ok) throw new Error("Failed to fetch change history");
+  return res.json();
+}
+
+export interface PacketLogEntry {
+  seq: number;
+  ts: number;
+  action: "block" | "allow" | "audit" | "limit";
+  direction: "in" | "out" | "fwd";
+  interface: string | null;
+  src: string | null;
+  dst: string | null;
+  proto: string | null;
+  spt: number | null;
+  dpt: number | null;
+  length: number | null;
+}
+
+export interface PacketLogResponse {
+  items: PacketLogEntry[];
+  next_before?: number | null;
+  next_after?: number;
+  last_seq: number;
+  limit: number;
+}
+
+export interface PacketLogFilters {
+  limit?: number;
+  before?: number;
+  after?: number;
+  ip?: string;
+  port?: number;
+  action?: string;
+  direction?: string;
+  proto?: string;
+}
+
+// Packets logged by UFW, newest first (page with next_before)
+export async function getLogs(filters: PacketLogFilters = {}): Promise<PacketLogResponse> {
+  const params = new URLSearchParams();
+  Object.entries(filters).forEach(([key, value]) => {
+    if (value !== undefined && value !== "") params.set(key, String(value));
+  });
+  const res = await fetch(`${API_BASE}/logs?${params}`);
+  if (!res.ok) throw new Error("Failed to fetch firewall logs");
+  return res.json();
+}
+
+export interface TrafficTotals {
+  packets: number;
+  blocked: number;
+  allowed: number;
+  bytes: number;
+}
+
+export interface TrafficStatsResponse {
+  window: number;
+  resolution: "minute" | "hour" | "day";
+  from: number;
+  totals: TrafficTotals;
+  top: {
+    sources: { ip: string; count: number; domains: string[] }[];
+    ports: { port: string; count: number }[];
+    domains: { domain: string; count: number }[];
+  };
+  error: { sources: number; ports: number; domains: number };
+  series: (TrafficTotals & { ts: number })[];
+}
+
+// Totals, top blocked sources / ports / domains and a time series
+// over the last `window` seconds
+export async function getTrafficStats(window = 3600, top = 10): Promise<TrafficStatsResponse> {
+  const res = await fetch(`${API_BASE}/stats?window=${window}&top=${top}`);
+  if (!res.ok) throw new Error("Failed to fetch traffic statistics");
+  return res.json();
+}
+
+export interface FirewallEventsSnapshot {
+  status: FirewallRuleResponse;
+  blocked_domains: string[];
+  blocked_total: number;
+  hosts_generation: number;
+}
+
+export interface FirewallEventHandlers {
+  onSnapshot: (snapshot: FirewallEventsSnapshot) => void;
+  onRulesChanged?: (added: FirewallRule[], removed: FirewallRule[]) => void;
+  onDomainsBlocked?: (domains: string[]) => void;
+  onDomainsUnblocked?: (domains: string[]) => void;
+  onEmergencyStop?: () => void;
+}
+
+// Subscribe to live rule / blocklist changes (Server-Sent Events).
+// Returns a function that closes the stream.
+export function subscribeFirewallEvents(handlers: FirewallEventHandlers): () => void {
+  const source = new EventSource(`${API_BASE}/events`);
+  const parse = (event: MessageEvent) => JSON.parse(event.data);
+
+  source.addEventListener("snapshot", (e) => handlers.onSnapshot(parse(e as MessageEvent)));
+  source.addEventListener("rule_added", (e) =>
+    handlers.onRulesChanged?.(parse(e as MessageEvent).rules, []));
+  source.addEventListener("rule_removed", (e) =>
+    handlers.onRulesChanged?.([], parse(e as MessageEvent).rules));
+  source.addEventListener("status_changed", () => handlers.onRulesChanged?.([], []));
+  source.addEventListener("domain_blocked", (e) =>
+    handlers.onDomainsBlocked?.(parse(e as MessageEvent).domains));
+  source.addEventListener("domain_unblocked", (e) =>
+    handlers.onDomainsUnblocked?.(parse(e as MessageEvent).domains));
+  source.addEventListener("emergency_stop", () => handlers.onEmergencyStop?.());
+
+  return () => source.close();
+}
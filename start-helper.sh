@@ -0,0 +1,5 @@
+#!/bin/bash
+
+# Start the privileged helper (runs as root, serves whitelisted firewall operations
+# to the backend over a Unix socket so it does not need sudo for every rule)
+cd /home/kali/cyberProject/cyber_sec && sudo .venv/bin/python -m backend.helper_daemon --user "$USER"
@@ -56,21 +56,21 @@ echo ""
 # Test Service Control
 echo "4️⃣  Testing Service Control API..."
 echo "   POST /api/firewall/http/on"
-RESPONSE=$(curl -s -X POST http://localhost:8000/api/firewall/http/on)
+RESPONSE=$(curl -s -X POST http://localhost:8000/api/firewall/http/on?wait=true)
 echo "   Response: $RESPONSE"
 echo ""
 
 # Test Port Control
 echo "5️⃣  Testing Port Control API..."
 echo "   POST /api/firewall/port/9999/off"
-RESPONSE=$(curl -s -X POST http://localhost:8000/api/firewall/port/9999/off)
+RESPONSE=$(curl -s -X POST http://localhost:8000/api/firewall/port/9999/off?wait=true)
 echo "   Response: $RESPONSE"
 echo ""
 
 # Test Domain Control
 echo "6️⃣  Testing Domain Control API..."
 echo "   POST /api/firewall/domain/example.com/block"
-RESPONSE=$(curl -s -X POST http://localhost:8000/api/firewall/domain/example.com/block)
+RESPONSE=$(curl -s -X POST http://localhost:8000/api/firewall/domain/example.com/block?wait=true)
 echo "   Response: $RESPONSE"
 echo ""
 
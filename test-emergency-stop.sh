@@ -27,7 +27,7 @@ echo -e "${YELLOW}Step 1: Adding test firewall rules...${NC}"
 
 # Block a test port
 echo -n "  - Blocking port 9999... "
-response=$(curl -s -X POST "$API_URL/api/firewall/port/9999/off")
+response=$(curl -s -X POST "$API_URL/api/firewall/port/9999/off?wait=true")
 if [[ $response == *"success"* ]]; then
     echo -e "${GREEN}✓${NC}"
 else
@@ -37,7 +37,7 @@ fi
 
 # Block HTTP
 echo -n "  - Blocking HTTP... "
-response=$(curl -s -X POST "$API_URL/api/firewall/http/off")
+response=$(curl -s -X POST "$API_URL/api/firewall/http/off?wait=true")
 echo -e "${GREEN}✓${NC}"
 
 echo ""
@@ -49,8 +49,8 @@ echo ""
 echo -e "${RED}Step 2: Executing EMERGENCY STOP...${NC}"
 echo -n "  - Sending emergency stop command... "
 
-response=$(curl -s -X POST "$API_URL/api/firewall/emergency-stop")
-http_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "$API_URL/api/firewall/emergency-stop")
+response=$(curl -s -X POST "$API_URL/api/firewall/emergency-stop?wait=true")
+http_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "$API_URL/api/firewall/emergency-stop?wait=true")
 
 if [ "$http_code" = "200" ]; then
     echo -e "${GREEN}✓${NC}"
@@ -32,7 +32,7 @@ test_case() {
     echo -e "${BLUE}[TEST $TOTAL]${NC} $test_name"
     echo "  Request: POST /api/firewall/port/$port/$action"
     
-    response=$(curl -s -w "\nHTTP_CODE:%{http_code}" -X POST "$API_URL/api/firewall/port/$port/$action")
+    response=$(curl -s -w "\nHTTP_CODE:%{http_code}" -X POST "$API_URL/api/firewall/port/$port/$action?wait=true")
     http_code=$(echo "$response" | grep "HTTP_CODE:" | cut -d: -f2)
     body=$(echo "$response" | sed '/HTTP_CODE:/d')
     
@@ -23,8 +23,8 @@ test_port() {
     
     echo -n "Testing: $test_name (port=$port, action=$action)... "
     
-    response=$(curl -s -X POST "$API_URL/api/firewall/port/$port/$action" 2>&1)
-    http_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "$API_URL/api/firewall/port/$port/$action" 2>&1)
+    response=$(curl -s -X POST "$API_URL/api/firewall/port/$port/$action?wait=true" 2>&1)
+    http_code=$(curl -s -o /dev/null -w "%{http_code}" -X POST "$API_URL/api/firewall/port/$port/$action?wait=true" 2>&1)
     
     if [ "$should_succeed" = "yes" ]; then
         if [ "$http_code" = "200" ]; then
@@ -76,7 +76,7 @@ echo ""
 echo "=== Testing Invalid Actions ==="
 # Note: FastAPI will reject invalid actions before reaching our code
 echo "Testing invalid action 'invalid' on port 1234..."
-response=$(curl -s -X POST "$API_URL/api/firewall/port/1234/invalid" 2>&1)
+response=$(curl -s -X POST "$API_URL/api/firewall/port/1234/invalid?wait=true" 2>&1)
 echo "Response: $response"
 echo ""
 